@@ -0,0 +1,275 @@
+"""
+Vectorized audio helpers for 16-bit PCM WAV files (numpy).
+
+- `read_wav_memmap`: zero-copy view of the samples of a WAV file
+- `detect_speech_frames`: energy + spectral-flatness VAD over fixed frames
+- `trim_silence`: cut long silent spans and keep an `OffsetMap` back to the original timeline
+- `write_wav_slice`: copy a time range of a recording into its own WAV file
+- `compute_peaks` / `build_peaks_file`: multi-resolution min/max waveform peaks in a compact binary file
+"""
+import bisect
+import json
+import os
+import struct
+import wave
+
+import numpy as np
+
+def read_wav_memmap(path: str) -> tuple[np.ndarray, int]:
+    """Return (int16 samples of channel 0 as a memmap, sample_rate) without loading the file."""
+    with open(path, "rb") as f:
+        riff, _, fmt = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or fmt != b"WAVE":
+            raise ValueError(f"Not a WAV file: {path}")
+        channels = sample_rate = bits = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in WAV file: {path}")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt_chunk = f.read(size)
+                _, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt_chunk[:16])
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), 1)
+    if bits != 16:
+        raise ValueError(f"Only 16-bit PCM is supported, got {bits}-bit: {path}")
+
+    file_size = _file_size(path)
+    # Streaming writers may leave 0 / 0xFFFFFFFF as the data size; trust the file length instead
+    size = min(size, file_size - offset) if size else file_size - offset
+    frames = size // (2 * channels)
+    if frames == 0:
+        return np.zeros(0, dtype=np.int16), sample_rate
+    samples = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels))
+    return samples[:, 0], sample_rate
+
+def _file_size(path: str) -> int:
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        return f.tell()
+
+def detect_speech_frames(
+    samples: np.ndarray,
+    sample_rate: int,
+    frame_ms: int = 30,
+    margin_db: float = 10.0,
+    min_level_db: float = -60.0,
+    flatness_threshold: float = 0.5,
+    block_frames: int = 8192,
+) -> np.ndarray:
+    """
+    Boolean speech mask, one entry per `frame_ms` frame.
+
+    A frame counts as speech when its RMS level is `margin_db` above the noise floor
+    (10th percentile of frame levels) and it is not spectrally flat (broadband noise),
+    or when it is clearly loud regardless of flatness.
+    """
+    frame_len = int(sample_rate * frame_ms / 1000)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+
+    levels = np.empty(n_frames, dtype=np.float32)
+    flatness = np.empty(n_frames, dtype=np.float32)
+    window = np.hanning(frame_len).astype(np.float32)
+    # Process in blocks so multi-hour recordings never materialize a full spectrogram
+    for start in range(0, n_frames, block_frames):
+        stop = min(n_frames, start + block_frames)
+        frames = np.asarray(samples[start * frame_len:stop * frame_len], dtype=np.float32).reshape(-1, frame_len) / 32768.0
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        levels[start:stop] = 20 * np.log10(rms + 1e-10)
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+        flatness[start:stop] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+
+    noise_floor = float(np.percentile(levels, 10))
+    threshold = max(noise_floor + margin_db, min_level_db)
+    loud = levels > threshold
+    return (loud & (flatness < flatness_threshold)) | (levels > threshold + margin_db)
+
+class OffsetMap:
+    """Maps times in the compacted audio back to the original recording (both in ms)."""
+
+    def __init__(self, spans: list[tuple[int, int, int]]):
+        # (compact_start_ms, original_start_ms, duration_ms), sorted by compact_start_ms
+        self.spans = spans
+        self._starts = [span[0] for span in spans]
+
+    def remap(self, ms):
+        if ms is None or not self.spans:
+            return ms
+        i = max(0, bisect.bisect_right(self._starts, ms) - 1)
+        compact_start, original_start, duration = self.spans[i]
+        return original_start + min(max(0, ms - compact_start), duration)
+
+    def remap_sentences(self, sentences: list[dict]) -> list[dict]:
+        for sent in sentences:
+            if not isinstance(sent, dict):
+                continue
+            for key in ("begin_time", "end_time"):
+                if sent.get(key) is not None:
+                    sent[key] = self.remap(sent[key])
+            for word in sent.get("words") or []:
+                if isinstance(word, dict):
+                    for key in ("begin_time", "end_time"):
+                        if word.get(key) is not None:
+                            word[key] = self.remap(word[key])
+        return sentences
+
+    @property
+    def removed_ms(self) -> int:
+        if not self.spans:
+            return 0
+        compact_start, original_start, _ = self.spans[-1]
+        return original_start - compact_start
+
+    def to_json(self) -> str:
+        return json.dumps(self.spans)
+
+    @classmethod
+    def from_json(cls, data: str) -> "OffsetMap":
+        return cls([tuple(span) for span in json.loads(data)])
+
+def trim_silence(
+    input_path: str,
+    output_path: str,
+    min_silence_ms: int = 2000,
+    keep_ms: int = 300,
+    frame_ms: int = 30,
+) -> OffsetMap | None:
+    """
+    Write a compacted copy of `input_path` with silent spans longer than `min_silence_ms` removed
+    (keeping `keep_ms` of context on each side). Returns None when nothing worth cutting was found.
+    """
+    samples, sample_rate = read_wav_memmap(input_path)
+    speech = detect_speech_frames(samples, sample_rate, frame_ms=frame_ms)
+    if not speech.any():
+        return None
+
+    # Dilate speech by keep_ms on each side so cuts never clip word onsets/offsets
+    pad = max(1, keep_ms // frame_ms)
+    keep = np.convolve(speech.astype(np.int32), np.ones(2 * pad + 1, dtype=np.int32), mode="same") > 0
+
+    # Run-length encode the keep mask and drop only silent runs above the threshold
+    edges = np.flatnonzero(np.diff(keep.astype(np.int8))) + 1
+    starts = np.concatenate(([0], edges))
+    ends = np.concatenate((edges, [len(keep)]))
+    min_silence_frames = min_silence_ms // frame_ms
+    cut = ~keep[starts] & ((ends - starts) >= min_silence_frames)
+    if not cut.any():
+        return None
+
+    frame_len = int(sample_rate * frame_ms / 1000)
+    kept_runs = []
+    for start, end, is_cut in zip(starts, ends, cut):
+        if is_cut:
+            continue
+        # Merge with the previous run when only a short (kept) silence separated them
+        if kept_runs and kept_runs[-1][1] == start:
+            kept_runs[-1][1] = end
+        else:
+            kept_runs.append([start, end])
+    # Keep the sub-frame tail of the file attached to the last run
+    total_samples = len(samples)
+    spans, compact_samples = [], 0
+    with wave.open(output_path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        for start, end in kept_runs:
+            s0 = int(start) * frame_len
+            s1 = total_samples if end == len(keep) else int(end) * frame_len
+            out.writeframes(np.ascontiguousarray(samples[s0:s1]).tobytes())
+            spans.append((
+                compact_samples * 1000 // sample_rate,
+                s0 * 1000 // sample_rate,
+                (s1 - s0) * 1000 // sample_rate,
+            ))
+            compact_samples += s1 - s0
+    return OffsetMap(spans)
+
+def write_wav_slice(samples: np.ndarray, sample_rate: int, start_ms: int, end_ms: int, path: str, block_samples: int = 1 << 20) -> None:
+    s0 = start_ms * sample_rate // 1000
+    s1 = min(len(samples), end_ms * sample_rate // 1000)
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        for start in range(s0, s1, block_samples):
+            out.writeframes(np.ascontiguousarray(samples[start:min(s1, start + block_samples)]).tobytes())
+
+# --- Waveform peaks ---
+# Binary layout (little endian):
+#   b"PEAK" | u16 version | u32 sample_rate | u64 total_samples | u16 level_count
+#   level_count x (u32 samples_per_peak | u32 peak_count | u64 byte_offset)
+#   level data: int8 pairs (min, max) per peak, scaled from int16 by 1/256
+
+PEAKS_MAGIC = b"PEAK"
+PEAKS_LEVELS = (256, 1024, 4096, 16384, 65536)
+_PEAKS_HEADER = struct.Struct("<4sHIQH")
+_PEAKS_LEVEL = struct.Struct("<IIQ")
+
+def compute_peaks(samples: np.ndarray, levels=PEAKS_LEVELS, block_samples: int = 1 << 22) -> dict[int, np.ndarray]:
+    """
+    Multi-resolution (min, max) peaks as {samples_per_peak: int8 array of shape (n, 2)}.
+    Only the finest level touches the audio; coarser levels are reduced from it.
+    """
+    levels = sorted(levels)
+    base = levels[0]
+    if any(level % base for level in levels):
+        raise ValueError("Peak levels must be multiples of the finest level")
+
+    n_peaks = -(-len(samples) // base)
+    mins = np.empty(n_peaks, dtype=np.int16)
+    maxs = np.empty(n_peaks, dtype=np.int16)
+    block_samples -= block_samples % base
+    for start in range(0, len(samples), block_samples):
+        block = np.asarray(samples[start:start + block_samples])
+        pad = (-len(block)) % base
+        if pad: # Pad the tail with its own edge value so it does not invent a zero crossing
+            block = np.concatenate((block, np.full(pad, block[-1], dtype=block.dtype)))
+        frames = block.reshape(-1, base)
+        first = start // base
+        mins[first:first + len(frames)] = frames.min(axis=1)
+        maxs[first:first + len(frames)] = frames.max(axis=1)
+
+    peaks = {}
+    for level in levels:
+        factor = level // base
+        count = -(-n_peaks // factor)
+        pad = count * factor - n_peaks
+        lvl_min = np.concatenate((mins, np.full(pad, mins[-1] if n_peaks else 0, dtype=np.int16))).reshape(count, factor).min(axis=1)
+        lvl_max = np.concatenate((maxs, np.full(pad, maxs[-1] if n_peaks else 0, dtype=np.int16))).reshape(count, factor).max(axis=1)
+        peaks[level] = np.stack(((lvl_min >> 8).astype(np.int8), (lvl_max >> 8).astype(np.int8)), axis=1)
+    return peaks
+
+def write_peaks_file(path: str, sample_rate: int, total_samples: int, peaks: dict[int, np.ndarray]) -> None:
+    levels = sorted(peaks)
+    offset = _PEAKS_HEADER.size + _PEAKS_LEVEL.size * len(levels)
+    table = []
+    for level in levels:
+        table.append(_PEAKS_LEVEL.pack(level, len(peaks[level]), offset))
+        offset += peaks[level].nbytes
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PEAKS_HEADER.pack(PEAKS_MAGIC, 1, sample_rate, total_samples, len(levels)))
+        f.write(b"".join(table))
+        for level in levels:
+            f.write(np.ascontiguousarray(peaks[level]).tobytes())
+    os.replace(tmp_path, path)
+
+def read_peaks_index(path: str) -> tuple[int, int, list[tuple[int, int, int]]]:
+    """Return (sample_rate, total_samples, [(samples_per_peak, peak_count, byte_offset), ...])."""
+    with open(path, "rb") as f:
+        magic, _, sample_rate, total_samples, level_count = _PEAKS_HEADER.unpack(f.read(_PEAKS_HEADER.size))
+        if magic != PEAKS_MAGIC:
+            raise ValueError(f"Not a peaks file: {path}")
+        levels = [_PEAKS_LEVEL.unpack(f.read(_PEAKS_LEVEL.size)) for _ in range(level_count)]
+    return sample_rate, total_samples, levels
+
+def build_peaks_file(wav_path: str, peaks_path: str) -> None:
+    samples, sample_rate = read_wav_memmap(wav_path)
+    write_peaks_file(peaks_path, sample_rate, len(samples), compute_peaks(samples))
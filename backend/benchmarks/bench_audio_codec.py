@@ -0,0 +1,90 @@
+"""
+Compare WAV / FLAC / Opus as the storage + transport codec.
+
+Reports encode time and disk footprint for each codec; with --upload also the
+OSS upload time, and with --asr the FunASR turnaround (both need .env creds).
+
+Usage (from backend/):
+    python benchmarks/bench_audio_codec.py path/to/meeting_mono.wav [--upload] [--asr]
+    python benchmarks/bench_audio_codec.py --synthetic-minutes 30
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def synthesize_speechlike_wav(path: str, minutes: float, sample_rate: int = 16000) -> None:
+    """Amplitude-modulated harmonics with pauses: compresses roughly like real speech, unlike noise."""
+    rng = np.random.default_rng(0)
+    with wave.open(path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        for _ in range(int(minutes * 60)):
+            t = np.arange(sample_rate) / sample_rate
+            f0 = rng.uniform(100, 250)
+            voiced = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6))
+            envelope = np.clip(np.sin(2 * np.pi * rng.uniform(2, 5) * t), 0, None) * (rng.random() > 0.2)
+            signal = 0.2 * voiced * envelope + rng.normal(0, 0.003, sample_rate)
+            out.writeframes((np.clip(signal, -1, 1) * 32767).astype(np.int16).tobytes())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wav", nargs="?", help="16 kHz mono WAV (e.g. an uploads/*_mono.wav)")
+    parser.add_argument("--synthetic-minutes", type=float, default=10, help="length of generated audio if no WAV given")
+    parser.add_argument("--codecs", default="wav,flac,opus")
+    parser.add_argument("--upload", action="store_true", help="measure OSS upload time")
+    parser.add_argument("--asr", action="store_true", help="measure FunASR turnaround (implies --upload)")
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg"):
+        sys.exit("ffmpeg is required")
+
+    import main as backend # Loads .env, OSS and DashScope config
+
+    workdir = tempfile.mkdtemp(prefix="codec_bench_")
+    source = args.wav
+    if not source:
+        source = os.path.join(workdir, "synthetic_mono.wav")
+        synthesize_speechlike_wav(source, args.synthetic_minutes)
+    with wave.open(source, "rb") as w:
+        audio_seconds = w.getnframes() / w.getframerate()
+
+    print(f"source: {source} ({audio_seconds / 60:.1f} min, {os.path.getsize(source) / 1e6:.1f} MB)")
+    print(f"{'codec':<6} {'encode s':>9} {'size MB':>9} {'MB/hour':>9} {'ratio':>7} {'upload s':>9} {'asr s':>8}")
+    wav_size = os.path.getsize(source)
+    for codec in [c.strip() for c in args.codecs.split(",") if c.strip()]:
+        # Fresh copy per codec so encode_for_transport never hits its cache
+        wav_copy = os.path.join(workdir, f"bench_{codec}.wav")
+        shutil.copy(source, wav_copy)
+        started = time.perf_counter()
+        encoded = backend.encode_for_transport(wav_copy, codec=codec)
+        encode_s = time.perf_counter() - started
+        size = os.path.getsize(encoded)
+
+        upload_s = asr_s = float("nan")
+        if args.upload or args.asr:
+            file_hash = backend.calculate_file_hash_from_file(encoded)
+            started = time.perf_counter()
+            url = backend.upload_to_oss(encoded, f"codec_bench{os.path.splitext(encoded)[1]}", file_hash)
+            upload_s = time.perf_counter() - started
+            if args.asr:
+                started = time.perf_counter()
+                backend.transcribe_with_fun_asr(url)
+                asr_s = time.perf_counter() - started
+
+        print(
+            f"{codec:<6} {encode_s:>9.2f} {size / 1e6:>9.2f} {size / 1e6 * 3600 / audio_seconds:>9.1f} "
+            f"{size / wav_size:>7.2f} {upload_s:>9.2f} {asr_s:>8.2f}"
+        )
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Microbenchmarks for the JSON hot paths: stdlib `json` vs the `jsoncodec` layer.
+
+Usage (from backend/):
+    python benchmarks/bench_json.py [--number 2000]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jsoncodec
+
+def build_cases() -> list[tuple[str, callable, callable]]:
+    # 100 ms of 16 kHz 16-bit mono PCM, as sent by the frontend per frame
+    audio_event = {
+        "event_id": "event_1700000000000",
+        "type": "input_audio_buffer.append",
+        "audio": base64.b64encode(os.urandom(3200)).decode("utf-8"),
+    }
+    upstream_message = json.dumps({
+        "event_id": "event_abc",
+        "type": "response.audio_transcript.done",
+        "transcript": "我们下周一之前需要把接口文档定下来，然后再安排联调。" * 2,
+    }, ensure_ascii=False)
+    frontend_payload = {
+        "type": "transcript",
+        "text": "我们下周一之前需要把接口文档定下来",
+        "is_final": True,
+        "speaker": None,
+    }
+    detail_payload = {
+        "id": "1",
+        "title": "产品周会",
+        "segments": [
+            {
+                "id": f"seg-{i}",
+                "type": "user",
+                "content": "这个需求的优先级我们还需要再讨论一下，先把风险列出来。",
+                "startTime": "12:34",
+                "endTime": "12:40",
+                "speaker": f"Speaker {i % 4}",
+                "speakerId": i % 4,
+                "emotion": None,
+            }
+            for i in range(3000)
+        ],
+        "analysis_result": {"mode": "full_summary", "qa_pairs": [{"q": "问题", "a": "回答"}] * 50},
+    }
+    analysis_blob = json.dumps(
+        {"chapters": [{"title": "章节", "start": "00:00", "summary": "本章讨论了排期与风险。" * 5}] * 40},
+        ensure_ascii=False,
+    )
+
+    return [
+        ("send_audio dumps (3.2 KB PCM)",
+         lambda: json.dumps(audio_event),
+         lambda: jsoncodec.dumps(audio_event)),
+        ("on_message loads",
+         lambda: json.loads(upstream_message),
+         lambda: jsoncodec.loads(upstream_message)),
+        ("_send_to_frontend dumps",
+         lambda: json.dumps(frontend_payload),
+         lambda: jsoncodec.dumps(frontend_payload)),
+        ("meeting detail render (3000 segments)",
+         lambda: json.dumps(detail_payload, ensure_ascii=False).encode("utf-8"),
+         lambda: jsoncodec.dumps_bytes(detail_payload)),
+        ("analysis blob loads",
+         lambda: json.loads(analysis_blob),
+         lambda: jsoncodec.loads(analysis_blob)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="iterations per case")
+    args = parser.parse_args()
+
+    print(f"jsoncodec backend: {jsoncodec.BACKEND}")
+    print(f"{'case':<40} {'stdlib us':>10} {'codec us':>10} {'saved us':>10} {'speedup':>8}")
+    for name, baseline, candidate in build_cases():
+        # Detail render is ~1000x larger than a realtime message, scale iterations down
+        number = max(10, args.number // 100) if "detail" in name else args.number
+        base_us = min(timeit.repeat(baseline, number=number, repeat=5)) / number * 1e6
+        cand_us = min(timeit.repeat(candidate, number=number, repeat=5)) / number * 1e6
+        print(f"{name:<40} {base_us:>10.2f} {cand_us:>10.2f} {base_us - cand_us:>10.2f} {base_us / cand_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
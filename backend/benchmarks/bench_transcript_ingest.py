@@ -0,0 +1,124 @@
+"""
+Transcription result ingest: full `json.loads` + ORM `add_all` vs streaming parse + batched inserts.
+
+Builds a synthetic FunASR result file (default 50k sentences with word timestamps) and
+ingests it into a scratch SQLite database both ways, reporting wall time and peak
+Python heap (tracemalloc, measured in a separate run so it does not skew the timings).
+
+Usage (from backend/):
+    python benchmarks/bench_transcript_ingest.py [--sentences 50000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def write_payload(path: str, n_sentences: int) -> None:
+    rng = random.Random(0)
+    phrases = ["我们下周一之前需要把接口文档定下来", "然后再安排联调", "这个需求的优先级还要再讨论", "先把风险列出来", "预算方面没有问题"]
+    sentences, t = [], 0
+    for i in range(n_sentences):
+        text = "，".join(rng.sample(phrases, 2)) + "。"
+        duration = rng.randint(1500, 6000)
+        step = duration // len(text)
+        words = [
+            {"begin_time": t + k * step, "end_time": t + (k + 1) * step, "text": ch, "punctuation": ""}
+            for k, ch in enumerate(text)
+        ]
+        sentences.append({
+            "begin_time": t, "end_time": t + duration, "text": text,
+            "sentence_id": i + 1, "speaker_id": rng.randint(0, 3), "words": words,
+        })
+        t += duration + rng.randint(100, 800)
+    payload = {
+        "file_url": "https://example.com/meeting.flac",
+        "properties": {"audio_format": "flac", "channels": [0], "original_sampling_rate": 16000},
+        "transcripts": [{"channel_id": 0, "content_duration_in_milliseconds": t, "text": "", "sentences": sentences}],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+
+def ingest_full(backend, session, meeting_id: int, path: str) -> int:
+    """The previous path: materialize the document, one ORM object per sentence."""
+    with open(path, "rb") as f:
+        payload = json.loads(f.read())
+    sentences = backend._extract_sentences_from_transcription_payload(payload)
+    speaker_ids = backend._speaker_ids_for_labels(
+        session, meeting_id, [backend._speaker_label(sent, "未知发言人") for sent in sentences]
+    )
+    segments = []
+    for sent in sentences:
+        speaker = backend._speaker_label(sent, "未知发言人")
+        segments.append(backend.Segment(
+            meeting_id=meeting_id,
+            content=sent.get("text", ""),
+            speaker=speaker,
+            speaker_id=speaker_ids[speaker],
+            start_time=backend._ms_to_mmss(sent.get("begin_time")),
+            end_time=backend._ms_to_mmss(sent.get("end_time")),
+            emotion=sent.get("emotion_tag"),
+        ))
+    session.add_all(segments)
+    session.commit()
+    return len(segments)
+
+def ingest_streaming(backend, session, meeting_id: int, path: str) -> int:
+    count, _ = backend.insert_transcript_segments(
+        session, meeting_id, backend._iter_spooled_sentences(open(path, "rb")), "未知发言人"
+    )
+    session.commit()
+    return count
+
+def run(backend, fn, path: str, db_path: str, trace: bool) -> tuple[int, float, int]:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+    backend.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        meeting = backend.Meeting(title="bench", date="2026-01-01", time="00:00", duration="00:00")
+        session.add(meeting)
+        session.commit()
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        count = fn(backend, session, meeting.id, path)
+        elapsed = time.perf_counter() - started
+        peak = 0
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return count, elapsed, peak
+    finally:
+        session.close()
+        engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=50_000)
+    args = parser.parse_args()
+
+    import main as backend # Loads .env; the benchmark itself only touches a scratch database
+
+    with tempfile.TemporaryDirectory() as tmp:
+        payload_path = os.path.join(tmp, "transcription.json")
+        write_payload(payload_path, args.sentences)
+        print(f"payload: {args.sentences} sentences, {os.path.getsize(payload_path) / 1e6:.1f} MB, "
+              f"streaming parser: {'ijson/' + backend.ijson.backend if backend.ijson else 'none (full parse fallback)'}")
+        print(f"{'path':<28}{'segments':>10}{'time':>10}{'peak heap':>12}")
+        for name, fn in [("json.loads + ORM add_all", ingest_full), ("streaming + executemany", ingest_streaming)]:
+            count, elapsed, _ = run(backend, fn, payload_path, os.path.join(tmp, "bench.db"), trace=False)
+            _, _, peak = run(backend, fn, payload_path, os.path.join(tmp, "bench.db"), trace=True)
+            print(f"{name:<28}{count:>10}{elapsed:>9.2f}s{peak / 1e6:>10.1f} MB")
+
+if __name__ == "__main__":
+    main()
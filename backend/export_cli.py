@@ -0,0 +1,90 @@
+"""
+Bulk export of meetings without going through the API.
+
+Uses the same streaming generators as the /api/export endpoints (see
+"Streaming Export" in main.py), so memory stays flat however large the
+database is. Output goes to a file or stdout; throughput goes to stderr.
+
+    python export_cli.py jsonl -o meetings.jsonl
+    python export_cli.py csv --table segments --date-from 2026-01-01 -o segments.csv
+    python export_cli.py srt --meeting 12 -o meeting_12.srt
+    python export_cli.py vtt --all -o subtitles/
+"""
+import argparse
+import os
+import sys
+import time
+
+def write_chunks(chunks, out) -> int:
+    written = 0
+    for chunk in chunks:
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+def open_output(path: str | None):
+    if not path or path == "-":
+        return sys.stdout.buffer
+    return open(path, "wb")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("format", choices=["jsonl", "csv", "srt", "vtt"])
+    parser.add_argument("-o", "--output", help="output file (default: stdout); a directory with --all")
+    parser.add_argument("--table", choices=["meetings", "segments", "analyses"], default="segments", help="csv only")
+    parser.add_argument("--since-id", type=int, default=0, help="only meetings with a larger id (incremental exports)")
+    parser.add_argument("--date-from", help="YYYY-MM-DD")
+    parser.add_argument("--date-to", help="YYYY-MM-DD")
+    parser.add_argument("--no-segments", action="store_true", help="jsonl only: skip segments")
+    parser.add_argument("--no-analyses", action="store_true", help="jsonl only: skip analysis results")
+    parser.add_argument("--meeting", type=int, help="srt/vtt: meeting id")
+    parser.add_argument("--all", action="store_true", help="srt/vtt: one file per meeting into --output")
+    parser.add_argument("--no-speakers", action="store_true", help="srt/vtt: omit speaker names")
+    args = parser.parse_args()
+
+    import main as backend # Loads .env and the database
+
+    filters = {"since_id": args.since_id, "date_from": args.date_from, "date_to": args.date_to}
+    started = time.perf_counter()
+    written = files = 0
+
+    if args.format == "jsonl":
+        out = open_output(args.output)
+        written = write_chunks(
+            backend.iter_export_jsonl(segments=not args.no_segments, analyses=not args.no_analyses, **filters), out
+        )
+        files = 1
+    elif args.format == "csv":
+        out = open_output(args.output)
+        written = write_chunks(backend.iter_export_csv(args.table, **filters), out)
+        files = 1
+    elif args.all:
+        if not args.output:
+            parser.error("--all needs --output DIR")
+        os.makedirs(args.output, exist_ok=True)
+        with backend.engine.connect() as conn:
+            where, params = backend._export_filter(**filters)
+            meeting_ids = [row[0] for row in conn.execute(backend.text(f"SELECT m.id FROM meetings m WHERE {where} ORDER BY m.id"), params)]
+        for meeting_id in meeting_ids:
+            with open(os.path.join(args.output, f"meeting_{meeting_id}.{args.format}"), "wb") as f:
+                written += write_chunks(backend.iter_subtitles(meeting_id, args.format, with_speakers=not args.no_speakers), f)
+            files += 1
+    else:
+        if args.meeting is None:
+            parser.error("srt/vtt need --meeting ID or --all")
+        out = open_output(args.output)
+        written = write_chunks(backend.iter_subtitles(args.meeting, args.format, with_speakers=not args.no_speakers), out)
+        files = 1
+
+    if args.format in ("jsonl", "csv") or not args.all:
+        out.flush()
+        if out is not sys.stdout.buffer:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(
+        f"exported {files} file(s), {written / 1e6:.1f} MB in {elapsed:.1f}s ({written / 1e6 / max(elapsed, 1e-9):.1f} MB/s)",
+        file=sys.stderr,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Resumable bulk import of historical recordings.
+
+Walks a directory and feeds every audio file through the same pipeline as
+/api/asr/file (see transcribe_local_file in main.py), without the HTTP round
+trip and with each stage on its own thread pool:
+
+    hash -> prepare (mono WAV, peaks, VAD, encode) -> upload (OSS) -> asr (FunASR) -> save (SQLite)
+
+Progress is appended to a JSONL manifest keyed by content hash, so re-running
+the same command skips finished files, re-uses finished transcriptions and
+only retries what failed or was interrupted. Files already in the database
+(e.g. uploaded through the web UI) are detected by hash and skipped.
+
+    python import_archive.py /data/recordings --asr-workers 8 --upload-workers 4
+    python import_archive.py /data/recordings --retry-failed --no-analysis
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".mp4", ".aac", ".flac", ".ogg", ".opus", ".wma", ".amr", ".webm", ".mov"}
+
+@dataclass
+class ImportItem:
+    path: str
+    size: int
+    mtime_ns: int
+    file_hash: str | None = None
+    mono_path: str | None = None
+    asr_path: str | None = None
+    offset_map: object = None
+    asr_url: str | None = None
+    sentences: list | None = None
+    audio_seconds: float = 0.0
+
+@dataclass
+class StageStats:
+    workers: int
+    done: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+    bytes: int = 0
+
+class Manifest:
+    """Append-only JSONL log of per-file progress; the last record for a hash wins."""
+
+    def __init__(self, path: str, jsoncodec):
+        self.path = path
+        self.jsoncodec = jsoncodec
+        self.by_hash: dict[str, dict] = {}
+        self.by_path: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = jsoncodec.loads_or_none(line.strip())
+                    if record:
+                        self._remember(record)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _remember(self, record: dict) -> None:
+        merged = {**self.by_hash.get(record["hash"], {}), **record}
+        self.by_hash[record["hash"]] = merged
+        self.by_path[merged["path"]] = merged
+
+    def known_hash(self, item: ImportItem) -> str | None:
+        """Content hash from a previous run, if the file is unchanged (saves re-reading it)."""
+        record = self.by_path.get(item.path)
+        if record and record.get("size") == item.size and record.get("mtime_ns") == item.mtime_ns:
+            return record["hash"]
+        return None
+
+    def record(self, item: ImportItem, stage: str, status: str, **extra) -> None:
+        entry = {
+            "hash": item.file_hash, "path": item.path, "size": item.size, "mtime_ns": item.mtime_ns,
+            "stage": stage, "status": status, "updated_at": datetime.now().isoformat(timespec="seconds"), **extra,
+        }
+        with self._lock:
+            self._remember(entry)
+            self._file.write(self.jsoncodec.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+class Pipeline:
+    """
+    One bounded queue and thread pool per stage. A stage function returns the name of the
+    stage the item goes to next (stages only move forward) or None when the item is finished.
+    """
+
+    def __init__(self, stages: list[tuple[str, callable, int]], queue_size: int, on_error):
+        self.stages = stages
+        self.queues = {name: queue.Queue(maxsize=queue_size) for name, _, _ in stages}
+        self.stats = {name: StageStats(workers=workers) for name, _, workers in stages}
+        self.on_error = on_error
+        self.threads: dict[str, list[threading.Thread]] = {}
+        self._stats_lock = threading.Lock()
+
+    def _work(self, name: str, fn) -> None:
+        q = self.queues[name]
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+            started = time.perf_counter()
+            try:
+                next_stage = fn(item)
+                failed = False
+            except Exception as e:
+                next_stage, failed = None, True
+                self.on_error(item, name, e)
+            with self._stats_lock:
+                stats = self.stats[name]
+                stats.busy_seconds += time.perf_counter() - started
+                stats.failed += failed
+                stats.done += not failed
+                stats.bytes += item.size if not failed else 0
+            if next_stage:
+                self.queues[next_stage].put(item)
+            q.task_done()
+
+    def run(self, items) -> None:
+        for name, fn, workers in self.stages:
+            self.threads[name] = [
+                threading.Thread(target=self._work, args=(name, fn), name=f"import-{name}-{i}", daemon=True)
+                for i in range(workers)
+            ]
+            for thread in self.threads[name]:
+                thread.start()
+        first = self.stages[0][0]
+        for item in items:
+            self.queues[first].put(item)
+        # Drain stage by stage: once a stage is empty nothing can feed it again
+        for name, _, workers in self.stages:
+            self.queues[name].join()
+            for _ in range(workers):
+                self.queues[name].put(None)
+            for thread in self.threads[name]:
+                thread.join()
+
+def discover(root: str, extensions: set[str]):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                path = os.path.abspath(os.path.join(dirpath, filename))
+                st = os.stat(path)
+                yield ImportItem(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+def print_report(pipeline: Pipeline, started: float, audio_seconds: float, out=sys.stderr) -> None:
+    elapsed = time.perf_counter() - started
+    print(f"\n{'stage':<8} {'workers':>7} {'done':>6} {'failed':>6} {'avg s':>8} {'busy':>6} {'MB/s':>8}", file=out)
+    for name, stats in pipeline.stats.items():
+        total = stats.done + stats.failed
+        avg = stats.busy_seconds / total if total else 0.0
+        utilization = stats.busy_seconds / (elapsed * stats.workers) if elapsed else 0.0
+        mb_s = stats.bytes / 1e6 / elapsed if elapsed else 0.0
+        print(f"{name:<8} {stats.workers:>7} {stats.done:>6} {stats.failed:>6} {avg:>8.2f} {utilization:>6.0%} {mb_s:>8.1f}", file=out)
+    saved = pipeline.stats["save"].done
+    print(
+        f"\n{saved} meetings imported in {elapsed / 60:.1f} min "
+        f"({saved / elapsed * 3600 if elapsed else 0:.0f} files/h, "
+        f"{audio_seconds / 3600:.1f} h of audio = {audio_seconds / elapsed if elapsed else 0:.1f}x realtime)",
+        file=out,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="directory to import (walked recursively)")
+    parser.add_argument("--manifest", default="import_manifest.jsonl", help="progress manifest (JSONL)")
+    parser.add_argument("--extensions", default=",".join(sorted(AUDIO_EXTENSIONS)))
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--prepare-workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="ffmpeg / VAD / encode")
+    parser.add_argument("--upload-workers", type=int, default=4)
+    parser.add_argument("--asr-workers", type=int, default=4, help="concurrent FunASR tasks")
+    parser.add_argument("--queue-size", type=int, default=16, help="max items waiting per stage")
+    parser.add_argument("--retry-failed", action="store_true", help="retry files that failed in a previous run")
+    parser.add_argument("--date-source", choices=["mtime", "now"], default="mtime", help="meeting date/time")
+    parser.add_argument("--no-analysis", action="store_true", help="do not queue the auto-summary job")
+    parser.add_argument("--report-interval", type=float, default=30, help="seconds between progress lines")
+    parser.add_argument("--dry-run", action="store_true", help="only hash files and show what would be imported")
+    args = parser.parse_args()
+
+    import jsoncodec
+    import upstream
+    import main as backend # Loads .env, OSS and DashScope config, and the database
+
+    extensions = {e if e.startswith(".") else f".{e}" for e in args.extensions.lower().split(",") if e.strip()}
+    manifest = Manifest(args.manifest, jsoncodec)
+    audio_seconds = 0.0
+    audio_lock = threading.Lock()
+    counts = {"skipped": 0, "pending": 0}
+
+    def count(key: str) -> None:
+        with audio_lock:
+            counts[key] += 1
+
+    def asr_cache_path(item: ImportItem) -> str:
+        return os.path.join(backend.UPLOAD_DIR, f"{item.file_hash}_asr.json")
+
+    def stage_hash(item: ImportItem) -> str | None:
+        item.file_hash = manifest.known_hash(item) or backend.calculate_file_hash_from_file(item.path)
+        previous = manifest.by_hash.get(item.file_hash, {})
+        if previous.get("status") == "done" or (previous.get("status") == "failed" and not args.retry_failed):
+            count("skipped")
+            return None
+        mono_path = os.path.join(backend.UPLOAD_DIR, f"{item.file_hash}_mono.wav")
+        db = backend.SessionLocal()
+        try:
+            existing = db.query(backend.Meeting.id).filter(backend.Meeting.audio_path == mono_path).first()
+        finally:
+            db.close()
+        if existing:
+            manifest.record(item, "save", "done", meeting_id=existing.id, note="already in database")
+            count("skipped")
+            return None
+        count("pending")
+        if args.dry_run:
+            print(f"would import {item.path}", file=sys.stderr)
+            return None
+        if previous.get("file_url") and os.path.exists(asr_cache_path(item)):
+            # Transcript from an interrupted run: only the database write is left
+            with open(asr_cache_path(item), "r", encoding="utf-8") as f:
+                item.sentences = jsoncodec.loads(f.read())
+            item.mono_path = previous.get("mono_path") or mono_path
+            item.asr_url = previous.get("file_url")
+            return "save"
+        manifest.record(item, "hash", "ok")
+        return "prepare"
+
+    def stage_prepare(item: ImportItem) -> str:
+        nonlocal audio_seconds
+        item.mono_path, item.asr_path, item.offset_map = backend.prepare_audio_for_asr(item.path, item.file_hash)
+        # 16 kHz 16-bit mono: 32000 bytes per second after the 44-byte header
+        item.audio_seconds = max(0, os.path.getsize(item.mono_path) - 44) / 32000
+        with audio_lock:
+            audio_seconds += item.audio_seconds
+        manifest.record(item, "prepare", "ok", audio_seconds=round(item.audio_seconds, 1))
+        return "upload"
+
+    def stage_upload(item: ImportItem) -> str:
+        if item.asr_path is None: # Long recording: chunks are uploaded by transcribe_long_audio
+            return "asr"
+        item.asr_url = backend.upload_for_asr(item.asr_path, os.path.basename(item.path))
+        manifest.record(item, "upload", "ok")
+        return "asr"
+
+    def stage_asr(item: ImportItem) -> str:
+        # Bulk imports queue behind interactive transcriptions for FunASR quota
+        with upstream.priority(upstream.PRIORITY_LOW):
+            if item.asr_path is None:
+                _, item.sentences = backend.transcribe_long_audio(item.mono_path, item.file_hash)
+            else:
+                _, item.sentences = backend.fetch_asr_sentences(item.asr_url, item.offset_map)
+        file_url = item.asr_url
+        if item.offset_map is not None or item.asr_path is None:
+            file_url = backend._local_audio_url(backend.encode_for_transport(item.mono_path))
+        with open(asr_cache_path(item), "w", encoding="utf-8") as f:
+            f.write(jsoncodec.dumps(item.sentences))
+        item.asr_url = file_url
+        manifest.record(item, "asr", "ok", sentences=len(item.sentences), mono_path=item.mono_path, file_url=file_url)
+        return "save"
+
+    def stage_save(item: ImportItem) -> None:
+        recorded_at = datetime.fromtimestamp(item.mtime_ns / 1e9) if args.date_source == "mtime" else None
+        meeting_id, _ = backend.save_transcribed_meeting(
+            os.path.basename(item.path), item.mono_path, item.asr_url, item.sentences, recorded_at=recorded_at
+        )
+        if not args.no_analysis:
+            backend.enqueue_job("analysis", {"meeting_id": meeting_id, "preset_id": "full_summary"})
+        manifest.record(item, "save", "done", meeting_id=meeting_id)
+        if os.path.exists(asr_cache_path(item)):
+            os.remove(asr_cache_path(item))
+        item.sentences = None # Release memory as soon as the meeting is written
+
+    def on_error(item: ImportItem, stage: str, error: Exception) -> None:
+        backend.logger.error(f"Import failed at {stage} for {item.path}: {error}")
+        print(f"FAILED [{stage}] {item.path}: {error}", file=sys.stderr)
+        if item.file_hash:
+            manifest.record(item, stage, "failed", error=str(error)[:500])
+
+    pipeline = Pipeline(
+        [
+            ("hash", stage_hash, args.hash_workers),
+            ("prepare", stage_prepare, args.prepare_workers),
+            ("upload", stage_upload, args.upload_workers),
+            ("asr", stage_asr, args.asr_workers),
+            # SQLite has a single writer: more threads would only contend on the lock
+            ("save", stage_save, 1),
+        ],
+        queue_size=args.queue_size,
+        on_error=on_error,
+    )
+
+    started = time.perf_counter()
+    stop_reporting = threading.Event()
+
+    def report_progress():
+        while not stop_reporting.wait(args.report_interval):
+            done = {name: stats.done for name, stats in pipeline.stats.items()}
+            print(
+                f"[{(time.perf_counter() - started) / 60:.1f} min] skipped={counts['skipped']} "
+                + " ".join(f"{name}={count}" for name, count in done.items()),
+                file=sys.stderr,
+            )
+
+    threading.Thread(target=report_progress, daemon=True).start()
+    try:
+        pipeline.run(discover(args.root, extensions))
+    except KeyboardInterrupt:
+        print("\nInterrupted; re-run the same command to resume.", file=sys.stderr)
+    finally:
+        stop_reporting.set()
+        manifest.close()
+    print(f"\nskipped (already imported or failed before): {counts['skipped']}, to import: {counts['pending']}", file=sys.stderr)
+    print_report(pipeline, started, audio_seconds)
+
+if __name__ == "__main__":
+    main()
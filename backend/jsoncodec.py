@@ -0,0 +1,44 @@
+"""
+Shared JSON codec for REST responses, websocket messages and DB blob columns.
+
+Uses orjson when it is installed and falls back to the stdlib `json` module
+otherwise, so the output is always compact UTF-8 (the equivalent of
+`json.dumps(..., ensure_ascii=False, separators=(",", ":"))`).
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError: # Optional: stdlib fallback
+    orjson = None
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+BACKEND = "orjson" if orjson else "json"
+
+def dumps_bytes(obj: Any) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps(obj: Any) -> str:
+    if orjson:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def loads(data: str | bytes) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can keep catching the stdlib type
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def loads_or_none(data: str | bytes | None) -> Any:
+    """Decode a nullable JSON blob column."""
+    return loads(data) if data else None
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
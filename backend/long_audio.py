@@ -0,0 +1,134 @@
+"""
+Split-and-stitch planning for transcribing very long recordings as parallel ASR tasks.
+
+- `plan_chunks`: cut points in silences near every `chunk_ms`; neighbouring chunks share
+  `overlap_ms` of audio around each cut
+- `stitch_chunks`: merge per-chunk sentence lists onto the recording timeline, keeping each
+  sentence from the chunk that owns its midpoint, dropping duplicates across the cut, and
+  mapping each chunk's local `speaker_id`s to global ones by overlap voting
+
+Diarization labels are local to each ASR task. Speakers are linked across a cut when both
+chunks heard them in the shared audio. A speaker who is silent around a cut gets a new
+global id, so the overlap should span a few turns of conversation.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from audio_dsp import OffsetMap, detect_speech_frames
+
+@dataclass
+class AudioChunk:
+    index: int
+    start_ms: int # Audio range sent to ASR, including the overlaps
+    end_ms: int
+    keep_from_ms: int # Sentences whose midpoint falls in [keep_from_ms, keep_to_ms) belong to this chunk
+    keep_to_ms: int
+
+def plan_chunks(
+    samples: np.ndarray,
+    sample_rate: int,
+    chunk_ms: int,
+    overlap_ms: int,
+    search_ms: int = 60_000,
+    frame_ms: int = 30,
+) -> list[AudioChunk]:
+    total_ms = len(samples) * 1000 // sample_rate
+    n_chunks = max(1, round(total_ms / chunk_ms))
+    if n_chunks == 1:
+        return [AudioChunk(0, 0, total_ms, 0, total_ms)]
+
+    speech = detect_speech_frames(samples, sample_rate, frame_ms=frame_ms)
+    step = total_ms / n_chunks
+    cuts = [_silence_cut(speech, frame_ms, int(i * step), min(search_ms, int(step / 3))) for i in range(1, n_chunks)]
+    bounds = [0, *sorted(set(cuts)), total_ms]
+    half = overlap_ms // 2
+    return [
+        AudioChunk(i, max(0, bounds[i] - half), min(total_ms, bounds[i + 1] + half), bounds[i], bounds[i + 1])
+        for i in range(len(bounds) - 1)
+    ]
+
+def _silence_cut(speech: np.ndarray, frame_ms: int, target_ms: int, search_ms: int) -> int:
+    """Middle of the longest silent run within `search_ms` of the target (closest one on ties)."""
+    lo = max(0, (target_ms - search_ms) // frame_ms)
+    hi = min(len(speech), (target_ms + search_ms) // frame_ms)
+    silent = ~speech[lo:hi]
+    if not silent.any():
+        return target_ms # Continuous speech: the overlap de-duplication has to cope
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], silent.astype(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    mids = (starts + ends) // 2
+    best = np.lexsort((np.abs(lo + mids - target_ms // frame_ms), starts - ends))[0]
+    return int((lo + mids[best]) * frame_ms)
+
+def stitch_chunks(results: list[tuple[AudioChunk, list[dict]]]) -> list[dict]:
+    """`results`: (chunk, sentences with chunk-relative times) in chunk order."""
+    stitched: list[dict] = []
+    prev: list[tuple[dict, int | None]] = [] # (sentence, global speaker) of the previous chunk
+    prev_window_end = 0
+    next_global = 0
+    for n, (chunk, sentences) in enumerate(results):
+        keep_to = chunk.keep_to_ms if n < len(results) - 1 else float("inf") # ASR times may run past the end
+        sentences = [s for s in sentences if isinstance(s, dict)]
+        OffsetMap([(0, chunk.start_ms, chunk.end_ms - chunk.start_ms)]).remap_sentences(sentences)
+        local_ids = [s.get("speaker_id") for s in sentences]
+
+        mapping = _vote_speakers(prev, list(zip(sentences, local_ids)), chunk.start_ms, prev_window_end)
+        for local in dict.fromkeys(i for i in local_ids if i is not None):
+            if local not in mapping:
+                mapping[local] = next_global
+                next_global += 1
+
+        last_kept = stitched[-1] if stitched else None
+        current = []
+        for sent, local in zip(sentences, local_ids):
+            global_id = mapping.get(local) if local is not None else None
+            current.append((sent, global_id))
+            mid = _midpoint(sent)
+            if mid is None or not chunk.keep_from_ms <= mid < keep_to:
+                continue
+            if last_kept is not None and _mostly_covered(sent, last_kept):
+                continue # Same utterance heard on both sides of the cut
+            kept = dict(sent)
+            if local is not None:
+                kept["speaker_id"] = global_id
+            stitched.append(kept)
+        prev, prev_window_end = current, chunk.end_ms
+    return stitched
+
+def _vote_speakers(prev: list[tuple[dict, int | None]], cur: list[tuple[dict, int | None]], window_start: int, window_end: int) -> dict:
+    """{local speaker of `cur`: global speaker of `prev`}, by shared speaking time in the overlap window."""
+    if not prev or window_end <= window_start:
+        return {}
+    a = [(s, g) for s, g in prev if g is not None and _overlap(s, window_start, window_end) > 0]
+    b = [(s, l) for s, l in cur if l is not None and _overlap(s, window_start, window_end) > 0]
+    votes: dict[tuple, int] = {}
+    for sa, ga in a:
+        for sb, lb in b:
+            shared = _overlap(sb, sa["begin_time"], sa["end_time"])
+            if shared > 0:
+                votes[(lb, ga)] = votes.get((lb, ga), 0) + shared
+    mapping, used = {}, set()
+    for (local, global_id), _ in sorted(votes.items(), key=lambda kv: -kv[1]):
+        if local not in mapping and global_id not in used:
+            mapping[local] = global_id
+            used.add(global_id)
+    return mapping
+
+def _overlap(sent: dict, start: int, end: int) -> int:
+    begin, finish = sent.get("begin_time"), sent.get("end_time")
+    if begin is None or finish is None:
+        return 0
+    return max(0, min(finish, end) - max(begin, start))
+
+def _midpoint(sent: dict) -> int | None:
+    begin, finish = sent.get("begin_time"), sent.get("end_time")
+    if begin is None:
+        return None
+    return (begin + (finish if finish is not None else begin)) // 2
+
+def _mostly_covered(sent: dict, other: dict) -> bool:
+    begin, finish = sent.get("begin_time"), sent.get("end_time")
+    if begin is None or finish is None or finish <= begin or other.get("begin_time") is None:
+        return False
+    return _overlap(sent, other["begin_time"], other.get("end_time") or other["begin_time"]) > (finish - begin) / 2
@@ -9,12 +9,24 @@ import hashlib
 import shutil
 import subprocess
 import wave
+import struct
 import ssl
-from collections import deque
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Depends
+import gzip
+import mmap
+import csv
+import io
+import itertools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, UploadFile, File, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import openai
 from loguru import logger
 import oss2
@@ -22,6 +34,20 @@ import requests
 import websocket # websocket-client for Qwen Realtime
 import dashscope
 from dashscope.audio.asr import Transcription
+import jsoncodec
+from jsoncodec import FastJSONResponse
+from rolling_context import RollingContext
+import transcript_index
+import meeting_stats
+import long_audio
+import upstream
+import realtime_trace
+from audio_dsp import OffsetMap, build_peaks_file, read_peaks_index, read_wav_memmap, trim_silence, write_wav_slice
+
+try:
+    import brotli
+except ImportError: # Optional: fall back to gzip only
+    brotli = None
 
 # --- 加载环境变量 ---
 from dotenv import load_dotenv
@@ -48,18 +74,65 @@ DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 dashscope.api_key = DASHSCOPE_API_KEY
 
 # 配置 OpenAI 客户端 (用于 Gemini LLM 对话)
+# SDK retries are off: the upstream governor below retries with shared backoff instead
 client = openai.OpenAI(
     api_key=os.getenv("GEMINI_API_KEY"),
-    base_url=os.getenv("GEMINI_BASE_URL")
+    base_url=os.getenv("GEMINI_BASE_URL"),
+    max_retries=0,
+)
+# Async client for realtime suggestions, shared so connections are pooled across sessions
+async_client = openai.AsyncOpenAI(
+    api_key=os.getenv("GEMINI_API_KEY"),
+    base_url=os.getenv("GEMINI_BASE_URL"),
+    max_retries=0,
 )
 
+# 上游调用限流 (per-provider rate limits, concurrency caps and retries; see upstream.py)
+def _governor(name: str, rps: float, concurrency: int) -> upstream.Governor:
+    prefix = f"UPSTREAM_{name.upper()}"
+    rate = float(os.getenv(f"{prefix}_RPS", str(rps)))
+    return upstream.Governor(
+        name,
+        rate=rate,
+        burst=float(os.getenv(f"{prefix}_BURST", str(max(1.0, rate)))),
+        max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+    )
+
+asr_governor = _governor("asr", rps=2, concurrency=8) # FunASR file transcription (submit + wait)
+realtime_governor = _governor("realtime", rps=5, concurrency=20) # Realtime ASR sessions
+llm_governor = _governor("llm", rps=5, concurrency=16) # Gemini chat completions
+UPSTREAM_GOVERNORS = {g.name: g for g in (asr_governor, realtime_governor, llm_governor)}
+
+LLM_ANALYSIS_DEADLINE = float(os.getenv("LLM_ANALYSIS_DEADLINE", "600"))
+LLM_CHAT_DEADLINE = float(os.getenv("LLM_CHAT_DEADLINE", "60"))
+LLM_SUGGESTION_DEADLINE = float(os.getenv("LLM_SUGGESTION_DEADLINE", "10")) # A late suggestion is useless
+REALTIME_CONNECT_DEADLINE = float(os.getenv("REALTIME_CONNECT_DEADLINE", "15"))
+
+# 实时建议上下文预算 (token 估算)
+CONTEXT_WINDOW_TOKENS = int(os.getenv("CONTEXT_WINDOW_TOKENS", "600"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+
 # --- 阿里云 OSS 配置 ---
 OSS_ACCESS_KEY_ID = os.getenv("ALIYUN_ACCESS_KEY_ID")
 OSS_ACCESS_KEY_SECRET = os.getenv("ALIYUN_ACCESS_KEY_SECRET")
 OSS_BUCKET_NAME = os.getenv("ALIYUN_OSS_BUCKET")
 OSS_ENDPOINT = os.getenv("ALIYUN_OSS_ENDPOINT")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Run an in-process worker unless jobs are handled by standalone `worker.py` processes
+    stop_events = []
+    if os.getenv("EMBEDDED_WORKER", "1") == "1":
+        stop_events.append(start_worker_threads(f"api-{os.getpid()}", concurrency=int(os.getenv("EMBEDDED_WORKER_CONCURRENCY", "2"))))
+    if os.getenv("STORAGE_MANAGER", "1") == "1":
+        stop_events.append(start_storage_manager())
+    if os.getenv("CHAT_INDEXER", "1") == "1":
+        stop_events.append(start_chat_indexer())
+    yield
+    for stop_event in stop_events:
+        stop_event.set()
+
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -67,15 +140,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Content-Range", "X-Sample-Rate", "X-Samples-Per-Peak", "X-Peak-Count", "X-Total-Samples"],
 )
+# Compress large JSON responses (responses that already set Content-Encoding are left alone)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, ForeignKey, DateTime, Float, UniqueConstraint, Index
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session
 
 # ... (Existing imports)
 
@@ -86,6 +162,15 @@ SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(os.path.dirname(__file__), '
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL + busy timeout so API and worker processes can share the database file
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=10000")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -99,16 +184,32 @@ class Meeting(Base):
     date = Column(String)  # YYYY-MM-DD
     time = Column(String)  # HH:MM
     duration = Column(String) # 00:00
-    file_url = Column(String) # OSS URL
+    file_url = Column(String) # OSS URL (or local URL when OSS only holds VAD-trimmed audio)
+    audio_path = Column(String, nullable=True) # Local mono WAV on the original timeline
     created_at = Column(DateTime, default=datetime.now)
     type = Column(String, default="product") # meeting type
     analysis_result = Column(Text, nullable=True) # JSON string for analysis result
     chapters = Column(Text, nullable=True) # JSON string for smart chapters
     summary = Column(Text, nullable=True) # Full summary text
     keywords = Column(Text, nullable=True) # JSON list of keywords
+    version = Column(Integer, default=1, nullable=False) # Bumped by every write path, used as ETag
+    transcript_version = Column(Integer, default=1, nullable=False) # Bumped only when segments or speakers change
     
     # Relationship to segments
     segments = relationship("Segment", back_populates="meeting", cascade="all, delete-orphan")
+    speakers = relationship("Speaker", back_populates="meeting", cascade="all, delete-orphan")
+    analyses = relationship("AnalysisResult", cascade="all, delete-orphan")
+
+class Speaker(Base):
+    __tablename__ = "speakers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    meeting_id = Column(Integer, ForeignKey("meetings.id"), index=True)
+    label = Column(String)  # Original ASR label, e.g. "Speaker 0"
+    name = Column(String)  # Display name, resolved at read time
+    merged_into_id = Column(Integer, ForeignKey("speakers.id"), nullable=True)
+
+    meeting = relationship("Meeting", back_populates="speakers")
 
 class Segment(Base):
     __tablename__ = "segments"
@@ -116,13 +217,74 @@ class Segment(Base):
     id = Column(Integer, primary_key=True, index=True)
     meeting_id = Column(Integer, ForeignKey("meetings.id"))
     content = Column(Text)
-    speaker = Column(String)
+    speaker = Column(String) # Original ASR label, never rewritten
+    speaker_id = Column(Integer, ForeignKey("speakers.id"), nullable=True, index=True)
     start_time = Column(String)
     end_time = Column(String)
     emotion = Column(String, nullable=True)
 
     meeting = relationship("Meeting", back_populates="segments")
 
+class AnalysisResult(Base):
+    __tablename__ = "analysis_results"
+    __table_args__ = (UniqueConstraint("meeting_id", "preset_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    meeting_id = Column(Integer, ForeignKey("meetings.id"), index=True)
+    preset_id = Column(String)
+    result = Column(Text) # JSON string of the raw preset output
+    updated_at = Column(DateTime, default=datetime.now)
+    transcript_version = Column(Integer, nullable=True) # Meeting.transcript_version it was built from; None = not reusable
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (Index("ix_jobs_claim", "status", "run_after"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String) # transcribe / postprocess / analysis
+    payload = Column(Text) # JSON arguments for the handler
+    status = Column(String, default="pending") # pending / running / done / failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    lease_owner = Column(String, nullable=True) # Claim token of the worker holding the lease
+    lease_expires_at = Column(Float, nullable=True) # Epoch seconds
+    run_after = Column(Float, default=0) # Epoch seconds, used for retry backoff
+    last_error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True) # Small JSON summary returned by the handler
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class StoredFile(Base):
+    __tablename__ = "stored_files"
+
+    name = Column(String, primary_key=True) # File name inside UPLOAD_DIR
+    size = Column(Integer, default=0)
+    present = Column(Integer, default=1) # 0 = evicted locally, restorable from oss_key
+    oss_key = Column(String, nullable=True)
+    last_access = Column(Float, nullable=True, index=True) # Epoch seconds
+    created_at = Column(Float, nullable=True)
+
+class ChatIndexState(Base):
+    __tablename__ = "chat_index_state"
+
+    meeting_id = Column(Integer, primary_key=True)
+    version = Column(Integer) # Meeting.version the passages were built from
+
+class MeetingStats(Base):
+    """Transcript statistics, materialized whenever a meeting's segments or speakers change (see meeting_stats.py)."""
+    __tablename__ = "meeting_stats"
+
+    meeting_id = Column(Integer, ForeignKey("meetings.id"), primary_key=True)
+    segment_count = Column(Integer, default=0)
+    speaker_count = Column(Integer, default=0)
+    char_count = Column(Integer, default=0)
+    word_count = Column(Integer, default=0)
+    talk_ms = Column(Integer, default=0)
+    host = Column(String, nullable=True) # Display name of the speaker with the most talk time
+    speakers = Column(Text) # JSON list, ordered by talk time
+    emotions = Column(Text) # JSON {emotion: segment count}
+    updated_at = Column(Float)
+
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -155,6 +317,79 @@ except Exception:
     with engine.connect() as conn:
         conn.execute(text("ALTER TABLE meetings ADD COLUMN keywords TEXT"))
 
+# 5. Check if 'version' column exists
+try:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT version FROM meetings LIMIT 1"))
+except Exception:
+    logger.info("Adding 'version' column to meetings table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE meetings ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+# 6. Check if 'audio_path' column exists
+try:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT audio_path FROM meetings LIMIT 1"))
+except Exception:
+    logger.info("Adding 'audio_path' column to meetings table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE meetings ADD COLUMN audio_path TEXT"))
+
+# 7. Check if 'speaker_id' column exists on segments, backfill the speakers table
+try:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT speaker_id FROM segments LIMIT 1"))
+except Exception:
+    logger.info("Adding 'speaker_id' column to segments table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE segments ADD COLUMN speaker_id INTEGER REFERENCES speakers(id)"))
+
+# 8. Check if 'transcript_version' columns exist (stored analysis results are only reused while current)
+try:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT transcript_version FROM meetings LIMIT 1"))
+except Exception:
+    logger.info("Adding 'transcript_version' column to meetings table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE meetings ADD COLUMN transcript_version INTEGER NOT NULL DEFAULT 1"))
+try:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT transcript_version FROM analysis_results LIMIT 1"))
+except Exception:
+    logger.info("Adding 'transcript_version' column to analysis_results table")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE analysis_results ADD COLUMN transcript_version INTEGER"))
+
+with engine.begin() as conn:
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_segments_meeting_id ON segments (meeting_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_segments_speaker_id ON segments (speaker_id)"))
+    if conn.execute(text("SELECT 1 FROM segments WHERE speaker_id IS NULL LIMIT 1")).first():
+        logger.info("Backfilling speakers table from segments")
+        conn.execute(text(
+            "INSERT INTO speakers (meeting_id, label, name) "
+            "SELECT DISTINCT s.meeting_id, s.speaker, s.speaker FROM segments s "
+            "WHERE s.speaker_id IS NULL AND NOT EXISTS ("
+            "  SELECT 1 FROM speakers sp WHERE sp.meeting_id = s.meeting_id AND sp.label IS s.speaker)"
+        ))
+        conn.execute(text(
+            "UPDATE segments SET speaker_id = ("
+            "  SELECT sp.id FROM speakers sp WHERE sp.meeting_id = segments.meeting_id AND sp.label IS segments.speaker"
+            "  ORDER BY sp.id LIMIT 1) "
+            "WHERE speaker_id IS NULL"
+        ))
+
+# Stats stored with the raw "unknown_speaker_default" label are dropped and lazily recomputed by the listing
+with engine.begin() as conn:
+    conn.execute(text("DELETE FROM meeting_stats WHERE speakers LIKE '%unknown_speaker_default%'"))
+
+# Full-text passage index for /chat (see transcript_index.py); rebuilt per meeting when its version changes
+with engine.begin() as conn:
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_passages USING fts5("
+        "tokens, meeting_id UNINDEXED, kind UNINDEXED, start_time UNINDEXED, end_time UNINDEXED, "
+        "segment_id UNINDEXED, speakers UNINDEXED, content UNINDEXED)"
+    ))
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
@@ -187,7 +422,8 @@ def calculate_file_hash_from_file(file_path: str) -> str:
 
 def ensure_mono_wav(input_path: str, base_hash: str) -> str:
     mono_path = os.path.join(UPLOAD_DIR, f"{base_hash}_mono.wav")
-    if os.path.exists(mono_path):
+    if os.path.exists(mono_path) or (not os.path.exists(input_path) and ensure_local_file(mono_path)):
+        touch_file(mono_path)
         return mono_path
     ffmpeg_path = shutil.which("ffmpeg")
     if not ffmpeg_path:
@@ -200,6 +436,89 @@ def ensure_mono_wav(input_path: str, base_hash: str) -> str:
     )
     return mono_path
 
+# --- 传输/存储编码 (Transport Codec) ---
+# wav: uncompressed 16 kHz PCM (~115 MB/h); flac: lossless (~40-60% of wav);
+# opus: speech-tuned lossy (~15 MB/h at 32 kbps). All are accepted by FunASR and browsers.
+AUDIO_CODEC = os.getenv("AUDIO_CODEC", "flac").lower()
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "32k")
+AUDIO_CODECS = {
+    "flac": (".flac", ["-c:a", "flac", "-compression_level", "8"]),
+    "opus": (".ogg", ["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip"]),
+}
+
+def encode_for_transport(wav_path: str, codec: str | None = None) -> str:
+    """Encode a mono WAV with the configured codec; falls back to the WAV itself on any failure."""
+    codec = (codec or AUDIO_CODEC).lower()
+    if codec not in AUDIO_CODECS:
+        return wav_path
+    ext, codec_args = AUDIO_CODECS[codec]
+    out_path = os.path.splitext(wav_path)[0] + ext
+    if os.path.exists(out_path):
+        touch_file(out_path)
+        return out_path
+    ffmpeg_path = shutil.which("ffmpeg")
+    if not ffmpeg_path:
+        logger.warning(f"ffmpeg not found, uploading uncompressed {os.path.basename(wav_path)}")
+        return wav_path
+
+    # Encode to a temp name and rename, so concurrent workers never see a partial file
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp{ext}"
+    try:
+        subprocess.run(
+            [ffmpeg_path, "-y", "-i", wav_path, "-vn", "-ac", "1", "-ar", "16000", *codec_args, tmp_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        logger.warning(f"{codec} encoding failed for {os.path.basename(wav_path)}, uploading WAV: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return wav_path
+    logger.info(
+        f"Encoded {os.path.basename(wav_path)} as {codec}: "
+        f"{os.path.getsize(wav_path) / 1e6:.1f} MB -> {os.path.getsize(out_path) / 1e6:.1f} MB"
+    )
+    return out_path
+
+# --- 静音裁剪 (VAD) ---
+# Opt-in: OSS then only holds the compacted audio, so playback falls back to the local original
+VAD_TRIM_ENABLED = os.getenv("VAD_TRIM_ENABLED", "0") == "1"
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "2000"))
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+
+def trim_silence_for_asr(mono_path: str, base_hash: str) -> tuple[str, OffsetMap | None]:
+    """Return (path to upload for ASR, offset map back to the original timeline or None)."""
+    if not VAD_TRIM_ENABLED:
+        return mono_path, None
+
+    trim_path = os.path.join(UPLOAD_DIR, f"{base_hash}_trim.wav")
+    map_path = os.path.join(UPLOAD_DIR, f"{base_hash}_trim.json")
+    if os.path.exists(map_path):
+        with open(map_path, "r", encoding="utf-8") as f:
+            offset_map = OffsetMap.from_json(f.read())
+        if not offset_map.spans:
+            return mono_path, None
+        if os.path.exists(trim_path):
+            return trim_path, offset_map
+
+    try:
+        offset_map = trim_silence(mono_path, trim_path, min_silence_ms=VAD_MIN_SILENCE_MS)
+    except Exception as e:
+        logger.warning(f"VAD trimming failed for {mono_path}, uploading untrimmed audio: {e}")
+        return mono_path, None
+
+    with open(map_path, "w", encoding="utf-8") as f:
+        f.write(offset_map.to_json() if offset_map else "[]")
+    if offset_map is None:
+        return mono_path, None
+    logger.info(f"VAD trimmed {offset_map.removed_ms / 1000:.1f}s of silence from {os.path.basename(mono_path)}")
+    return trim_path, offset_map
+
+def _local_audio_url(path: str) -> str:
+    return f"{PUBLIC_BASE_URL}/uploads/{os.path.basename(path)}"
+
 def append_debug_line(text: str) -> None:
     if os.getenv("ASR_DEBUG") != "1":
         return
@@ -207,7 +526,8 @@ def append_debug_line(text: str) -> None:
     with open(debug_path, "a", encoding="utf-8") as f:
         f.write(text.rstrip("\n") + "\n")
 
-def upload_to_oss(local_path: str, filename: str, file_hash: str) -> str:
+def upload_to_oss(local_path: str, filename: str, file_hash: str, track: bool = True) -> str:
+    """`track=False` for temporary copies that are deleted right after the upload (no `stored_files` row)."""
     try:
         bucket = get_oss_bucket()
         # Use hash in object key for deduplication
@@ -219,55 +539,478 @@ def upload_to_oss(local_path: str, filename: str, file_hash: str) -> str:
         else:
             logger.info(f"Uploading {filename} to OSS as {key}")
             bucket.put_object_from_file(key, local_path)
+        if track:
+            track_file(local_path, oss_key=key)
         
-        # Generate signed URL (valid for 12 hours to avoid expiration during long transcription)
-        url = bucket.sign_url("GET", key, 43200).replace("http://", "https://")
-        logger.info(f"Generated signed URL: {url.split('?')[0]}")
-        return url
+        return _sign_oss_url(bucket, key)
     except Exception as e:
         logger.error(f"OSS Upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"OSS Upload failed: {str(e)}")
 
+def _sign_oss_url(bucket, key: str) -> str:
+    # Generate signed URL (valid for 12 hours to avoid expiration during long transcription)
+    url = bucket.sign_url("GET", key, 43200).replace("http://", "https://")
+    logger.info(f"Generated signed URL: {url.split('?')[0]}")
+    return url
+
+# --- 实时录音渐进式上传 (Progressive Multipart Upload) ---
+REALTIME_PROGRESSIVE_UPLOAD = os.getenv("REALTIME_PROGRESSIVE_UPLOAD", "1") == "1"
+REALTIME_UPLOAD_PART_SIZE = int(float(os.getenv("REALTIME_UPLOAD_PART_MB", "5")) * 1024 * 1024)
+
+def _wav_header(data_size: int, sample_rate: int = 16000, channels: int = 1, sample_width: int = 2) -> bytes:
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b"data", data_size,
+    )
+
+class ProgressiveOSSUpload:
+    """
+    Streams a live 16 kHz mono PCM recording to OSS as a multipart WAV upload.
+    Parts 2..N are uploaded in the background while recording; part 1 (WAV header +
+    first chunk) is uploaded at completion, once the total data size is known.
+    The multipart upload itself is initiated on the part threads too: constructing
+    this (on the event loop, at session start) does no network I/O.
+    """
+
+    def __init__(self, key: str, part_size: int = REALTIME_UPLOAD_PART_SIZE):
+        self.key = key
+        self.part_size = max(part_size, 100 * 1024) # OSS minimum for non-final parts
+        self.bucket = None
+        self.upload_id = None
+        self.buffer = bytearray()
+        self.first_chunk: bytes | None = None
+        self.total_bytes = 0
+        self.next_part_number = 2
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="oss-part")
+        self._started = self.executor.submit(self._start) # Parts queue behind it until it is done
+
+    def _start(self) -> None:
+        self.bucket = get_oss_bucket()
+        self.upload_id = self.bucket.init_multipart_upload(self.key).upload_id
+        logger.info(f"Started progressive upload {self.key} ({self.upload_id})")
+
+    def write(self, pcm: bytes) -> None:
+        """Called from the event loop; only buffers and schedules uploads, never blocks on the network."""
+        self.buffer.extend(pcm)
+        self.total_bytes += len(pcm)
+        while len(self.buffer) >= self.part_size:
+            chunk = bytes(self.buffer[:self.part_size])
+            del self.buffer[:self.part_size]
+            if self.first_chunk is None:
+                self.first_chunk = chunk
+            else:
+                self.futures.append(self.executor.submit(self._upload_part, self.next_part_number, chunk))
+                self.next_part_number += 1
+
+    def _upload_part(self, part_number: int, data: bytes):
+        self._started.result() # Re-raises an init failure, so complete() falls back to a full upload
+        result = self.bucket.upload_part(self.key, self.upload_id, part_number, data)
+        return oss2.models.PartInfo(part_number, result.etag, size=len(data))
+
+    def complete(self) -> str:
+        """Upload the remaining parts, finish the multipart upload and return a signed URL (blocking)."""
+        try:
+            if self.first_chunk is None:
+                self.first_chunk, tail = bytes(self.buffer), b""
+            else:
+                tail = bytes(self.buffer)
+            self.buffer.clear()
+            if tail:
+                self.futures.append(self.executor.submit(self._upload_part, self.next_part_number, tail))
+            self.futures.append(self.executor.submit(self._upload_part, 1, _wav_header(self.total_bytes) + self.first_chunk))
+            parts = sorted((f.result() for f in self.futures), key=lambda part: part.part_number)
+            self.bucket.complete_multipart_upload(self.key, self.upload_id, parts)
+            logger.info(f"Completed progressive upload {self.key}: {len(parts)} parts, {self.total_bytes / 1e6:.1f} MB")
+            return _sign_oss_url(self.bucket, self.key)
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def abort(self) -> None:
+        try:
+            self._started.result()
+        except Exception:
+            return # Nothing was initiated
+        try:
+            self.bucket.abort_multipart_upload(self.key, self.upload_id)
+        except Exception as e:
+            logger.error(f"Failed to abort progressive upload {self.key}: {e}")
+
+# --- 本地存储生命周期 (Disk Lifecycle) ---
+# UPLOAD_DIR is a cache once audio is durably in OSS: files are tracked in `stored_files`
+# with size / last access / OSS key, evicted LRU-first above STORAGE_BUDGET_GB and
+# re-downloaded on demand. Access times are batched in memory and flushed by the sweeper.
+STORAGE_BUDGET_BYTES = int(float(os.getenv("STORAGE_BUDGET_GB", "0")) * 1024 ** 3) # 0 = no eviction
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "300"))
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "30"))
+STORAGE_TEMP_MAX_AGE = float(os.getenv("STORAGE_TEMP_MAX_AGE_HOURS", "24")) * 3600
+STORAGE_MIN_IDLE = float(os.getenv("STORAGE_MIN_IDLE_MINUTES", "60")) * 60 # Never evict recently used files
+STORAGE_LOW_WATER = 0.9 # Evict down to 90% of the budget so sweeps do not thrash at the limit
+
+_pending_touches: dict[str, float] = {}
+_touch_lock = threading.Lock()
+_active_local_files: set[str] = set() # Realtime recordings still being written
+_storage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="storage")
+_refetching: set[str] = set()
+
+def _stored_name(path: str) -> str | None:
+    """Key of a file in `stored_files`, or None if it is not directly inside UPLOAD_DIR."""
+    if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(UPLOAD_DIR):
+        return None
+    return os.path.basename(path)
+
+def touch_file(path: str) -> None:
+    """Record an access without touching the database (flushed in batches)."""
+    name = _stored_name(path)
+    if name:
+        with _touch_lock:
+            _pending_touches[name] = time.time()
+
+def track_file(path: str, oss_key: str | None = None) -> None:
+    """Register a local file (and where it lives in OSS, if anywhere)."""
+    name = _stored_name(path)
+    if not name or not os.path.exists(path):
+        return
+    db = SessionLocal()
+    try:
+        row = db.query(StoredFile).filter(StoredFile.name == name).first()
+        if row is None:
+            row = StoredFile(name=name, created_at=time.time())
+            db.add(row)
+        row.size = os.path.getsize(path)
+        row.present = 1
+        row.last_access = time.time()
+        if oss_key:
+            row.oss_key = oss_key
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Failed to track {name}: {e}")
+    finally:
+        db.close()
+
+def flush_file_touches() -> int:
+    with _touch_lock:
+        touches = dict(_pending_touches)
+        _pending_touches.clear()
+    if not touches:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE stored_files SET last_access = :ts WHERE name = :name AND (last_access IS NULL OR last_access < :ts)"),
+            [{"name": name, "ts": ts} for name, ts in touches.items()],
+        )
+    return len(touches)
+
+def _encoded_siblings(name: str) -> list[str]:
+    stem = os.path.splitext(name)[0]
+    return [stem + ext for ext, _ in AUDIO_CODECS.values()]
+
+def _oss_source(db: Session, name: str) -> tuple[str, str] | None:
+    """(name, oss_key) of the OSS object this file can be restored from: itself or its encoded copy."""
+    candidates = [name] + (_encoded_siblings(name) if name.endswith(".wav") else [])
+    rows = db.query(StoredFile.name, StoredFile.oss_key).filter(
+        StoredFile.name.in_(candidates), StoredFile.oss_key.isnot(None)
+    ).all()
+    by_name = {row.name: row.oss_key for row in rows}
+    for candidate in candidates:
+        if candidate in by_name:
+            return candidate, by_name[candidate]
+    return None
+
+def _is_evictable(name: str, oss_source: tuple[str, str] | None, names: set[str]) -> bool:
+    if name.endswith((".peaks", ".json")):
+        return False # Tiny, and peaks are what lets timelines render without the audio
+    if "_trim." in name:
+        return True # ASR input only, regenerated from the mono WAV when needed
+    if oss_source is not None:
+        return True
+    stem, ext = os.path.splitext(name)
+    # Original uploads are only an input to ensure_mono_wav once the mono copy exists
+    return "_" not in stem and not name.startswith("temp_") and f"{stem}_mono.wav" in names
+
+def restorable_from_oss(path: str) -> bool:
+    name = _stored_name(path)
+    if not name:
+        return False
+    db = SessionLocal()
+    try:
+        return _oss_source(db, name) is not None
+    finally:
+        db.close()
+
+def signed_url_for_local(path: str) -> str | None:
+    """Fresh signed OSS URL for a (possibly evicted) local file, if a copy exists in OSS."""
+    name = _stored_name(path)
+    if not name:
+        return None
+    db = SessionLocal()
+    try:
+        source = _oss_source(db, name)
+    finally:
+        db.close()
+    return _sign_oss_url(get_oss_bucket(), source[1]) if source else None
+
+def ensure_local_file(path: str) -> bool:
+    """Make sure `path` exists locally, downloading it (or its encoded copy) from OSS. Blocking."""
+    if os.path.exists(path):
+        touch_file(path)
+        return True
+    name = _stored_name(path)
+    if not name:
+        return False
+    db = SessionLocal()
+    try:
+        source = _oss_source(db, name)
+    finally:
+        db.close()
+    if source is None:
+        return False
+
+    source_name, oss_key = source
+    source_path = os.path.join(UPLOAD_DIR, source_name)
+    if not os.path.exists(source_path):
+        tmp_path = f"{source_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            get_oss_bucket().get_object_to_file(oss_key, tmp_path)
+            os.replace(tmp_path, source_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logger.info(f"Restored {source_name} from OSS ({oss_key})")
+        track_file(source_path, oss_key)
+    if source_name != name:
+        # Only the encoded copy is in OSS: decode it back to the 16 kHz mono WAV
+        ffmpeg_path = shutil.which("ffmpeg")
+        if not ffmpeg_path:
+            return False
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp.wav"
+        try:
+            subprocess.run(
+                [ffmpeg_path, "-y", "-i", source_path, "-ac", "1", "-ar", "16000", "-c:a", "pcm_s16le", tmp_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+            )
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        track_file(path)
+    return os.path.exists(path)
+
+def schedule_refetch(path: str) -> None:
+    """Restore an evicted file in the background (request threads redirect to OSS meanwhile)."""
+    with _touch_lock:
+        if path in _refetching:
+            return
+        _refetching.add(path)
+
+    def run():
+        try:
+            ensure_local_file(path)
+        except Exception as e:
+            logger.warning(f"Refetch of {os.path.basename(path)} failed: {e}")
+        finally:
+            with _touch_lock:
+                _refetching.discard(path)
+
+    _storage_executor.submit(run)
+
+def _protected_files(db: Session) -> set[str]:
+    """Files that must stay: open recordings and inputs of queued / running jobs."""
+    protected = {os.path.basename(p) for p in _active_local_files}
+    for (payload,) in db.query(Job.payload).filter(Job.status.in_(["pending", "running"])).all():
+        data = jsoncodec.loads_or_none(payload) or {}
+        for key in ("local_path", "file_path"):
+            if data.get(key):
+                protected.add(os.path.basename(data[key]))
+    return protected
+
+def _is_orphan_temp(name: str, mtime: float, now: float, audio_names: dict[int, str | None]) -> bool:
+    if ".tmp" in name:
+        return now - mtime > 3600 # Partial encode / download / peaks file from a crashed process
+    if not name.startswith("temp_") or now - mtime < STORAGE_TEMP_MAX_AGE:
+        return False
+    if name.startswith("temp_unknown_"):
+        return True # Sessions without a meeting are never post-processed
+    try:
+        meeting_id = int(os.path.splitext(name)[0][len("temp_"):])
+    except ValueError:
+        return False
+    if meeting_id not in audio_names:
+        return True # Meeting is gone
+    # Post-processing moved the audio to `{hash}_mono.wav`; otherwise this is still the only copy
+    return audio_names[meeting_id] not in (None, name)
+
+def sweep_upload_dir(budget_bytes: int | None = None) -> dict:
+    """Sync `stored_files` with the directory, delete orphaned temp files and evict LRU files over budget."""
+    budget_bytes = STORAGE_BUDGET_BYTES if budget_bytes is None else budget_bytes
+    flush_file_touches()
+    now = time.time()
+    stats = {"tracked": 0, "orphans_removed": 0, "evicted": 0, "freed_bytes": 0, "total_bytes": 0}
+    db = SessionLocal()
+    try:
+        rows = {row.name: row for row in db.query(StoredFile).all()}
+        on_disk = {}
+        for entry in os.scandir(UPLOAD_DIR):
+            if entry.is_file():
+                on_disk[entry.name] = entry.stat()
+
+        audio_names = {
+            m.id: os.path.basename(m.audio_path) if m.audio_path else None
+            for m in db.query(Meeting.id, Meeting.audio_path).all()
+        }
+        protected = _protected_files(db)
+        meeting_audio = {name for name in audio_names.values() if name}
+        for name, st in list(on_disk.items()):
+            if name not in protected and name not in meeting_audio and _is_orphan_temp(name, st.st_mtime, now, audio_names):
+                try:
+                    os.remove(os.path.join(UPLOAD_DIR, name))
+                except OSError as e:
+                    logger.warning(f"Failed to remove orphan {name}: {e}")
+                    continue
+                logger.info(f"Removed orphaned temp file {name} ({st.st_size / 1e6:.1f} MB)")
+                stats["orphans_removed"] += 1
+                stats["freed_bytes"] += st.st_size
+                del on_disk[name]
+
+        for name, st in on_disk.items():
+            row = rows.get(name)
+            if row is None:
+                row = rows[name] = StoredFile(name=name, created_at=st.st_mtime, last_access=st.st_mtime)
+                db.add(row)
+            row.size, row.present = st.st_size, 1
+        for name, row in rows.items():
+            if name not in on_disk:
+                if row.oss_key:
+                    row.present = 0 # Keep the row: it is how the file gets restored from OSS
+                else:
+                    db.delete(row)
+        db.commit()
+
+        present = [row for row in rows.values() if row.name in on_disk]
+        total = sum(row.size or 0 for row in present)
+        stats["tracked"] = len(present)
+        if budget_bytes and total > budget_bytes:
+            target = budget_bytes * STORAGE_LOW_WATER
+            names = set(on_disk)
+            candidates = sorted(
+                (row for row in present if row.name not in protected and (row.last_access or 0) < now - STORAGE_MIN_IDLE),
+                key=lambda row: row.last_access or 0,
+            )
+            for row in candidates:
+                if total <= target:
+                    break
+                if not _is_evictable(row.name, _oss_source(db, row.name), names):
+                    continue
+                try:
+                    os.remove(os.path.join(UPLOAD_DIR, row.name))
+                except OSError as e:
+                    logger.warning(f"Failed to evict {row.name}: {e}")
+                    continue
+                total -= row.size or 0
+                stats["evicted"] += 1
+                stats["freed_bytes"] += row.size or 0
+                names.discard(row.name)
+                if row.oss_key:
+                    row.present = 0
+                else:
+                    db.delete(row)
+            db.commit()
+            if total > budget_bytes:
+                logger.warning(f"UPLOAD_DIR still {total / 1e6:.0f} MB after eviction (budget {budget_bytes / 1e6:.0f} MB): remaining files are not in OSS or in use")
+        stats["total_bytes"] = total
+    finally:
+        db.close()
+    if stats["orphans_removed"] or stats["evicted"]:
+        logger.info(f"Storage sweep: {stats}")
+    return stats
+
+def start_storage_manager() -> threading.Event:
+    stop_event = threading.Event()
+
+    def loop():
+        last_sweep = 0.0
+        while not stop_event.wait(STORAGE_FLUSH_INTERVAL):
+            try:
+                if time.time() - last_sweep >= STORAGE_SWEEP_INTERVAL:
+                    sweep_upload_dir()
+                    last_sweep = time.time()
+                else:
+                    flush_file_touches()
+            except Exception as e:
+                logger.error(f"Storage manager error: {e}")
+        flush_file_touches()
+
+    threading.Thread(target=loop, name="storage-manager", daemon=True).start()
+    return stop_event
+
 # --- FunASR (Paraformer) File Transcription ---
+ASR_TASK_DEADLINE = float(os.getenv("ASR_TASK_DEADLINE", "3600")) # Give up retrying throttled submits after this
 
 def transcribe_with_fun_asr(file_url: str):
     logger.info(f"Submitting FunASR (fun-asr) task for {file_url.split('?')[0]}")
     
     try:
-        task_response = Transcription.async_call(
-            model='fun-asr',
-            file_urls=[file_url],
-            diarization_enabled=True,
-            timestamp_alignment_enabled=True,
-            channel_id=[0],
-        )
-        
-        if task_response.status_code != 200:
-             logger.error(f"FunASR Submit Failed: {task_response.code} {task_response.message}")
-             raise Exception(f"FunASR Submit Failed: {task_response.message}")
-
-        task_id = task_response.output.task_id
-        logger.info(f"FunASR Task Submitted: {task_id}")
-        
-        # Wait for result
-        status_response = Transcription.wait(task=task_id)
-        
-        if status_response.status_code == 200:
-            status = status_response.output.task_status
-            if status == 'SUCCEEDED':
-                logger.info(f"FunASR Task SUCCEEDED: {task_id}")
-                return status_response.output
-            else:
-                logger.error(f"FunASR Task Failed: {status} - {status_response.output.message}")
-                raise Exception(f"FunASR Task Failed: {status_response.output.message}")
-        else:
-             logger.error(f"FunASR Wait Failed: {status_response.code}")
-             raise Exception(f"FunASR Wait Failed: {status_response.message}")
-
+        # The governor slot covers submit + wait, so it caps concurrent FunASR tasks
+        return asr_governor.call(_run_fun_asr_task, file_url, deadline=ASR_TASK_DEADLINE)
     except Exception as e:
         logger.error(f"FunASR Transcription Error: {e}")
         raise e
 
+def _run_fun_asr_task(file_url: str):
+    task_response = Transcription.async_call(
+        model='fun-asr',
+        file_urls=[file_url],
+        diarization_enabled=True,
+        timestamp_alignment_enabled=True,
+        channel_id=[0],
+    )
+    
+    if task_response.status_code != 200:
+         logger.error(f"FunASR Submit Failed: {task_response.code} {task_response.message}")
+         raise upstream.UpstreamError(
+             f"FunASR Submit Failed: {task_response.message}", task_response.status_code, task_response.code
+         )
+
+    task_id = task_response.output.task_id
+    logger.info(f"FunASR Task Submitted: {task_id}")
+    return _wait_fun_asr_task(task_id)
+
+FUNASR_WAIT_ATTEMPTS = int(os.getenv("FUNASR_WAIT_ATTEMPTS", "5"))
+
+def _wait_fun_asr_task(task_id: str):
+    """
+    Wait for a submitted task. Transient wait failures are retried here on the same task id and
+    then raised as non-retryable: a governor retry would submit (and bill) a second task.
+    """
+    for attempt in range(FUNASR_WAIT_ATTEMPTS):
+        try:
+            status_response = Transcription.wait(task=task_id)
+        except Exception as e:
+            error = e
+        else:
+            if status_response.status_code == 200:
+                status = status_response.output.task_status
+                if status == 'SUCCEEDED':
+                    logger.info(f"FunASR Task SUCCEEDED: {task_id}")
+                    return status_response.output
+                logger.error(f"FunASR Task Failed: {status} - {status_response.output.message}")
+                raise Exception(f"FunASR Task Failed: {status_response.output.message}")
+            error = upstream.UpstreamError(
+                f"FunASR Wait Failed: {status_response.message}", status_response.status_code, status_response.code
+            )
+        if upstream.classify_error(error) == "fatal" or attempt + 1 >= FUNASR_WAIT_ATTEMPTS:
+            logger.error(f"FunASR Wait Failed for task {task_id}: {error}")
+            raise RuntimeError(f"FunASR Wait Failed for task {task_id}: {error}") from error
+        logger.warning(f"FunASR wait for task {task_id} failed ({error}), retrying")
+        time.sleep(min(30, 2 ** attempt))
+
 def _safe_url(url: str) -> str:
     return url.split("?")[0]
 
@@ -348,13 +1091,333 @@ from sqlalchemy.orm import Session
 
 # ... (OSS and Helper Functions)
 
+# --- Speaker Helpers ---
+
+def _speaker_ids_for_labels(db: Session, meeting_id: int, labels) -> dict[str, int]:
+    """Return {label: speaker_id} for a meeting, creating missing speakers in one flush."""
+    existing = {
+        label: speaker_id
+        for speaker_id, label in db.query(Speaker.id, Speaker.label).filter(Speaker.meeting_id == meeting_id)
+    }
+    created = []
+    for label in dict.fromkeys(labels):
+        if label not in existing:
+            speaker = Speaker(meeting_id=meeting_id, label=label, name=label)
+            db.add(speaker)
+            created.append(speaker)
+    if created:
+        db.flush()
+        for speaker in created:
+            existing[speaker.label] = speaker.id
+    return existing
+
+def _speaker_display_names(db: Session, meeting_id: int) -> dict[int, str]:
+    """Resolve {speaker_id: display name} for a meeting, following merges."""
+    rows = db.query(Speaker.id, Speaker.name, Speaker.merged_into_id).filter(Speaker.meeting_id == meeting_id).all()
+    return _resolve_speaker_names(rows)
+
+def _resolve_speaker_names(rows) -> dict[int, str]:
+    """{speaker_id: display name} from rows with id / name / merged_into_id (one meeting)."""
+    by_id = {row.id: row for row in rows}
+    names = {}
+    for row in rows:
+        target, seen = row, set()
+        while target.merged_into_id in by_id and target.id not in seen:
+            seen.add(target.id)
+            target = by_id[target.merged_into_id]
+        names[row.id] = target.name
+    return names
+
+def _find_speakers(db: Session, meeting_id: int, name: str) -> list[Speaker]:
+    """Speakers currently shown as `name` (by display name or original label)."""
+    names = _speaker_display_names(db, meeting_id)
+    return [
+        s for s in db.query(Speaker).filter(Speaker.meeting_id == meeting_id).all()
+        if s.merged_into_id is None and (names.get(s.id) == name or s.label == name)
+    ]
+
+# --- 转写结果解析与批量写入 (Streaming Parse & Bulk Insert) ---
+# Long recordings produce result files with tens of thousands of sentences. They are spooled
+# to a temp file and parsed incrementally, and segments go to SQLite in executemany batches,
+# so neither the full JSON document nor one ORM object per sentence is ever held in memory.
+
+try:
+    import ijson
+except ImportError: # Optional: without it the spooled payload is parsed in one go
+    ijson = None
+
+TRANSCRIPTION_SENTENCES_PREFIX = "transcripts.item.sentences.item" # FunASR result layout
+TRANSCRIPTION_SPOOL_CHUNK = 256 * 1024
+SEGMENT_INSERT_BATCH = int(os.getenv("SEGMENT_INSERT_BATCH", "2000"))
+
+def iter_transcription_sentences(output, offset_map: OffsetMap | None = None, task_id: str | None = None) -> Iterator[dict]:
+    """
+    Sentences of a finished FunASR task, on the original timeline when `offset_map` is given.
+    The result file is downloaded before returning, so download errors surface here, not mid-insert.
+    """
+    results = output.get("results")
+    transcription_url = results[0].get("transcription_url") if results else None
+    if transcription_url:
+        logger.info(f"Fetching transcription json: {_safe_url(transcription_url)}")
+        if task_id:
+            append_debug_line(f"task_id={task_id}\ttranscription_url={_safe_url(transcription_url)}")
+        sentences = _iter_spooled_sentences(_spool_transcription(transcription_url))
+    elif results:
+        sentences = iter(_extract_sentences_from_transcription_payload({"results": results})) # Wrap to match structure
+    else:
+        sentences = iter(_extract_sentences_from_transcription_payload(output or {}))
+    if offset_map is None:
+        return sentences
+    return (offset_map.remap_sentences([sent])[0] for sent in sentences)
+
+def _spool_transcription(url: str):
+    # A local spool frees the connection quickly (the consumer may be slow DB inserts),
+    # and lets the fallback re-read payloads in other layouts
+    spool = tempfile.TemporaryFile()
+    try:
+        with requests.get(url, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(TRANSCRIPTION_SPOOL_CHUNK):
+                spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+def _iter_spooled_sentences(spool) -> Iterator[dict]:
+    with spool:
+        found = False
+        if ijson is not None:
+            for sent in ijson.items(spool, TRANSCRIPTION_SENTENCES_PREFIX, use_float=True):
+                found = True
+                yield sent
+        if not found:
+            # Other layouts (segments / utterances / nested output) need the whole document
+            spool.seek(0)
+            yield from _extract_sentences_from_transcription_payload(jsoncodec.loads(spool.read()))
+
+def insert_transcript_segments(db: Session, meeting_id: int, sentences: Iterable[dict], default_speaker: str, on_segment=None) -> tuple[int, int | None]:
+    """
+    Insert sentences as segments with batched Core executemany (no ORM objects per row).
+    Returns (segment count, last end_time in ms); `on_segment(index, row)` sees every inserted row.
+    """
+    insert_segments = Segment.__table__.insert()
+    speaker_ids: dict[str, int] = {}
+    batch, count, last_end = [], 0, None
+    for sent in sentences:
+        if not isinstance(sent, dict):
+            continue
+        speaker = _speaker_label(sent, default_speaker)
+        if speaker not in speaker_ids:
+            speaker_ids.update(_speaker_ids_for_labels(db, meeting_id, [speaker]))
+        row = {
+            "meeting_id": meeting_id,
+            "content": sent.get("text", ""),
+            "speaker": speaker,
+            "speaker_id": speaker_ids[speaker],
+            "start_time": _ms_to_mmss(sent.get("begin_time")),
+            "end_time": _ms_to_mmss(sent.get("end_time")),
+            "emotion": sent.get("emotion_tag"),
+        }
+        if on_segment:
+            on_segment(count, row)
+        batch.append(row)
+        count += 1
+        if sent.get("end_time") is not None:
+            last_end = sent["end_time"]
+        if len(batch) >= SEGMENT_INSERT_BATCH:
+            db.execute(insert_segments, batch)
+            batch = []
+    if batch:
+        db.execute(insert_segments, batch)
+    return count, last_end
+
+# --- 会议统计 (Meeting Stats) ---
+# Written together with segments (ingest, realtime writer, speaker edits), so reads are a primary-key lookup.
+
+def refresh_meeting_stats(db: Session, meeting_id: int) -> dict:
+    """Recompute a meeting's stats from its segments (one query, one vectorized pass); caller commits."""
+    rows = db.execute(
+        text("SELECT speaker_id, start_time, end_time, content, emotion FROM segments WHERE meeting_id = :id ORDER BY id"),
+        {"id": meeting_id},
+    ).all()
+    stats = meeting_stats.compute_stats(
+        [r[0] for r in rows],
+        [_timestamp_to_ms(r[1]) for r in rows],
+        [_timestamp_to_ms(r[2]) for r in rows],
+        [r[3] for r in rows],
+        [r[4] for r in rows],
+        _stats_speaker_names(db, meeting_id),
+    )
+    _store_meeting_stats(db, meeting_id, stats)
+    return stats
+
+def add_segment_to_stats(
+    db: Session, meeting_id: int, speaker_id: int | None, start_time: str | None, end_time: str | None,
+    content: str, emotion: str | None = None,
+) -> None:
+    """
+    Incremental update for a single appended segment (realtime writer); caller commits.
+    Takes the stored mm:ss timestamps, so the result matches a later refresh_meeting_stats.
+    """
+    row = db.get(MeetingStats, meeting_id)
+    if row is None:
+        refresh_meeting_stats(db, meeting_id) # Includes the new segment once it is flushed
+        return
+    name = _stats_speaker_names(db, meeting_id).get(speaker_id, "未知发言人")
+    stats = meeting_stats.add_segment(
+        _meeting_stats_dict(row), speaker_id, name,
+        _timestamp_to_ms(start_time), _timestamp_to_ms(end_time), content, emotion,
+    )
+    _store_meeting_stats(db, meeting_id, stats)
+
+def _stats_speaker_names(db: Session, meeting_id: int) -> dict[int, str]:
+    # Upload ingests label unlabelled speech "unknown_speaker_default"; show it the way the frontend does
+    return {
+        speaker_id: "未知发言人" if name == "unknown_speaker_default" else name
+        for speaker_id, name in _speaker_display_names(db, meeting_id).items()
+    }
+
+def _store_meeting_stats(db: Session, meeting_id: int, stats: dict) -> None:
+    row = db.get(MeetingStats, meeting_id) or MeetingStats(meeting_id=meeting_id)
+    row.segment_count = stats["segment_count"]
+    row.speaker_count = stats["speaker_count"]
+    row.char_count = stats["char_count"]
+    row.word_count = stats["word_count"]
+    row.talk_ms = stats["talk_ms"]
+    row.host = stats["host"]
+    row.speakers = jsoncodec.dumps(stats["speakers"])
+    row.emotions = jsoncodec.dumps(stats["emotions"])
+    row.updated_at = time.time()
+    db.add(row)
+
+def _meeting_stats_dict(row: MeetingStats) -> dict:
+    return {
+        "segment_count": row.segment_count,
+        "speaker_count": row.speaker_count,
+        "char_count": row.char_count,
+        "word_count": row.word_count,
+        "talk_ms": row.talk_ms,
+        "host": row.host,
+        "speakers": jsoncodec.loads_or_none(row.speakers) or [],
+        "emotions": jsoncodec.loads_or_none(row.emotions) or {},
+    }
+
+# --- Versioning, ETag & Rendered Payload Cache ---
+
+def _bump_meeting_version(db: Session, meeting_id: int, transcript: bool = True) -> None:
+    """
+    Mark a meeting as changed; every write path must call this before committing.
+    `transcript=False` for writes that leave segments and speakers alone (analysis results, audio URL),
+    so stored analysis results stay reusable.
+    """
+    values = {Meeting.version: Meeting.version + 1}
+    if transcript:
+        values[Meeting.transcript_version] = Meeting.transcript_version + 1
+    db.query(Meeting).filter(Meeting.id == meeting_id).update(values, synchronize_session=False)
+
+class RenderedPayloadCache:
+    """Small LRU of rendered JSON bodies keyed by (key, version), with lazily compressed variants."""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body: bytes) -> dict:
+        entry = {"version": version, "body": body, "encoded": {}}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+rendered_cache = RenderedPayloadCache(int(os.getenv("RENDERED_CACHE_SIZE", "64")))
+
+def _accepted_encodings(request: Request) -> set[str]:
+    header = request.headers.get("accept-encoding", "")
+    return {part.split(";")[0].strip().lower() for part in header.split(",") if part.strip()}
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def _cached_json_response(request: Request, cache_key, read_version, etag_for, render, attempts: int = 3) -> Response:
+    """
+    Serve a 304 / cached body / freshly rendered body for a versioned resource.
+    pysqlite runs SELECTs without a snapshot, so the version is re-read after rendering: a body
+    that raced a write is re-rendered, never cached or tagged under the version it started from.
+    """
+    for _ in range(attempts):
+        version = read_version()
+        headers = {"ETag": etag_for(version), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if _etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        entry = rendered_cache.get(cache_key, version)
+        if entry is not None:
+            break
+        body = jsoncodec.dumps_bytes(render())
+        if read_version() == version:
+            entry = rendered_cache.put(cache_key, version, body)
+            break
+    else:
+        # Still being written to (e.g. a live meeting): send the latest body untagged and uncached
+        headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+        entry = {"body": body, "encoded": {}}
+
+    body = entry["body"]
+    if len(body) >= 1024:
+        accepted = _accepted_encodings(request)
+        encoding = "br" if brotli and "br" in accepted else "gzip" if "gzip" in accepted else None
+        if encoding:
+            encoded = entry["encoded"].get(encoding)
+            if encoded is None:
+                encoded = brotli.compress(body, quality=5) if encoding == "br" else gzip.compress(body, compresslevel=6)
+                entry["encoded"][encoding] = encoded
+            body = encoded
+            headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/api/meetings")
-def get_meetings(db: Session = Depends(get_db)):
-    meetings = db.query(Meeting).order_by(Meeting.created_at.desc()).all()
+def get_meetings(request: Request, db: Session = Depends(get_db)):
+    def read_stamp() -> str:
+        count, version_sum, max_id = db.execute(
+            text("SELECT COUNT(*), COALESCE(SUM(version), 0), COALESCE(MAX(id), 0) FROM meetings")
+        ).one()
+        return f"{count}-{version_sum}-{max_id}"
+
+    return _cached_json_response(
+        request, "meetings", read_stamp, lambda stamp: f'W/"meetings-{stamp}"', lambda: _render_meeting_list(db)
+    )
+
+def _render_meeting_list(db: Session) -> list[dict]:
+    rows = (
+        db.query(Meeting, MeetingStats)
+        .outerjoin(MeetingStats, MeetingStats.meeting_id == Meeting.id)
+        .order_by(Meeting.created_at.desc())
+        .all()
+    )
+    missing = [m.id for m, stats in rows if stats is None]
+    if missing: # Meetings from before stats existed: materialize once
+        for meeting_id in missing:
+            refresh_meeting_stats(db, meeting_id)
+        db.commit()
+        rows = [(m, stats or db.get(MeetingStats, m.id)) for m, stats in rows]
     # Transform to frontend format
     result = []
-    for m in meetings:
-        # Get last segment for duration calc if needed, or use stored duration
+    for m, stats in rows:
         result.append({
             "id": str(m.id),
             "title": m.title,
@@ -362,16 +1425,32 @@ def get_meetings(db: Session = Depends(get_db)):
             "time": m.time,
             "duration": m.duration,
             "type": m.type,
-            "host": "未知发言人" # Could derive from first speaker
+            "host": stats.host or "未知发言人",
+            "segmentCount": stats.segment_count,
+            "speakerCount": stats.speaker_count,
+            "wordCount": stats.word_count,
         })
     return result
 
 @app.get("/api/meetings/{meeting_id}")
-def get_meeting_detail(meeting_id: int, db: Session = Depends(get_db)):
+def get_meeting_detail(meeting_id: int, request: Request, db: Session = Depends(get_db)):
+    def read_version() -> int:
+        version = db.query(Meeting.version).filter(Meeting.id == meeting_id).scalar()
+        if version is None: # Also when deleted while rendering
+            raise HTTPException(status_code=404, detail="Meeting not found")
+        return version
+
+    return _cached_json_response(
+        request,
+        ("meeting", meeting_id),
+        read_version,
+        lambda version: f'W/"meeting-{meeting_id}-{version}"',
+        lambda: _render_meeting_detail(db, meeting_id),
+    )
+
+def _render_meeting_detail(db: Session, meeting_id: int) -> dict:
     meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
-    if not meeting:
-        raise HTTPException(status_code=404, detail="Meeting not found")
-    
+    speaker_names = _speaker_display_names(db, meeting_id)
     segments = []
     ordered_segments = (
         db.query(Segment)
@@ -386,26 +1465,215 @@ def get_meeting_detail(meeting_id: int, db: Session = Depends(get_db)):
             "content": seg.content,
             "startTime": seg.start_time,
             "endTime": seg.end_time,
-            "speaker": seg.speaker,
+            "speaker": speaker_names.get(seg.speaker_id, seg.speaker),
+            "speakerId": seg.speaker_id,
             "emotion": seg.emotion
         })
-        
+
+    speakers = [
+        {"id": s.id, "label": s.label, "name": speaker_names.get(s.id, s.name), "merged_into": s.merged_into_id}
+        for s in meeting.speakers
+    ]
+
     return {
         "id": str(meeting.id),
         "title": meeting.title,
         "segments": segments,
+        "speakers": speakers,
         "file_url": meeting.file_url,
-        "analysis_result": json.loads(meeting.analysis_result) if meeting.analysis_result else None,
-        "chapters": json.loads(meeting.chapters) if meeting.chapters else None,
+        "audio_url": f"/api/meetings/{meeting.id}/audio" if meeting.audio_path else None,
+        "peaks_url": f"/api/meetings/{meeting.id}/peaks" if meeting.audio_path else None,
+        "analysis_result": jsoncodec.loads_or_none(meeting.analysis_result),
+        "chapters": jsoncodec.loads_or_none(meeting.chapters),
         "summary": meeting.summary,
-        "keywords": json.loads(meeting.keywords) if meeting.keywords else None
+        "keywords": jsoncodec.loads_or_none(meeting.keywords),
+        "analyses": {a.preset_id: jsoncodec.loads_or_none(a.result) for a in meeting.analyses}
+    }
+
+# --- 音频播放 (Range) 与波形峰值 (Peaks) ---
+AUDIO_STREAM_CHUNK = 256 * 1024
+AUDIO_MEDIA_TYPES = {".wav": "audio/wav", ".flac": "audio/flac", ".ogg": "audio/ogg", ".mp3": "audio/mpeg", ".m4a": "audio/mp4"}
+
+def _peaks_path(mono_path: str) -> str:
+    return os.path.splitext(mono_path)[0] + ".peaks"
+
+def _ensure_peaks(mono_path: str) -> str | None:
+    """Build the peaks file next to the mono WAV if missing; best-effort, returns its path or None."""
+    peaks_path = _peaks_path(mono_path)
+    if os.path.exists(peaks_path):
+        return peaks_path
+    try:
+        build_peaks_file(mono_path, peaks_path)
+    except Exception as e:
+        logger.warning(f"Failed to compute waveform peaks for {os.path.basename(mono_path)}: {e}")
+        return None
+    return peaks_path
+
+def _playback_file(meeting: Meeting) -> str | None:
+    """Local file to play: the encoded transport copy if present (smaller), else the mono WAV."""
+    if not meeting.audio_path:
+        return None
+    for ext, _ in AUDIO_CODECS.values():
+        encoded = os.path.splitext(meeting.audio_path)[0] + ext
+        if os.path.exists(encoded):
+            return encoded
+    return meeting.audio_path if os.path.exists(meeting.audio_path) else None
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Parse a single `bytes=` range into inclusive (start, end); None if unsatisfiable."""
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        raise ValueError("Only a single byte range is supported")
+    first, _, last = spec.strip().partition("-")
+    if not first: # Suffix range: last N bytes
+        length = int(last)
+        if length <= 0 or size == 0:
+            return None
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, end
+
+def _iter_mmap(path: str, start: int, end: int):
+    # Each slice is still copied into a bytes chunk (memoryview slices would pin the mapping open
+    # while the server holds them); the mapping saves a read() syscall per chunk and shares the OS page cache
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos <= end:
+            stop = min(end + 1, pos + AUDIO_STREAM_CHUNK)
+            yield mm[pos:stop]
+            pos = stop
+
+@app.get("/api/meetings/{meeting_id}/stats")
+def get_meeting_stats(meeting_id: int, db: Session = Depends(get_db)):
+    row = db.get(MeetingStats, meeting_id)
+    if row is None:
+        if not db.query(Meeting.id).filter(Meeting.id == meeting_id).first():
+            raise HTTPException(status_code=404, detail="Meeting not found")
+        refresh_meeting_stats(db, meeting_id)
+        db.commit()
+        row = db.get(MeetingStats, meeting_id)
+    return _meeting_stats_dict(row)
+
+@app.get("/api/meetings/{meeting_id}/audio")
+def get_meeting_audio(meeting_id: int, request: Request, db: Session = Depends(get_db)):
+    meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
+    if not meeting:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+    path = _playback_file(meeting)
+    if not path and meeting.audio_path and restorable_from_oss(meeting.audio_path):
+        # Evicted from the local cache: play from OSS now, restore the local copy in the background
+        schedule_refetch(meeting.audio_path)
+        return RedirectResponse(signed_url_for_local(meeting.audio_path), status_code=307)
+    if not path:
+        if meeting.file_url and meeting.file_url.startswith(("http://", "https://")):
+            return RedirectResponse(meeting.file_url, status_code=307)
+        raise HTTPException(status_code=404, detail="Audio not found")
+
+    touch_file(path)
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'"audio-{meeting_id}-{size:x}-{int(stat.st_mtime):x}"'
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": "private, max-age=3600"}
+    media_type = AUDIO_MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    # If-Range: only honour the range when the client's copy is still current
+    if range_header and request.headers.get("if-range", etag) != etag:
+        range_header = None
+    if size == 0: # mmap cannot map an empty file
+        return Response(content=b"", media_type=media_type, headers=headers)
+    if not range_header:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_iter_mmap(path, 0, size - 1), media_type=media_type, headers=headers)
+
+    try:
+        byte_range = _parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Range header")
+    if byte_range is None:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(_iter_mmap(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+@app.get("/api/meetings/{meeting_id}/peaks")
+def get_meeting_peaks(
+    meeting_id: int,
+    request: Request,
+    samples_per_peak: int | None = None,
+    width: int | None = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Waveform peaks as raw int8 (min, max) pairs for one resolution level.
+    Pick the level with `samples_per_peak`, or with `width` (the coarsest level with at least that many peaks).
+    """
+    meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
+    if not meeting:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+    if not meeting.audio_path:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    # Peaks are never evicted, so they are usually served even when the audio is only in OSS
+    peaks_path = _peaks_path(meeting.audio_path)
+    if not os.path.exists(peaks_path):
+        if not os.path.exists(meeting.audio_path):
+            if not restorable_from_oss(meeting.audio_path):
+                raise HTTPException(status_code=404, detail="Audio not found")
+            schedule_refetch(meeting.audio_path)
+            raise HTTPException(status_code=503, detail="Audio is being restored from OSS", headers={"Retry-After": "5"})
+        peaks_path = _ensure_peaks(meeting.audio_path)
+    if not peaks_path:
+        raise HTTPException(status_code=500, detail="Failed to compute waveform peaks")
+
+    sample_rate, total_samples, levels = read_peaks_index(peaks_path)
+    if samples_per_peak is not None:
+        level = next((lvl for lvl in levels if lvl[0] == samples_per_peak), None)
+        if level is None:
+            raise HTTPException(
+                status_code=400, detail=f"samples_per_peak must be one of {[lvl[0] for lvl in levels]}"
+            )
+    elif width:
+        candidates = [lvl for lvl in levels if lvl[1] >= width]
+        level = max(candidates, key=lambda lvl: lvl[0]) if candidates else levels[0]
+    else:
+        level = levels[-1]
+    level_samples, peak_count, offset = level
+
+    etag = f'"peaks-{meeting_id}-{level_samples}-{total_samples}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=3600",
+        "X-Sample-Rate": str(sample_rate),
+        "X-Samples-Per-Peak": str(level_samples),
+        "X-Peak-Count": str(peak_count),
+        "X-Total-Samples": str(total_samples),
     }
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    with open(peaks_path, "rb") as f:
+        f.seek(offset)
+        body = f.read(peak_count * 2)
+    return Response(content=body, media_type="application/octet-stream", headers=headers)
 
 class AnalysisRequest(BaseModel):
     speaker_map: dict[str, str] = {}
     ignored_speakers: list[str] = []
     preset_id: str
     custom_requirement: str = ""
+    force: bool = False # Always call the LLM, even if the result can be served from stored results
+
+class BatchAnalysisRequest(BaseModel):
+    speaker_map: dict[str, str] = {}
+    ignored_speakers: list[str] = []
+    preset_ids: list[str] = Field(min_length=1)
+    custom_requirement: str = ""
+    force: bool = False
 
 class UpdateSpeakerRequest(BaseModel):
     original_name: str
@@ -417,19 +1685,79 @@ def update_speaker_name(meeting_id: int, request: UpdateSpeakerRequest, db: Sess
     if not meeting:
         raise HTTPException(status_code=404, detail="Meeting not found")
         
-    # Update segments
-    # Note: SQLite may not support UPDATE ... FROM syntax in older versions, so we use standard update
-    db.query(Segment).filter(
-        Segment.meeting_id == meeting_id,
-        Segment.speaker == request.original_name
-    ).update({Segment.speaker: request.new_name}, synchronize_session=False)
-    
+    # Segments reference speakers by id, so a rename only touches the speakers table
+    speakers = _find_speakers(db, meeting_id, request.original_name)
+    if not speakers:
+        raise HTTPException(status_code=404, detail="Speaker not found")
+    for speaker in speakers:
+        speaker.name = request.new_name
+    db.flush()
+    refresh_meeting_stats(db, meeting_id)
+    _bump_meeting_version(db, meeting_id)
+
     db.commit()
-    
+
     return {"status": "success", "message": f"Updated speaker {request.original_name} to {request.new_name}"}
 
-@app.get("/api/presets")
-def get_presets():
+class MergeSpeakersRequest(BaseModel):
+    source_name: str
+    target_name: str
+
+@app.post("/api/meetings/{meeting_id}/speakers/merge")
+def merge_speakers(meeting_id: int, request: MergeSpeakersRequest, db: Session = Depends(get_db)):
+    sources = _find_speakers(db, meeting_id, request.source_name)
+    targets = _find_speakers(db, meeting_id, request.target_name)
+    if not sources or not targets:
+        raise HTTPException(status_code=404, detail="Speaker not found")
+
+    target = targets[0]
+    for speaker in sources:
+        if speaker.id != target.id:
+            speaker.merged_into_id = target.id
+    db.flush()
+    refresh_meeting_stats(db, meeting_id)
+    _bump_meeting_version(db, meeting_id)
+    db.commit()
+
+    return {"status": "success", "message": f"Merged speaker {request.source_name} into {request.target_name}"}
+
+class SplitSpeakerRequest(BaseModel):
+    segment_ids: list[str | int]
+    new_name: str
+
+@app.post("/api/meetings/{meeting_id}/speakers/split")
+def split_speaker(meeting_id: int, request: SplitSpeakerRequest, db: Session = Depends(get_db)):
+    meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
+    if not meeting:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+
+    segment_ids = []
+    for seg_id in request.segment_ids:
+        try:
+            segment_ids.append(int(str(seg_id).removeprefix("seg-")))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid segment id: {seg_id}")
+
+    owned = db.query(Segment.id).filter(Segment.meeting_id == meeting_id, Segment.id.in_(segment_ids)).count()
+    if not owned:
+        raise HTTPException(status_code=404, detail="No matching segments in this meeting")
+
+    # Only the re-assigned segments are rewritten
+    speaker = Speaker(meeting_id=meeting_id, label=request.new_name, name=request.new_name)
+    db.add(speaker)
+    db.flush()
+    updated = db.query(Segment).filter(
+        Segment.meeting_id == meeting_id,
+        Segment.id.in_(segment_ids)
+    ).update({Segment.speaker_id: speaker.id}, synchronize_session=False)
+    refresh_meeting_stats(db, meeting_id)
+    _bump_meeting_version(db, meeting_id)
+    db.commit()
+
+    return {"status": "success", "speaker_id": speaker.id, "updated": updated}
+
+def _load_presets() -> list[dict]:
+    """All presets, including hidden ones that are only reachable by id."""
     try:
         preset_path = os.path.join(os.path.dirname(__file__), "presets.json")
         if not os.path.exists(preset_path):
@@ -440,6 +1768,10 @@ def get_presets():
         logger.error(f"Failed to load presets: {e}")
         return []
 
+@app.get("/api/presets")
+def get_presets():
+    return [p for p in _load_presets() if not p.get("hidden")]
+
 def load_prompt_file(filename: str) -> str:
     try:
         path = os.path.join(os.path.dirname(__file__), "prompts", filename)
@@ -451,90 +1783,265 @@ def load_prompt_file(filename: str) -> str:
         logger.error(f"Error loading prompt file {filename}: {e}")
         return ""
 
-def perform_analysis(meeting_id: int, preset_id: str, speaker_map: dict = {}, ignored_speakers: list = [], custom_requirement: str = ""):
-    """
-    Internal synchronous analysis function to be called by API or background tasks.
-    Creates its own DB session to avoid threading issues.
-    """
-    db = SessionLocal()
+# --- Preset Dependency Graph ---
+# Each preset declares "produces": {artifact: key in its JSON result ("$" = whole result)}
+# and "consumes": [artifact, ...] which are fed to its prompt when available.
+
+def _artifact_value(preset: dict, result, artifact: str):
+    key = preset.get("produces", {}).get(artifact)
+    if key is None or not isinstance(result, dict) and key != "$":
+        return None
+    return result if key == "$" else result.get(key)
+
+def _stored_artifacts(db: Session, meeting_id: int, presets: list[dict], exclude_preset_id: str | None = None) -> dict:
+    """{artifact: value} derivable from results stored for a meeting and built from its current transcript."""
+    by_id = {p["id"]: p for p in presets}
+    artifacts = {}
+    rows = (
+        db.query(AnalysisResult.preset_id, AnalysisResult.result)
+        .join(Meeting, Meeting.id == AnalysisResult.meeting_id)
+        .filter(
+            AnalysisResult.meeting_id == meeting_id,
+            AnalysisResult.transcript_version == Meeting.transcript_version,
+        )
+        .order_by(AnalysisResult.updated_at.asc())
+    )
+    for preset_id, result in rows:
+        preset = by_id.get(preset_id)
+        if not preset or preset_id == exclude_preset_id:
+            continue
+        data = jsoncodec.loads_or_none(result)
+        for artifact in preset.get("produces", {}):
+            value = _artifact_value(preset, data, artifact)
+            if value is not None:
+                artifacts[artifact] = value
+    return artifacts
+
+def _result_from_artifacts(preset: dict, artifacts: dict):
+    """Assemble a preset's result from other presets' artifacts, or None if anything is missing."""
+    produces = preset.get("produces", {})
+    if not produces or "$" in produces.values() or not all(a in artifacts for a in produces):
+        return None
+    return {key: artifacts[artifact] for artifact, key in produces.items()}
+
+def _preset_levels(presets: list[dict]) -> list[list[dict]]:
+    """Group presets into levels so that consumers run after producers within the same batch."""
+    producers = {}
+    for p in presets:
+        for artifact in p.get("produces", {}):
+            producers.setdefault(artifact, set()).add(p["id"])
+    remaining = {p["id"]: p for p in presets}
+    done, levels = set(), []
+    while remaining:
+        level = [
+            p for p in remaining.values()
+            if all(producers.get(a, set()) - {p["id"]} <= done for a in p.get("consumes", []))
+        ]
+        if not level: # Cycle: run whatever is left together
+            level = list(remaining.values())
+        levels.append(level)
+        for p in level:
+            done.add(p["id"])
+            remaining.pop(p["id"])
+    return levels
+
+def _build_transcript_text(db: Session, meeting_id: int, speaker_map: dict, ignored_speakers: list) -> str:
+    # Resolve speaker tags once per speaker instead of once per segment
+    speaker_tags = {}
+    for speaker_id, name in _speaker_display_names(db, meeting_id).items():
+        if name in ignored_speakers:
+            speaker_tags[speaker_id] = None
+        else:
+            speaker_tags[speaker_id] = f"{name} ({speaker_map.get(name, name)})"
+
+    lines = []
+    rows = (
+        db.query(Segment.start_time, Segment.speaker, Segment.speaker_id, Segment.content)
+        .filter(Segment.meeting_id == meeting_id)
+        .order_by(Segment.id.asc())
+    )
+    for start_time, label, speaker_id, content in rows:
+        if speaker_id in speaker_tags:
+            tag = speaker_tags[speaker_id]
+        elif label in ignored_speakers:
+            tag = None
+        else:
+            tag = f"{label} ({speaker_map.get(label, label)})"
+        if tag is None:
+            continue
+        lines.append(f"[{start_time}] {tag}: {content}\n")
+    return "".join(lines)
+
+def _call_preset_llm(meeting_id: int, preset: dict, transcript_text: str, custom_requirement: str = "", consumed: dict | None = None, priority: int | None = None):
+    base_prompt = load_prompt_file("base.txt")
+    skill_prompt = load_prompt_file(preset["skill_file"])
+
+    system_prompt = f"{base_prompt}\n\n---\n你的具体任务是：\n{skill_prompt}"
+    if consumed:
+        system_prompt += f"\n\n---\n可参考的已有分析结果：\n{jsoncodec.dumps(consumed)}"
+    if custom_requirement:
+        system_prompt += f"\n\n---\n额外用户要求：\n{custom_requirement}"
+    user_prompt = f"会议录音文本如下：\n{transcript_text}"
+
+    logger.info(f"Calling Gemini for meeting {meeting_id} with preset {preset['id']}")
+    response = llm_governor.call(
+        client.chat.completions.create,
+        model="gemini-3-flash-preview", 
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        priority=priority,
+        deadline=LLM_ANALYSIS_DEADLINE,
+    )
+    
+    content = response.choices[0].message.content
+    if content.startswith("```json"): content = content[7:]
+    if content.endswith("```"): content = content[:-3]
+    content = content.strip()
+        
+    try:
+        return jsoncodec.loads(content)
+    except json.JSONDecodeError:
+        logger.error(f"Invalid JSON from Gemini for meeting {meeting_id} (preset {preset['id']})")
+        return None
+
+def _save_analysis_result(meeting_id: int, preset_id: str, analysis_data, transcript_version: int | None = None) -> bool:
+    """Persist one preset result with its own session, so batch presets can save as they finish."""
+    db = SessionLocal()
     try:
         meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
         if not meeting:
-            logger.error(f"Meeting {meeting_id} not found for analysis")
-            return None
-        
-        # 1. Load Preset
-        presets = get_presets()
-        preset = next((p for p in presets if p["id"] == preset_id), None)
-        if not preset:
-            logger.error(f"Invalid preset_id: {preset_id}")
-            return None
-        
-        base_prompt = load_prompt_file("base.txt")
-        skill_prompt = load_prompt_file(preset["skill_file"])
-        
-        # 2. Build Context
-        transcript_text = ""
-        for seg in meeting.segments:
-            if seg.speaker in ignored_speakers:
-                continue
-            display_name = speaker_map.get(seg.speaker, seg.speaker)
-            transcript_text += f"[{seg.start_time}] {seg.speaker} ({display_name}): {seg.content}\n"
-        
-        # 3. Build Prompt
-        system_prompt = f"{base_prompt}\n\n---\n你的具体任务是：\n{skill_prompt}"
-        if custom_requirement:
-            system_prompt += f"\n\n---\n额外用户要求：\n{custom_requirement}"
-        user_prompt = f"会议录音文本如下：\n{transcript_text}"
-        
-        # 4. Call Gemini
-        logger.info(f"Calling Gemini for meeting {meeting_id} with preset {preset_id}")
-        response = client.chat.completions.create(
-            model="gemini-3-flash-preview", 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        
-        content = response.choices[0].message.content
-        if content.startswith("```json"): content = content[7:]
-        if content.endswith("```"): content = content[:-3]
-        content = content.strip()
-            
-        try:
-            analysis_data = json.loads(content)
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON from Gemini for meeting {meeting_id}")
-            return None
+            logger.error(f"Meeting {meeting_id} not found when saving analysis")
+            return False
 
-        # 5. Save Result
         if preset_id == "chapters":
-            meeting.chapters = json.dumps(analysis_data, ensure_ascii=False)
+            meeting.chapters = jsoncodec.dumps(analysis_data)
         elif preset_id == "full_summary":
             meeting.summary = analysis_data.get("abstract", "")
-            meeting.keywords = json.dumps(analysis_data.get("keywords", []), ensure_ascii=False)
+            meeting.keywords = jsoncodec.dumps(analysis_data.get("keywords", []))
             chapters_data = {"chapters": analysis_data.get("chapters", [])}
-            meeting.chapters = json.dumps(chapters_data, ensure_ascii=False)
+            meeting.chapters = jsoncodec.dumps(chapters_data)
             full_summary_result = {
                 "mode": "full_summary",
                 "speaker_summaries": analysis_data.get("speaker_summaries", []),
                 "qa_pairs": analysis_data.get("qa_pairs", [])
             }
-            meeting.analysis_result = json.dumps(full_summary_result, ensure_ascii=False)
+            meeting.analysis_result = jsoncodec.dumps(full_summary_result)
         else:
-            meeting.analysis_result = json.dumps(analysis_data, ensure_ascii=False)
-        
+            meeting.analysis_result = jsoncodec.dumps(analysis_data)
+
+        row = db.query(AnalysisResult).filter(
+            AnalysisResult.meeting_id == meeting_id, AnalysisResult.preset_id == preset_id
+        ).first()
+        if row is None:
+            row = AnalysisResult(meeting_id=meeting_id, preset_id=preset_id)
+            db.add(row)
+        row.result = jsoncodec.dumps(analysis_data)
+        row.updated_at = datetime.now()
+        row.transcript_version = transcript_version
+        _bump_meeting_version(db, meeting_id, transcript=False)
+
         db.commit()
-        logger.info(f"Analysis completed for meeting {meeting_id}")
-        return analysis_data
-        
+        if preset_id in ("full_summary", "chapters"): # Summaries and chapters are /chat passages
+            index_meeting_passages_safe(meeting_id)
+        return True
     except Exception as e:
-        logger.error(f"Internal analysis failed for meeting {meeting_id}: {e}")
+        logger.error(f"Saving analysis failed for meeting {meeting_id} ({preset_id}): {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+class MeetingNotFoundError(LookupError):
+    pass
+
+def perform_analysis(meeting_id: int, preset_id: str, speaker_map: dict = {}, ignored_speakers: list = [], custom_requirement: str = "", force: bool = False):
+    """
+    Internal synchronous analysis function to be called by API or background tasks.
+    Creates its own DB session to avoid threading issues.
+    """
+    try:
+        results = run_analysis_batch(meeting_id, [preset_id], speaker_map, ignored_speakers, custom_requirement, force)
+    except MeetingNotFoundError:
         return None
+    return results.get(preset_id)
+
+def run_analysis_batch(meeting_id: int, preset_ids: list[str], speaker_map: dict = {}, ignored_speakers: list = [], custom_requirement: str = "", force: bool = False) -> dict:
+    """
+    Run several presets over one prepared transcript.
+    Presets whose outputs can be assembled from stored results skip the LLM call;
+    the rest run in parallel per dependency level and are persisted as each completes.
+    Returns {preset_id: result or None}; raises MeetingNotFoundError for an unknown meeting.
+    """
+    db = SessionLocal()
+    try:
+        meeting_row = db.query(Meeting.id, Meeting.transcript_version).filter(Meeting.id == meeting_id).first()
+        if not meeting_row:
+            logger.error(f"Meeting {meeting_id} not found for analysis")
+            raise MeetingNotFoundError(meeting_id)
+        # Results over a customized transcript or prompt are not reused for (or by) later requests
+        customized = bool(speaker_map or ignored_speakers or custom_requirement)
+        transcript_version = None if customized else meeting_row.transcript_version
+
+        presets = {p["id"]: p for p in _load_presets()}
+        results = {}
+        selected = []
+        for preset_id in dict.fromkeys(preset_ids):
+            if preset_id in presets:
+                selected.append(presets[preset_id])
+            else:
+                logger.error(f"Invalid preset_id: {preset_id}")
+                results[preset_id] = None
+
+        artifacts = {} if customized else _stored_artifacts(db, meeting_id, list(presets.values()))
+        to_run = []
+        for preset in selected:
+            reused = None
+            if not force and not customized:
+                # A preset is only assembled from other presets' results, never re-served from its own row
+                reused = _result_from_artifacts(preset, _stored_artifacts(db, meeting_id, list(presets.values()), preset["id"]))
+            if reused is not None:
+                logger.info(f"Serving preset {preset['id']} for meeting {meeting_id} from stored results")
+                results[preset["id"]] = reused
+            else:
+                to_run.append(preset)
+        if not to_run:
+            return results
+
+        transcript_text = _build_transcript_text(db, meeting_id, speaker_map, ignored_speakers)
     finally:
         db.close()
 
+    priority = upstream.current_priority() # Pool threads below do not inherit the caller's context
+
+    def run_one(preset: dict):
+        try:
+            consumed = {a: artifacts[a] for a in preset.get("consumes", []) if a in artifacts}
+            data = _call_preset_llm(meeting_id, preset, transcript_text, custom_requirement, consumed, priority)
+            if data is None or not _save_analysis_result(meeting_id, preset["id"], data, transcript_version):
+                return None
+            logger.info(f"Analysis completed for meeting {meeting_id} ({preset['id']})")
+            return data
+        except Exception as e:
+            logger.error(f"Internal analysis failed for meeting {meeting_id} ({preset['id']}): {e}")
+            return None
+
+    for level in _preset_levels(to_run):
+        if len(level) == 1:
+            outputs = [run_one(level[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(level)) as pool:
+                outputs = list(pool.map(run_one, level))
+        for preset, data in zip(level, outputs):
+            results[preset["id"]] = data
+            if data is not None:
+                for artifact in preset.get("produces", {}):
+                    value = _artifact_value(preset, data, artifact)
+                    if value is not None:
+                        artifacts[artifact] = value
+    return results
+
 @app.post("/api/meetings/{meeting_id}/analysis")
 async def analyze_meeting(meeting_id: int, request: AnalysisRequest, db: Session = Depends(get_db)):
     # Reuse the internal logic, but run in thread pool to avoid blocking async loop if synchronous
@@ -547,7 +2054,8 @@ async def analyze_meeting(meeting_id: int, request: AnalysisRequest, db: Session
         request.preset_id, 
         request.speaker_map, 
         request.ignored_speakers, 
-        request.custom_requirement
+        request.custom_requirement,
+        request.force
     )
     
     if result is None:
@@ -555,10 +2063,530 @@ async def analyze_meeting(meeting_id: int, request: AnalysisRequest, db: Session
          
     return {"status": "success", "result": result}
 
+@app.post("/api/meetings/{meeting_id}/analysis/batch")
+async def analyze_meeting_batch(meeting_id: int, request: BatchAnalysisRequest):
+    loop = asyncio.get_running_loop()
+    try:
+        results = await loop.run_in_executor(
+            None,
+            run_analysis_batch,
+            meeting_id,
+            request.preset_ids,
+            request.speaker_map,
+            request.ignored_speakers,
+            request.custom_requirement,
+            request.force
+        )
+    except MeetingNotFoundError:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+
+    failed = [preset_id for preset_id, result in results.items() if result is None]
+    return {"status": "partial" if failed else "success", "results": results, "failed": failed}
+
+# --- 会议问答 (/chat, Retrieval-Augmented) ---
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", "8"))
+CHAT_INDEX_SYNC_INTERVAL = float(os.getenv("CHAT_INDEX_SYNC_INTERVAL", "60")) # Background catch-up of the passage index
+CHAT_PASSAGES_PER_MEETING = 1_000_000 # rowid = meeting_id * this + n, so a meeting's passages are one rowid range
+
+def _chat_rowid_range(meeting_id: int) -> tuple[int, int]:
+    first = meeting_id * CHAT_PASSAGES_PER_MEETING
+    return first, first + CHAT_PASSAGES_PER_MEETING - 1
+
+def index_meeting_passages(db: Session, meeting_id: int) -> int:
+    """(Re)build the /chat passages of one meeting; returns the number of passages indexed."""
+    first, last = _chat_rowid_range(meeting_id)
+    db.execute(text("DELETE FROM chat_passages WHERE rowid BETWEEN :first AND :last"), {"first": first, "last": last})
+    meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
+    if not meeting:
+        db.query(ChatIndexState).filter(ChatIndexState.meeting_id == meeting_id).delete()
+        db.commit()
+        return 0
+
+    speaker_names = _speaker_display_names(db, meeting_id)
+    rows = (
+        db.query(Segment.id, Segment.content, Segment.speaker, Segment.speaker_id, Segment.start_time, Segment.end_time)
+        .filter(Segment.meeting_id == meeting_id)
+        .order_by(Segment.id.asc())
+        .all()
+    )
+    passages = [
+        {**p, "kind": "transcript"}
+        for p in transcript_index.build_passages([
+            {
+                "id": row.id,
+                "content": row.content,
+                "speaker": None if row.speaker == "unknown_speaker_default" else speaker_names.get(row.speaker_id, row.speaker),
+                "start_time": row.start_time,
+                "end_time": row.end_time,
+            }
+            for row in rows
+        ])
+    ]
+    if meeting.summary:
+        passages.append({"kind": "summary", "content": f"{meeting.title}\n{meeting.summary}", "start_time": None})
+    for chapter in (jsoncodec.loads_or_none(meeting.chapters) or {}).get("chapters") or []:
+        if isinstance(chapter, dict) and (chapter.get("title") or chapter.get("summary")):
+            passages.append({
+                "kind": "chapter",
+                "content": f"{chapter.get('title', '')}: {chapter.get('summary', '')}",
+                "start_time": chapter.get("timestamp"),
+            })
+
+    if passages:
+        db.execute(
+            text(
+                "INSERT INTO chat_passages (rowid, tokens, meeting_id, kind, start_time, end_time, segment_id, speakers, content) "
+                "VALUES (:rowid, :tokens, :meeting_id, :kind, :start_time, :end_time, :segment_id, :speakers, :content)"
+            ),
+            [
+                {
+                    "rowid": first + n,
+                    "tokens": transcript_index.index_text(p["content"]),
+                    "meeting_id": meeting_id,
+                    "kind": p["kind"],
+                    "start_time": p.get("start_time"),
+                    "end_time": p.get("end_time"),
+                    "segment_id": p.get("segment_id"),
+                    "speakers": jsoncodec.dumps(p.get("speakers") or []),
+                    "content": p["content"],
+                }
+                for n, p in enumerate(passages[:CHAT_PASSAGES_PER_MEETING])
+            ],
+        )
+    state = db.query(ChatIndexState).filter(ChatIndexState.meeting_id == meeting_id).first()
+    if state is None:
+        state = ChatIndexState(meeting_id=meeting_id)
+        db.add(state)
+    state.version = meeting.version
+    db.commit()
+    return len(passages)
+
+def sync_chat_index(db: Session) -> int:
+    """Reindex meetings whose version moved since they were indexed (new, renamed, re-analyzed, deleted)."""
+    stale = [
+        row[0] for row in db.execute(text(
+            "SELECT m.id FROM meetings m LEFT JOIN chat_index_state s ON s.meeting_id = m.id "
+            "WHERE s.version IS NULL OR s.version != m.version "
+            "UNION SELECT s.meeting_id FROM chat_index_state s "
+            "WHERE NOT EXISTS (SELECT 1 FROM meetings m WHERE m.id = s.meeting_id)"
+        ))
+    ]
+    for meeting_id in stale:
+        index_meeting_passages(db, meeting_id)
+    if stale:
+        logger.info(f"Chat index: reindexed {len(stale)} meetings")
+    return len(stale)
+
+def index_meeting_passages_safe(meeting_id: int) -> None:
+    """Best-effort incremental indexing from the ingest paths; the background indexer catches up anything missed."""
+    db = SessionLocal()
+    try:
+        index_meeting_passages(db, meeting_id)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Chat index update failed for meeting {meeting_id}: {e}")
+    finally:
+        db.close()
+
+def start_chat_indexer() -> threading.Event:
+    """
+    Re-syncs the passage index at startup and every CHAT_INDEX_SYNC_INTERVAL seconds.
+    /chat searches whatever is indexed, so edits and live meetings (whose version moves with
+    every saved segment) are reindexed at most once per interval instead of on every query.
+    """
+    stop_event = threading.Event()
+
+    def loop():
+        while True:
+            db = SessionLocal()
+            try:
+                sync_chat_index(db)
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Chat indexer error: {e}")
+            finally:
+                db.close()
+            if stop_event.wait(CHAT_INDEX_SYNC_INTERVAL):
+                return
+
+    threading.Thread(target=loop, name="chat-indexer", daemon=True).start()
+    return stop_event
+
+def search_chat_passages(query: str, top_k: int = CHAT_TOP_K, meeting_id: int | None = None) -> list[dict]:
+    db = SessionLocal()
+    try:
+        columns = "rowid, meeting_id, kind, start_time, end_time, segment_id, speakers, content"
+        scope, params = "", {"k": top_k}
+        if meeting_id is not None:
+            scope = " AND rowid BETWEEN :first AND :last"
+            params["first"], params["last"] = _chat_rowid_range(meeting_id)
+
+        match = transcript_index.match_query(query)
+        rows = []
+        if match:
+            rows = db.execute(
+                text(f"SELECT {columns} FROM chat_passages WHERE chat_passages MATCH :q{scope} ORDER BY bm25(chat_passages) LIMIT :k"),
+                {**params, "q": match},
+            ).all()
+        if not rows:
+            # Nothing matched lexically (e.g. "每周回顾"): fall back to the most recent summaries
+            rows = db.execute(
+                text(f"SELECT {columns} FROM chat_passages WHERE kind = 'summary'{scope} ORDER BY rowid DESC LIMIT :k"),
+                params,
+            ).all()
+
+        meetings = {
+            m.id: m for m in db.query(Meeting.id, Meeting.title, Meeting.date)
+            .filter(Meeting.id.in_({row.meeting_id for row in rows})).all()
+        }
+        passages = []
+        for row in rows:
+            meeting = meetings.get(row.meeting_id)
+            passages.append({
+                "meeting_id": row.meeting_id,
+                "meeting_title": meeting.title if meeting else None,
+                "date": meeting.date if meeting else None,
+                "kind": row.kind,
+                "start_time": row.start_time,
+                "end_time": row.end_time,
+                "segment_id": f"seg-{row.segment_id}" if row.segment_id else None,
+                "speakers": jsoncodec.loads_or_none(row.speakers) or [],
+                "content": row.content,
+            })
+        return passages
+    finally:
+        db.close()
+
+def _build_chat_messages(message: str, passages: list[dict]) -> list[dict]:
+    blocks = []
+    for i, p in enumerate(passages, 1):
+        when = f" {p['start_time']}" if p["start_time"] else ""
+        label = {"summary": "摘要", "chapter": "章节"}.get(p["kind"], "转写")
+        blocks.append(f"[{i}] 《{p['meeting_title']}》({p['date']}{when}，{label})\n{p['content']}")
+    system_prompt = (
+        "你是会议记录助手。只依据下面提供的会议片段回答用户的问题，"
+        "每个结论后用 [编号] 标注所依据的片段；片段中没有相关信息时直接说明，不要编造。"
+    )
+    context = "\n\n".join(blocks) if blocks else "（没有检索到相关会议内容）"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"会议片段：\n{context}\n\n问题：{message}"},
+    ]
+
+def _chat_citations(passages: list[dict]) -> list[dict]:
+    return [
+        {
+            "index": i,
+            **{key: p[key] for key in ("meeting_id", "meeting_title", "date", "kind", "start_time", "end_time", "segment_id", "speakers")},
+            "snippet": p["content"][:160],
+        }
+        for i, p in enumerate(passages, 1)
+    ]
+
+class ChatRequest(BaseModel):
+    message: str
+    meeting_id: int | None = None # Restrict retrieval to one meeting
+    top_k: int = CHAT_TOP_K
+    stream: bool = False # Server-sent events: citations, then answer deltas
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Empty message")
+    loop = asyncio.get_running_loop()
+    passages = await loop.run_in_executor(
+        None, search_chat_passages, request.message, max(1, min(request.top_k, 20)), request.meeting_id
+    )
+    messages = _build_chat_messages(request.message, passages)
+    citations = _chat_citations(passages)
+
+    if not request.stream:
+        response = await llm_governor.acall(
+            async_client.chat.completions.create, model="gemini-3-flash-preview", messages=messages,
+            priority=upstream.PRIORITY_HIGH, deadline=LLM_CHAT_DEADLINE,
+        )
+        return {"response": response.choices[0].message.content, "citations": citations}
+
+    async def event_stream():
+        yield f"data: {jsoncodec.dumps({'type': 'citations', 'citations': citations})}\n\n"
+        try:
+            # Closes the upstream response (and frees the LLM slot) when the client disconnects
+            async with llm_governor.astream(
+                async_client.chat.completions.create, model="gemini-3-flash-preview", messages=messages, stream=True,
+                priority=upstream.PRIORITY_HIGH, deadline=LLM_CHAT_DEADLINE,
+            ) as stream:
+                async for chunk in stream:
+                    content = chunk.choices[0].delta.content if chunk.choices else None
+                    if content:
+                        yield f"data: {jsoncodec.dumps({'type': 'delta', 'content': content})}\n\n"
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}")
+            yield f"data: {jsoncodec.dumps({'type': 'error', 'content': str(e)})}\n\n"
+        yield f"data: {jsoncodec.dumps({'type': 'done'})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+
+# --- 批量导出 (Streaming Export) ---
+EXPORT_BATCH_ROWS = 1000 # Rows fetched per round trip from the server-side cursors
+EXPORT_FLUSH_BYTES = 64 * 1024 # Response chunk size
+EXPORT_CSV_COLUMNS = {
+    "meetings": ["meeting_id", "title", "date", "time", "duration", "type", "file_url", "summary", "keywords"],
+    "segments": ["meeting_id", "segment_id", "start_time", "end_time", "speaker", "speaker_label", "content", "emotion"],
+    "analyses": ["meeting_id", "preset_id", "result"],
+}
+
+class _MeetingGroups:
+    """Walks rows ordered by meeting_id, handing out one meeting's rows at a time."""
+
+    def __init__(self, rows):
+        self._groups = itertools.groupby(rows, key=lambda row: row.meeting_id)
+        self._current = next(self._groups, None)
+
+    def take(self, meeting_id: int) -> list:
+        while self._current is not None and self._current[0] < meeting_id:
+            self._current = next(self._groups, None)
+        if self._current is None or self._current[0] != meeting_id:
+            return []
+        rows = list(self._current[1])
+        self._current = next(self._groups, None)
+        return rows
+
+def _export_filter(since_id: int, date_from: str | None, date_to: str | None) -> tuple[str, dict]:
+    clauses, params = ["m.id > :since_id"], {"since_id": since_id}
+    if date_from:
+        clauses.append("m.date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        clauses.append("m.date <= :date_to")
+        params["date_to"] = date_to
+    return " AND ".join(clauses), params
+
+def iter_meeting_exports(
+    conn,
+    since_id: int = 0,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    segments: bool = True,
+    analyses: bool = True,
+):
+    """
+    Yield one export record per meeting (ordered by id) in constant memory.
+
+    Meetings, speakers, segments and analyses are each read with a streaming cursor
+    ordered by meeting_id and merge-joined here, so the whole database is a handful
+    of sequential index scans instead of one ORM query per meeting.
+    """
+    where, params = _export_filter(since_id, date_from, date_to)
+    streaming = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS)
+
+    def stream(sql: str):
+        return streaming.execute(text(sql), params)
 
+    meetings = stream(
+        "SELECT m.id, m.title, m.date, m.time, m.duration, m.type, m.file_url, m.summary, m.keywords, m.chapters "
+        f"FROM meetings m WHERE {where} ORDER BY m.id"
+    )
+    speakers = _MeetingGroups(stream(
+        "SELECT sp.meeting_id, sp.id, sp.label, sp.name, sp.merged_into_id "
+        f"FROM speakers sp JOIN meetings m ON m.id = sp.meeting_id WHERE {where} ORDER BY sp.meeting_id, sp.id"
+    ))
+    segment_groups = _MeetingGroups(stream(
+        "SELECT s.meeting_id, s.id, s.start_time, s.end_time, s.speaker, s.speaker_id, s.content, s.emotion "
+        f"FROM segments s JOIN meetings m ON m.id = s.meeting_id WHERE {where} ORDER BY s.meeting_id, s.id"
+    )) if segments else None
+    analysis_groups = _MeetingGroups(stream(
+        "SELECT a.meeting_id, a.preset_id, a.result, a.updated_at "
+        f"FROM analysis_results a JOIN meetings m ON m.id = a.meeting_id WHERE {where} ORDER BY a.meeting_id, a.id"
+    )) if analyses else None
+
+    for m in meetings:
+        speaker_rows = speakers.take(m.id)
+        names = _resolve_speaker_names(speaker_rows)
+        record = {
+            "id": m.id,
+            "title": m.title,
+            "date": m.date,
+            "time": m.time,
+            "duration": m.duration,
+            "type": m.type,
+            "file_url": m.file_url,
+            "summary": m.summary,
+            "keywords": jsoncodec.loads_or_none(m.keywords),
+            "chapters": jsoncodec.loads_or_none(m.chapters),
+            "speakers": [
+                {"id": row.id, "label": row.label, "name": names.get(row.id, row.name), "merged_into": row.merged_into_id}
+                for row in speaker_rows
+            ],
+        }
+        if segment_groups is not None:
+            record["segments"] = [
+                {
+                    "id": row.id,
+                    "start_time": row.start_time,
+                    "end_time": row.end_time,
+                    "speaker": names.get(row.speaker_id, row.speaker),
+                    "speaker_label": row.speaker,
+                    "content": row.content,
+                    "emotion": row.emotion,
+                }
+                for row in segment_groups.take(m.id)
+            ]
+        if analysis_groups is not None:
+            record["analyses"] = {
+                row.preset_id: jsoncodec.loads_or_none(row.result) for row in analysis_groups.take(m.id)
+            }
+        yield record
+
+def _buffered(chunks):
+    """Coalesce small encoded pieces into ~EXPORT_FLUSH_BYTES chunks."""
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+def iter_export_jsonl(**filters):
+    with engine.connect() as conn:
+        yield from _buffered(
+            jsoncodec.dumps_bytes(record) + b"\n" for record in iter_meeting_exports(conn, **filters)
+        )
+
+def _csv_rows(table: str, records):
+    for record in records:
+        if table == "meetings":
+            yield [record["id"], record["title"], record["date"], record["time"], record["duration"],
+                   record["type"], record["file_url"], record["summary"], jsoncodec.dumps(record["keywords"] or [])]
+        elif table == "segments":
+            for seg in record["segments"]:
+                yield [record["id"], seg["id"], seg["start_time"], seg["end_time"], seg["speaker"],
+                       seg["speaker_label"], seg["content"], seg["emotion"]]
+        else:
+            for preset_id, result in record["analyses"].items():
+                yield [record["id"], preset_id, jsoncodec.dumps(result)]
+
+def iter_export_csv(table: str, **filters):
+    if table not in EXPORT_CSV_COLUMNS:
+        raise ValueError(f"Unknown export table: {table}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the UTF-8 (Chinese) text correctly
+    yield "\ufeff".encode("utf-8")
+    writer.writerow(EXPORT_CSV_COLUMNS[table])
+    with engine.connect() as conn:
+        records = iter_meeting_exports(
+            conn, segments=table == "segments", analyses=table == "analyses", **filters
+        )
+        for row in _csv_rows(table, records):
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def _timestamp_to_ms(value: str | None) -> int | None:
+    """Parse the stored "MM:SS" / "HH:MM:SS" segment timestamps."""
+    if not value:
+        return None
+    try:
+        parts = [int(p) for p in value.split(":")]
+    except ValueError:
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds * 1000
+
+def _subtitle_time(ms: int, fmt: str) -> str:
+    hours, rest = divmod(ms, 3600_000)
+    minutes, rest = divmod(rest, 60_000)
+    seconds, millis = divmod(rest, 1000)
+    separator = "," if fmt == "srt" else "."
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{millis:03d}"
+
+def iter_subtitles(meeting_id: int, fmt: str = "srt", with_speakers: bool = True):
+    """Yield SRT/VTT cues for one meeting; a cue without an end runs until the next cue (max 5 s)."""
+    with engine.connect() as conn:
+        names = _resolve_speaker_names(conn.execute(
+            text("SELECT id, name, merged_into_id FROM speakers WHERE meeting_id = :m"), {"m": meeting_id}
+        ).all())
+        rows = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS).execute(
+            text("SELECT start_time, end_time, speaker, speaker_id, content FROM segments WHERE meeting_id = :m ORDER BY id"),
+            {"m": meeting_id},
+        )
+        if fmt == "vtt":
+            yield b"WEBVTT\n\n"
+        yield from _buffered(
+            cue.encode("utf-8") for cue in _subtitle_cues(rows, names, fmt, with_speakers)
+        )
+
+def _subtitle_cues(rows, names: dict[int, str], fmt: str, with_speakers: bool):
+    # Hold back one cue: its end time may come from the next cue's start
+    index, previous = 0, None
+    for row in itertools.chain(rows, [None]):
+        start = _timestamp_to_ms(row.start_time) if row is not None else None
+        if row is not None and (start is None or not (row.content or "").strip()):
+            continue
+        if previous is not None:
+            prev_start, prev_end, line = previous
+            if prev_end is None or prev_end <= prev_start:
+                prev_end = prev_start + 5000 if start is None or start <= prev_start else min(start, prev_start + 5000)
+            index += 1
+            cue = f"{_subtitle_time(prev_start, fmt)} --> {_subtitle_time(prev_end, fmt)}\n{line}\n\n"
+            yield f"{index}\n{cue}" if fmt == "srt" else cue
+        if row is None:
+            break
+        content = row.content.strip()
+        speaker = names.get(row.speaker_id, row.speaker)
+        if with_speakers and speaker and speaker != "unknown_speaker_default":
+            content = f"<v {speaker}>{content}" if fmt == "vtt" else f"{speaker}: {content}"
+        previous = (start, _timestamp_to_ms(row.end_time), content)
+
+def _export_filename_headers(filename: str) -> dict:
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+@app.get("/api/export/meetings.jsonl")
+def export_meetings_jsonl(
+    since_id: int = 0, date_from: str | None = None, date_to: str | None = None,
+    segments: bool = True, analyses: bool = True,
+):
+    """One JSON object per meeting with its speakers, segments and parsed analysis results."""
+    return StreamingResponse(
+        iter_export_jsonl(since_id=since_id, date_from=date_from, date_to=date_to, segments=segments, analyses=analyses),
+        media_type="application/x-ndjson",
+        headers=_export_filename_headers("meetings.jsonl"),
+    )
+
+@app.get("/api/export/{table}.csv")
+def export_table_csv(table: str, since_id: int = 0, date_from: str | None = None, date_to: str | None = None):
+    if table not in EXPORT_CSV_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown export table, expected one of {list(EXPORT_CSV_COLUMNS)}")
+    return StreamingResponse(
+        iter_export_csv(table, since_id=since_id, date_from=date_from, date_to=date_to),
+        media_type="text/csv; charset=utf-8",
+        headers=_export_filename_headers(f"{table}.csv"),
+    )
+
+@app.get("/api/meetings/{meeting_id}/subtitles.{fmt}")
+def export_subtitles(meeting_id: int, fmt: str, speakers: bool = True, db: Session = Depends(get_db)):
+    if fmt not in ("srt", "vtt"):
+        raise HTTPException(status_code=404, detail="Subtitle format must be srt or vtt")
+    if not db.query(Meeting.id).filter(Meeting.id == meeting_id).first():
+        raise HTTPException(status_code=404, detail="Meeting not found")
+    return StreamingResponse(
+        iter_subtitles(meeting_id, fmt, with_speakers=speakers),
+        media_type="application/x-subrip; charset=utf-8" if fmt == "srt" else "text/vtt; charset=utf-8",
+        headers=_export_filename_headers(f"meeting_{meeting_id}.{fmt}"),
+    )
 
 @app.post("/api/asr/file")
-async def file_transcribe(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def file_transcribe(file: UploadFile = File(...), wait: bool = True):
     filename = file.filename or "audio.wav"
     # ... (Existing hash and upload logic)
     ext = os.path.splitext(filename)[1].lower().lstrip(".") or "wav"
@@ -569,137 +2597,203 @@ async def file_transcribe(file: UploadFile = File(...), db: Session = Depends(ge
     
     if os.path.exists(local_path):
         logger.info(f"File exists locally: {local_name}")
+        touch_file(local_path)
     else:
         with open(local_path, "wb") as f:
             f.write(content)
-            
+
+    # wait=false: hand the whole pipeline to a worker and return immediately
+    if not wait:
+        job_id = enqueue_job("transcribe", {"local_path": local_path, "filename": filename, "file_hash": file_hash})
+        return {"status": "queued", "job_id": job_id}
+
+    loop = asyncio.get_running_loop()
     try:
-        mono_path = ensure_mono_wav(local_path, file_hash)
-        mono_hash = calculate_file_hash_from_file(mono_path)
-        mono_filename = f"{os.path.splitext(filename)[0]}_mono.wav"
+        return await loop.run_in_executor(None, transcribe_local_file, local_path, filename, file_hash)
+    except Exception as e:
+        logger.error(f"File Transcription Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        asr_url = upload_to_oss(mono_path, mono_filename, mono_hash)
-        
-        # 2. Submit FunASR Task and Wait for Result (Synchronous wait inside)
-        output = transcribe_with_fun_asr(asr_url)
-        task_id = output.task_id
-        
-        # 3. Parse Result
-        # FunASR/Paraformer result parsing
-        
-        # Check for transcription_url (large file)
-        transcription_url = None
-        results = output.get("results")
-        if results and len(results) > 0:
-            first_res = results[0]
-            transcription_url = first_res.get("transcription_url")
-        
-        transcription_payload = None
-        if transcription_url:
-            logger.info(f"Fetching transcription json: {_safe_url(transcription_url)}")
-            append_debug_line(f"task_id={task_id}\ttranscription_url={_safe_url(transcription_url)}")
-            r = requests.get(transcription_url, timeout=30); r.raise_for_status()
-            transcription_payload = r.json()
-        elif results:
-            transcription_payload = {"results": results} # Wrap to match structure
+def transcribe_local_file(local_path: str, filename: str, file_hash: str, job_id: int | None = None) -> dict:
+    """
+    Full offline pipeline for a stored upload: mono WAV -> OSS -> FunASR -> new meeting.
+    Synchronous; used by the upload endpoint (in a thread) and by "transcribe" jobs.
+    The stages are separate functions so import_archive.py can run them with their own concurrency.
+    """
+    meeting_id = None
+    try:
+        mono_path, asr_path, offset_map = prepare_audio_for_asr(local_path, file_hash)
+        if asr_path is None: # Long recording: split into chunks transcribed in parallel
+            task_id, sentences = transcribe_long_audio(mono_path, file_hash)
+            file_url = _local_audio_url(encode_for_transport(mono_path))
         else:
-             # Fallback
-             transcription_payload = output
-            
-        sentences = _extract_sentences_from_transcription_payload(transcription_payload or {})
+            asr_url = upload_for_asr(asr_path, filename)
+            task_id, sentences = iter_asr_sentences(asr_url, offset_map)
+            file_url = asr_url if offset_map is None else _local_audio_url(encode_for_transport(mono_path))
+        meeting_id, frontend_segments = save_transcribed_meeting(filename, mono_path, file_url, sentences, job_id=job_id)
+        return {
+            "task_id": task_id,
+            "status": "succeeded",
+            "meeting_id": str(meeting_id), # Return DB ID
+            "segments": frontend_segments
+        }
+    finally:
+        # Trigger auto-summary (Best Effort, picked up by a worker)
+        if meeting_id:
+            enqueue_job("analysis", {"meeting_id": meeting_id, "preset_id": "full_summary"})
 
-        if os.getenv("ASR_DEBUG") == "1":
-            first_keys = list(sentences[0].keys()) if sentences and isinstance(sentences[0], dict) else []
-            speaker_ids = []
-            for s in sentences:
-                if not isinstance(s, dict):
-                    continue
-                if "speaker_id" in s and s.get("speaker_id") is not None:
-                    speaker_ids.append(s.get("speaker_id"))
-            append_debug_line(f"task_id={task_id}\tsentences={len(sentences)}\tspeaker_id_count={len(speaker_ids)}\tunique_speakers={sorted(set(speaker_ids))[:20]}\tfirst_sentence_keys={first_keys}")
-        
-        if not sentences:
-             logger.error(f"No sentences found. task_id={task_id} keys={list(output.keys())}")
-             # Don't raise error immediately, allow empty meeting? No, better raise.
-             # raise HTTPException(status_code=500, detail={"msg": "转写结果为空", "task_id": task_id})
-        
-        # 4. Save to Database
-        now = datetime.now()
-        duration_str = "00:00"
-        if sentences:
-            last_end = sentences[-1].get("end_time")
-            duration_str = _ms_to_mmss(last_end) or "00:00"
+def prepare_audio_for_asr(local_path: str, file_hash: str) -> tuple[str, str | None, OffsetMap | None]:
+    """
+    Local CPU stage: returns (mono_path, path to upload for ASR, offset map or None).
+    The upload path is None for recordings that go through transcribe_long_audio instead.
+    """
+    mono_path = ensure_mono_wav(local_path, file_hash)
+    _ensure_peaks(mono_path)
+    if _is_long_audio(mono_path):
+        return mono_path, None, None
+    asr_path, offset_map = trim_silence_for_asr(mono_path, file_hash)
+    asr_path = encode_for_transport(asr_path)
+    return mono_path, asr_path, offset_map
+
+# --- 长音频分片并行转写 (Long Audio Split & Stitch) ---
+# One FunASR task over a multi-hour file takes hours end to end. Long recordings are cut in
+# silences into overlapping chunks, transcribed as parallel tasks and stitched back together
+# (see long_audio.py). VAD trimming does not apply here: the chunks already start and end in silence.
+LONG_AUDIO_SPLIT = os.getenv("LONG_AUDIO_SPLIT", "0") == "1"
+LONG_AUDIO_MIN_SECONDS = float(os.getenv("LONG_AUDIO_MIN_MINUTES", "60")) * 60
+LONG_AUDIO_CHUNK_SECONDS = float(os.getenv("LONG_AUDIO_CHUNK_MINUTES", "15")) * 60
+LONG_AUDIO_OVERLAP_SECONDS = float(os.getenv("LONG_AUDIO_OVERLAP_SECONDS", "60"))
+LONG_AUDIO_PARALLEL = int(os.getenv("LONG_AUDIO_PARALLEL", "8")) # Also bounded by the asr governor
+
+def _is_long_audio(mono_path: str) -> bool:
+    # 16 kHz 16-bit mono: 32000 bytes per second after the 44-byte header
+    return LONG_AUDIO_SPLIT and max(0, os.path.getsize(mono_path) - 44) / 32000 >= LONG_AUDIO_MIN_SECONDS
+
+def transcribe_long_audio(mono_path: str, file_hash: str) -> tuple[str, list[dict]]:
+    """Chunked, parallel FunASR over a long mono WAV; returns (comma-joined task ids, stitched sentences)."""
+    samples, sample_rate = read_wav_memmap(mono_path)
+    chunks = long_audio.plan_chunks(
+        samples, sample_rate, int(LONG_AUDIO_CHUNK_SECONDS * 1000), int(LONG_AUDIO_OVERLAP_SECONDS * 1000)
+    )
+    logger.info(f"Long audio {os.path.basename(mono_path)}: {len(samples) / sample_rate / 60:.0f} min in {len(chunks)} chunks")
+    priority = upstream.current_priority() # Pool threads below do not inherit the caller's context
 
+    def run(chunk: long_audio.AudioChunk) -> tuple[str, list[dict]]:
+        part_path = os.path.join(UPLOAD_DIR, f"{file_hash}_part{chunk.index}.wav")
+        paths = [part_path]
+        try:
+            write_wav_slice(samples, sample_rate, chunk.start_ms, chunk.end_ms, part_path)
+            asr_path = encode_for_transport(part_path)
+            paths.append(asr_path)
+            asr_url = upload_for_asr(asr_path, os.path.basename(part_path), track=False)
+            with upstream.priority(priority):
+                return fetch_asr_sentences(asr_url)
+        finally:
+            for path in set(paths): # Chunk copies are only needed for the upload
+                if os.path.exists(path):
+                    os.remove(path)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(LONG_AUDIO_PARALLEL, len(chunks))), thread_name_prefix="asr-chunk") as pool:
+        results = list(pool.map(run, chunks))
+    sentences = long_audio.stitch_chunks([(chunk, sents) for chunk, (_, sents) in zip(chunks, results)])
+    logger.info(f"Stitched {len(chunks)} chunks into {len(sentences)} sentences")
+    return ",".join(task_id for task_id, _ in results), sentences
+
+def upload_for_asr(asr_path: str, filename: str, track: bool = True) -> str:
+    asr_hash = calculate_file_hash_from_file(asr_path)
+    mono_filename = f"{os.path.splitext(filename)[0]}_mono{os.path.splitext(asr_path)[1]}"
+    return upload_to_oss(asr_path, mono_filename, asr_hash, track=track)
+
+def iter_asr_sentences(asr_url: str, offset_map: OffsetMap | None = None) -> tuple[str, Iterator[dict]]:
+    """Run FunASR on an uploaded file and return (task_id, sentences on the original timeline, streamed)."""
+    # 2. Submit FunASR Task and Wait for Result (Synchronous wait inside)
+    output = transcribe_with_fun_asr(asr_url)
+    task_id = output.task_id
+    
+    # 3. Parse Result
+    sentences = iter_transcription_sentences(output, offset_map, task_id)
+    return task_id, _checked_sentences(task_id, output, sentences)
+
+def fetch_asr_sentences(asr_url: str, offset_map: OffsetMap | None = None) -> tuple[str, list[dict]]:
+    """Like iter_asr_sentences, but materialized (for callers that cache or post-process the list)."""
+    task_id, sentences = iter_asr_sentences(asr_url, offset_map)
+    return task_id, list(sentences)
+
+def _checked_sentences(task_id: str, output, sentences: Iterator[dict]) -> Iterator[dict]:
+    count, first_keys, speaker_ids = 0, [], set()
+    for sent in sentences:
+        if isinstance(sent, dict):
+            if not count:
+                first_keys = list(sent.keys())
+            if sent.get("speaker_id") is not None:
+                speaker_ids.add(sent["speaker_id"])
+        count += 1
+        yield sent
+
+    append_debug_line(f"task_id={task_id}\tsentences={count}\tunique_speakers={sorted(speaker_ids)[:20]}\tfirst_sentence_keys={first_keys}")
+    if not count:
+         logger.error(f"No sentences found. task_id={task_id} keys={list(output.keys())}")
+
+def save_transcribed_meeting(
+    filename: str, mono_path: str, file_url: str, sentences: Iterable[dict], recorded_at: datetime | None = None,
+    job_id: int | None = None,
+) -> tuple[int, list[dict]]:
+    """
+    Create the meeting, its speakers and segments; returns (meeting_id, frontend segments).
+    With `job_id`, the meeting id is stored on that job in the same commit, so a retry finds it.
+    """
+    db = SessionLocal()
+    try:
+        # 4. Save to Database
+        now = recorded_at or datetime.now()
         new_meeting = Meeting(
             title=os.path.splitext(filename)[0],
             date=now.strftime("%Y-%m-%d"),
             time=now.strftime("%H:%M"),
-            duration=duration_str,
-            file_url=asr_url,
+            duration="00:00",
+            file_url=file_url,
+            audio_path=mono_path,
             type="product" # Default type
         )
         db.add(new_meeting)
-        db.commit()
-        db.refresh(new_meeting)
+        db.flush() # Not committed: a parse failure in the lazy `sentences` rolls the whole meeting back
         
-        db_segments = []
         frontend_segments = []
-        
-        for idx, sent in enumerate(sentences):
-            start = _ms_to_mmss(sent.get("begin_time"))
-            end = _ms_to_mmss(sent.get("end_time"))
-            
-            # Extract speaker_id safely
-            # Note: DashScope FunASR usually returns 'speaker_id' as integer (0, 1, etc.)
-            spk_id = sent.get("speaker_id")
-            if spk_id is None:
-                spk_id = sent.get("speaker") # Fallback
-            
-            if spk_id is not None:
-                speaker = f"Speaker {spk_id}"
-            else:
-                speaker = "unknown_speaker_default" # Will be shown as "未知发言人" in frontend
-            
-            # DB Object
-            seg = Segment(
-                meeting_id=new_meeting.id,
-                content=sent.get("text", ""),
-                speaker=speaker,
-                start_time=start,
-                end_time=end,
-                emotion=sent.get("emotion_tag")
-            )
-            db_segments.append(seg)
-            
-            # Frontend Object
+
+        def collect(idx: int, row: dict):
             frontend_segments.append({
                 "id": f"seg-{idx}",
                 "type": "user",
-                "content": seg.content,
-                "startTime": start,
-                "endTime": end,
-                "speaker": speaker,
-                "emotion": seg.emotion
+                "content": row["content"],
+                "startTime": row["start_time"],
+                "endTime": row["end_time"],
+                "speaker": row["speaker"],
+                "emotion": row["emotion"]
             })
-            
-        db.add_all(db_segments)
-        db.commit()
 
-        return {
-            "task_id": task_id,
-            "status": "succeeded",
-            "meeting_id": str(new_meeting.id), # Return DB ID
-            "segments": frontend_segments
-        }
-        
-    except Exception as e:
-        logger.error(f"File Transcription Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        # "unknown_speaker_default" will be shown as "未知发言人" in frontend
+        _, last_end = insert_transcript_segments(db, new_meeting.id, sentences, "unknown_speaker_default", collect)
+        new_meeting.duration = _ms_to_mmss(last_end) or "00:00"
+        refresh_meeting_stats(db, new_meeting.id)
+        _bump_meeting_version(db, new_meeting.id)
+        if job_id is not None:
+            db.query(Job).filter(Job.id == job_id).update(
+                {Job.result: jsoncodec.dumps({"meeting_id": new_meeting.id})}, synchronize_session=False
+            )
+        db.commit()
+        meeting_id = new_meeting.id
     finally:
-        # Trigger auto-summary (Best Effort, non-blocking)
-        # Note: If we use BackgroundTasks here, it's better. But simple Thread also works.
-        if 'new_meeting' in locals() and new_meeting.id:
-            threading.Thread(target=perform_analysis, args=(new_meeting.id, "full_summary")).start()
+        db.close()
+    index_meeting_passages_safe(meeting_id)
+    return meeting_id, frontend_segments
+
+def _speaker_label(sent: dict, default: str) -> str:
+    # Extract speaker_id safely
+    # Note: DashScope FunASR usually returns 'speaker_id' as integer (0, 1, etc.)
+    spk_id = sent.get("speaker_id")
+    if spk_id is None:
+        spk_id = sent.get("speaker") # Fallback
+    return f"Speaker {spk_id}" if spk_id is not None else default
 
 def _ms_to_mmss(ms: int | None) -> str | None:
     if ms is None:
@@ -709,28 +2803,40 @@ def _ms_to_mmss(ms: int | None) -> str | None:
     s = seconds % 60
     return f"{m:02d}:{s:02d}"
 
-def process_realtime_recording(meeting_id: int, file_path: str):
+def process_realtime_recording(meeting_id: int, file_path: str, oss_key: str | None = None):
     logger.info(f"Starting post-processing for meeting {meeting_id}, file: {file_path}")
     
-    if not os.path.exists(file_path):
+    if not os.path.exists(file_path) and not ensure_local_file(file_path):
         logger.error(f"File not found: {file_path}")
         return
 
     db = SessionLocal()
     try:
-        # 1. Standardize & Hash
-        file_hash = calculate_file_hash_from_file(file_path)
-        mono_path = ensure_mono_wav(file_path, file_hash)
-        mono_hash = calculate_file_hash_from_file(mono_path)
-        
-        # 2. Upload to OSS
-        filename = f"realtime_{meeting_id}.wav"
-        oss_url = upload_to_oss(mono_path, filename, mono_hash)
+        if oss_key:
+            # Audio was already streamed to OSS during the session (ProgressiveOSSUpload);
+            # the temp recording is 16 kHz mono WAV, so it doubles as the local original
+            mono_path, offset_map = file_path, None
+            oss_url = _sign_oss_url(get_oss_bucket(), oss_key)
+            track_file(file_path, oss_key=oss_key)
+        else:
+            # 1. Standardize & Hash
+            file_hash = calculate_file_hash_from_file(file_path)
+            mono_path = ensure_mono_wav(file_path, file_hash)
+            asr_path, offset_map = trim_silence_for_asr(mono_path, file_hash)
+            asr_path = encode_for_transport(asr_path)
+            asr_hash = calculate_file_hash_from_file(asr_path)
+            
+            # 2. Upload to OSS
+            filename = f"realtime_{meeting_id}{os.path.splitext(asr_path)[1]}"
+            oss_url = upload_to_oss(asr_path, filename, asr_hash)
+        _ensure_peaks(mono_path)
         
         # Update Meeting URL immediately
         meeting = db.query(Meeting).filter(Meeting.id == meeting_id).first()
         if meeting:
-            meeting.file_url = oss_url
+            meeting.file_url = oss_url if offset_map is None else _local_audio_url(encode_for_transport(mono_path))
+            meeting.audio_path = mono_path
+            _bump_meeting_version(db, meeting_id, transcript=False)
             db.commit()
             logger.info(f"Updated meeting {meeting_id} file_url: {oss_url}")
         else:
@@ -742,90 +2848,250 @@ def process_realtime_recording(meeting_id: int, file_path: str):
         output = transcribe_with_fun_asr(oss_url)
         task_id = output.task_id
         
-        # 4. Parse Result (Reuse logic)
-        transcription_url = None
-        results = output.get("results")
-        if results and len(results) > 0:
-            first_res = results[0]
-            transcription_url = first_res.get("transcription_url")
-        
-        transcription_payload = None
-        if transcription_url:
-            logger.info(f"Fetching transcription json: {_safe_url(transcription_url)}")
-            r = requests.get(transcription_url, timeout=30); r.raise_for_status()
-            transcription_payload = r.json()
-        elif results:
-            transcription_payload = {"results": results}
-        else:
-             transcription_payload = output
-            
-        sentences = _extract_sentences_from_transcription_payload(transcription_payload or {})
-        
-        if not sentences:
+        # 4. Parse Result (streamed)
+        sentences = iter_transcription_sentences(output, offset_map, task_id)
+        first = next(sentences, None)
+        if first is None:
              logger.warning(f"No sentences found in offline transcription for meeting {meeting_id}")
              return
 
         # 5. Replace Segments
-        # Delete old realtime segments
+        # Delete old realtime segments and their speakers
         db.query(Segment).filter(Segment.meeting_id == meeting_id).delete()
+        db.query(Speaker).filter(Speaker.meeting_id == meeting_id).delete()
         
         # Insert new segments
-        new_segments = []
-        for sent in sentences:
-            start = _ms_to_mmss(sent.get("begin_time"))
-            end = _ms_to_mmss(sent.get("end_time"))
-            
-            spk_id = sent.get("speaker_id")
-            if spk_id is None: spk_id = sent.get("speaker")
-            
-            speaker = f"Speaker {spk_id}" if spk_id is not None else "未知发言人"
-            
-            seg = Segment(
-                meeting_id=meeting_id,
-                content=sent.get("text", ""),
-                speaker=speaker,
-                start_time=start,
-                end_time=end,
-                emotion=sent.get("emotion_tag")
-            )
-            new_segments.append(seg)
-            
-        db.add_all(new_segments)
+        count, last_end = insert_transcript_segments(db, meeting_id, itertools.chain([first], sentences), "未知发言人")
         
         # Update duration again with precise time
-        last_end = sentences[-1].get("end_time")
-        duration_str = _ms_to_mmss(last_end) or "00:00"
-        meeting.duration = duration_str
+        meeting.duration = _ms_to_mmss(last_end) or "00:00"
+        refresh_meeting_stats(db, meeting_id)
+        _bump_meeting_version(db, meeting_id)
         
         db.commit()
-        logger.info(f"Successfully re-processed meeting {meeting_id} with offline model ({len(new_segments)} segments)")
+        logger.info(f"Successfully re-processed meeting {meeting_id} with offline model ({count} segments)")
+        index_meeting_passages_safe(meeting_id)
         
         # Trigger auto-summary
-        threading.Thread(target=perform_analysis, args=(meeting_id, "full_summary")).start()
+        enqueue_job("analysis", {"meeting_id": meeting_id, "preset_id": "full_summary"})
         
     except Exception as e:
         logger.error(f"Post-processing failed for meeting {meeting_id}: {e}")
         db.rollback()
+        raise # Let the job queue retry
+    finally:
+        db.close()
+        # The temp recording is left to the storage sweeper: it is removed once the meeting
+        # audio lives elsewhere, or evicted under the disk budget once it is in OSS
+
+
+# --- Job Queue (SQLite, lease based) ---
+# API processes only enqueue; workers (embedded threads or `python worker.py`) claim jobs
+# with a lease, keep it alive with heartbeats, and expired leases are re-claimed by others.
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+def enqueue_job(kind: str, payload: dict, max_attempts: int = 3) -> int:
+    db = SessionLocal()
+    try:
+        job = Job(kind=kind, payload=jsoncodec.dumps(payload), max_attempts=max_attempts, run_after=time.time())
+        db.add(job)
+        db.commit()
+        logger.info(f"Enqueued job {job.id} ({kind})")
+        return job.id
     finally:
         db.close()
-        # Optional: Clean up temp file? 
-        # os.remove(file_path) 
 
+def claim_job(worker_id: str, kinds: list[str], lease_seconds: int = JOB_LEASE_SECONDS) -> dict | None:
+    """Atomically claim the oldest runnable job (pending, or running with an expired lease)."""
+    now = time.time()
+    token = f"{worker_id}:{uuid.uuid4().hex}"
+    kind_params = {f"kind_{i}": kind for i, kind in enumerate(kinds)}
+    kind_sql = ", ".join(f":{name}" for name in kind_params)
+    with engine.begin() as conn:
+        # Jobs whose worker died on the last allowed attempt are given up on
+        conn.execute(text(
+            "UPDATE jobs SET status = 'failed', last_error = 'lease expired', lease_owner = NULL "
+            "WHERE status = 'running' AND lease_expires_at < :now AND attempts >= max_attempts"
+        ), {"now": now})
+        # A single UPDATE is atomic in SQLite, so only one worker can win the row
+        claimed = conn.execute(text(
+            "UPDATE jobs SET status = 'running', lease_owner = :token, lease_expires_at = :expires, "
+            "attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ("
+            f"  SELECT id FROM jobs WHERE kind IN ({kind_sql}) AND ("
+            "    (status = 'pending' AND run_after <= :now) OR (status = 'running' AND lease_expires_at < :now))"
+            "  ORDER BY id LIMIT 1)"
+        ), {"token": token, "expires": now + lease_seconds, "now": now, **kind_params})
+        if claimed.rowcount == 0:
+            return None
+        row = conn.execute(
+            text("SELECT id, kind, payload, attempts, max_attempts FROM jobs WHERE lease_owner = :token"),
+            {"token": token},
+        ).one()
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "payload": jsoncodec.loads(row.payload),
+        "attempts": row.attempts,
+        "max_attempts": row.max_attempts,
+        "token": token,
+    }
+
+def heartbeat_job(job: dict, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """Extend the lease; False means the lease was lost (expired and re-claimed)."""
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            "UPDATE jobs SET lease_expires_at = :expires WHERE id = :id AND lease_owner = :token AND status = 'running'"
+        ), {"expires": time.time() + lease_seconds, "id": job["id"], "token": job["token"]})
+    return result.rowcount > 0
+
+def finish_job(job: dict, error: str | None = None, result=None) -> None:
+    if error is None:
+        status, run_after = "done", 0
+    elif job["attempts"] < job["max_attempts"]:
+        status, run_after = "pending", time.time() + min(300, 5 * 2 ** job["attempts"])
+    else:
+        status, run_after = "failed", 0
+    with engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE jobs SET status = :status, run_after = :run_after, last_error = :error, result = COALESCE(:result, result), "
+            "lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = :id AND lease_owner = :token"
+        ), {
+            "status": status, "run_after": run_after, "error": error,
+            "result": jsoncodec.dumps(result) if result is not None else None,
+            "id": job["id"], "token": job["token"],
+        })
+
+def _run_transcribe_job(payload: dict, job_id: int) -> dict:
+    # A previous attempt may have saved the meeting and died before finishing the job
+    db = SessionLocal()
+    try:
+        previous = jsoncodec.loads_or_none(db.query(Job.result).filter(Job.id == job_id).scalar()) or {}
+        existing = previous.get("meeting_id") and db.query(Meeting.id).filter(Meeting.id == previous["meeting_id"]).first()
+    finally:
+        db.close()
+    if existing:
+        logger.info(f"Job {job_id}: meeting {existing.id} was already saved by an earlier attempt")
+        enqueue_job("analysis", {"meeting_id": existing.id, "preset_id": "full_summary"})
+        return {"meeting_id": str(existing.id), "task_id": None}
+    result = transcribe_local_file(payload["local_path"], payload["filename"], payload["file_hash"], job_id=job_id)
+    return {"meeting_id": result["meeting_id"], "task_id": result["task_id"]}
+
+def _run_analysis_job(payload: dict, job_id: int):
+    result = perform_analysis(payload["meeting_id"], payload.get("preset_id", "full_summary"))
+    if result is None:
+        raise RuntimeError(f"Analysis failed for meeting {payload['meeting_id']}")
+
+JOB_HANDLERS = {
+    "transcribe": _run_transcribe_job,
+    "postprocess": lambda p, _: process_realtime_recording(p["meeting_id"], p["file_path"], p.get("oss_key")),
+    "analysis": _run_analysis_job,
+}
+# Upstream priority per job kind: queued analyses yield quota to interactive calls and transcriptions
+JOB_PRIORITIES = {"analysis": upstream.PRIORITY_LOW}
+
+def run_job(job: dict) -> None:
+    """Execute one claimed job while a heartbeat thread keeps its lease alive."""
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(JOB_LEASE_SECONDS / 3):
+            if not heartbeat_job(job):
+                logger.warning(f"Lost lease on job {job['id']}")
+                return
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    try:
+        logger.info(f"Running job {job['id']} ({job['kind']}), attempt {job['attempts']}/{job['max_attempts']}")
+        with upstream.priority(JOB_PRIORITIES.get(job["kind"], upstream.PRIORITY_NORMAL)):
+            result = JOB_HANDLERS[job["kind"]](job["payload"], job["id"])
+        finish_job(job, result=result)
+    except Exception as e:
+        logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+        finish_job(job, error=str(e))
+    finally:
+        stop.set()
+
+def worker_loop(worker_id: str, kinds: list[str], stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            job = claim_job(worker_id, kinds)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed to claim job: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+def start_worker_threads(worker_id: str, concurrency: int = 2, kinds: list[str] | None = None) -> threading.Event:
+    stop_event = threading.Event()
+    kinds = kinds or list(JOB_HANDLERS)
+    for i in range(concurrency):
+        threading.Thread(
+            target=worker_loop, args=(f"{worker_id}-{i}", kinds, stop_event), name=f"worker-{worker_id}-{i}", daemon=True
+        ).start()
+    logger.info(f"Started {concurrency} worker threads ({worker_id}) for {kinds}")
+    return stop_event
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "result": jsoncodec.loads_or_none(job.result),
+    }
+
+@app.get("/api/upstream")
+def upstream_status():
+    """Current adaptive rate, in-flight/waiting calls and retry counters per upstream provider."""
+    return {name: governor.snapshot() for name, governor in UPSTREAM_GOVERNORS.items()}
 
 # --- Qwen3 Realtime ASR (WebSocket) ---
+QWEN_REALTIME_URL = os.getenv("QWEN_REALTIME_URL", "wss://dashscope.aliyuncs.com/api-ws/v1/realtime") # realtime_replay.py serves a fake one
+REALTIME_LATENCY_DEBUG = os.getenv("REALTIME_LATENCY_DEBUG", "0") == "1" # Latency fields on every transcript message (or ?debug=1)
+REALTIME_RECORD_DIR = os.getenv("REALTIME_RECORD_DIR", "") # Record sessions (audio frames + upstream events) for realtime_replay.py
+REALTIME_REPLAY_ENABLED = os.getenv("REALTIME_REPLAY_ENABLED", "0") == "1" # Honour ?replay=1 (benchmark servers only)
+
+realtime_latency = realtime_trace.LatencyStats()
+
+@app.get("/api/debug/realtime-latency")
+def realtime_latency_status():
+    """Histograms of the realtime transcript path per stage, across all sessions since startup (or the last reset)."""
+    return realtime_latency.snapshot()
+
+@app.delete("/api/debug/realtime-latency")
+def reset_realtime_latency():
+    realtime_latency.reset()
+    return {"status": "ok"}
 
 class QwenRealtimeClient:
-    def __init__(self, frontend_ws: WebSocket, loop: asyncio.AbstractEventLoop, meeting_id: int = None):
+    def __init__(self, frontend_ws: WebSocket, loop: asyncio.AbstractEventLoop, meeting_id: int = None, debug: bool = False, offline: bool = False):
         self.frontend_ws = frontend_ws
         self.loop = loop
         self.ws = None
         self.is_connected = False
+        self.opened = False
+        self.closed = False
+        self.handshake_error = None
         self.thread = None
         self.meeting_id = meeting_id
+        self.speaker_id = None
         self.start_timestamp = time.time()
 
         self.audio_filename = f"temp_{self.meeting_id}.wav" if self.meeting_id else f"temp_unknown_{uuid.uuid4().hex}.wav"
         self.audio_path = os.path.join(UPLOAD_DIR, self.audio_filename)
+        _active_local_files.add(self.audio_path)
         self.wave_file = None
         try:
             self.wave_file = wave.open(self.audio_path, 'wb')
@@ -836,21 +3102,63 @@ class QwenRealtimeClient:
         except Exception as e:
             logger.error(f"Failed to create audio file: {e}")
 
-        self.context_buffer = deque()
+        # Stream the recording to OSS while the meeting runs, so post-processing can start at hang-up
+        self.offline = offline # Replay session: no OSS upload and no post-processing
+        self.uploader = None
+        if self.meeting_id and REALTIME_PROGRESSIVE_UPLOAD and not offline:
+            try:
+                self.uploader = ProgressiveOSSUpload(f"uploads/realtime_{self.meeting_id}_{uuid.uuid4().hex[:8]}.wav")
+            except Exception as e:
+                logger.warning(f"Progressive upload disabled for meeting {self.meeting_id}: {e}")
+
+        self.context = RollingContext(
+            window_tokens=CONTEXT_WINDOW_TOKENS,
+            summary_tokens=CONTEXT_SUMMARY_TOKENS,
+            compress_batch_tokens=CONTEXT_WINDOW_TOKENS // 2,
+        )
         self.last_text_time = time.time()
         self.suggestion_generated = False
         self.generating = False
+        self.suggestion_task: asyncio.Task | None = None
+        self.silence = SilenceScheduler(loop, SUGGESTION_SILENCE_SECONDS, self._on_silence)
         self.is_paused = False
         self.model = "qwen3-asr-flash-realtime"
         self._seen_types: set[str] = set()
 
+        self.debug = debug or REALTIME_LATENCY_DEBUG
+        self.latency = realtime_trace.UtteranceTracker(realtime_latency)
+        self.recorder = None
+        if REALTIME_RECORD_DIR:
+            try:
+                os.makedirs(REALTIME_RECORD_DIR, exist_ok=True)
+                path = os.path.join(REALTIME_RECORD_DIR, f"session_{self.meeting_id or 'unknown'}_{int(self.start_timestamp)}.jsonl")
+                self.recorder = realtime_trace.SessionRecorder(path, {"meeting_id": self.meeting_id, "model": self.model, "sample_rate": 16000})
+                logger.info(f"Recording realtime session to {path}")
+            except Exception as e:
+                logger.warning(f"Realtime session recording disabled: {e}")
+
     def connect(self):
-        url = f"wss://dashscope.aliyuncs.com/api-ws/v1/realtime?model={self.model}"
+        self.thread = threading.Thread(target=self._run_session)
+        self.thread.start()
+
+    def _run_session(self):
+        try:
+            # The governor slot is held for the whole session, so the realtime concurrency cap bounds open sessions
+            realtime_governor.call(self._open_socket, priority=upstream.PRIORITY_HIGH, deadline=REALTIME_CONNECT_DEADLINE)
+        except Exception as e:
+            logger.error(f"[QwenWS] Could not connect: {e}")
+
+    def _open_socket(self):
+        if self.closed:
+            return
+        url = f"{QWEN_REALTIME_URL}?model={self.model}"
         headers = [
             f"Authorization: Bearer {DASHSCOPE_API_KEY}",
             "OpenAI-Beta: realtime=v1"
         ]
         logger.info(f"Connecting to Qwen Realtime API: {url}")
+        self.opened = False
+        self.handshake_error = None
         self.ws = websocket.WebSocketApp(
             url,
             header=headers,
@@ -859,15 +3167,15 @@ class QwenRealtimeClient:
             on_error=self.on_error,
             on_close=self.on_close
         )
-        self.thread = threading.Thread(
-            target=self.ws.run_forever, 
-            kwargs={"sslopt": {"cert_reqs": ssl.CERT_NONE}}
-        )
-        self.thread.start()
+        self.ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+        # Re-raise handshake failures (e.g. HTTP 429) so the governor backs off and retries
+        if self.handshake_error is not None and not self.closed:
+            raise self.handshake_error
 
     def on_open(self, ws):
         logger.info("[QwenWS] Connected to Aliyun")
         self.is_connected = True
+        self.opened = True
         
         # Init Session
         session_event = {
@@ -887,7 +3195,7 @@ class QwenRealtimeClient:
                 }
             }
         }
-        ws.send(json.dumps(session_event))
+        ws.send(jsoncodec.dumps(session_event))
 
     def _save_segment_to_db(self, text: str):
         if not self.meeting_id or not text.strip():
@@ -907,19 +3215,25 @@ class QwenRealtimeClient:
             
             db = SessionLocal()
             try:
+                if self.speaker_id is None:
+                    self.speaker_id = _speaker_ids_for_labels(db, self.meeting_id, ["Speaker"])["Speaker"]
                 seg = Segment(
                     meeting_id=self.meeting_id,
                     content=text,
                     speaker="Speaker",
+                    speaker_id=self.speaker_id,
                     start_time=start_str,
                     end_time=end_str,
                     emotion=None
                 )
                 db.add(seg)
+                db.flush()
+                add_segment_to_stats(db, self.meeting_id, self.speaker_id, start_str, end_str, text)
                 
                 meeting = db.query(Meeting).filter(Meeting.id == self.meeting_id).first()
                 if meeting:
                     meeting.duration = end_str
+                _bump_meeting_version(db, self.meeting_id)
                     
                 db.commit()
             except Exception as e:
@@ -931,28 +3245,39 @@ class QwenRealtimeClient:
             logger.error(f"Error in _save_segment_to_db wrapper: {e}")
 
     def on_message(self, ws, message):
+        arrived = time.monotonic()
         try:
-            data = json.loads(message)
+            if self.recorder:
+                self.recorder.upstream(message, self.latency.clock.position_ms)
+            data = jsoncodec.loads(message)
             event_type = data.get("type")
             if isinstance(event_type, str) and event_type and event_type not in self._seen_types:
                 self._seen_types.add(event_type)
                 logger.info(f"[QwenWS] Event type: {event_type}")
+            marks = self.latency.event(data, arrived)
             
             # Handle transcription events
             if data.get("type") == "response.audio_transcript.delta":
                  text = data.get("delta", "")
-                 self._send_to_frontend(text, is_final=False)
+                 self._send_to_frontend(text, is_final=False, arrived=arrived, marks=marks)
+                 self.loop.call_soon_threadsafe(self._on_speech, False)
+            elif data.get("type") == "input_audio_buffer.speech_started":
+                 self.loop.call_soon_threadsafe(self._on_speech, False)
             elif data.get("type") == "response.audio_transcript.done":
                  text = data.get("transcript", "")
-                 self._send_to_frontend(text, is_final=True)
+                 self._send_to_frontend(text, is_final=True, arrived=arrived, marks=marks)
                  if text.strip():
-                     self.context_buffer.append((time.time(), text))
+                     self.context.append(text)
+                     if self.context.needs_compression():
+                         asyncio.run_coroutine_threadsafe(compress_context(self), self.loop)
                      
                      # Save to DB
+                     save_started = time.monotonic()
                      self._save_segment_to_db(text)
+                     realtime_latency.observe("db_save", (time.monotonic() - save_started) * 1000)
                      
                      self.last_text_time = time.time()
-                     self.suggestion_generated = False
+                     self.loop.call_soon_threadsafe(self._on_speech, True)
             
             # Fallback/Other event types handling...
             
@@ -962,19 +3287,24 @@ class QwenRealtimeClient:
     def on_error(self, ws, error):
         logger.error(f"[QwenWS] Error: {error}")
         self.is_connected = False
+        if not self.opened and isinstance(error, Exception):
+            self.handshake_error = error
 
     def on_close(self, ws, *args):
         logger.info("[QwenWS] Closed")
         self.is_connected = False
 
-    def send_audio(self, audio_bytes: bytes):
+    def send_audio(self, audio_bytes: bytes, received_at: float | None = None):
         if not self.is_connected: return
+        received_at = received_at if received_at is not None else time.monotonic()
         
         if self.wave_file:
             try:
                 self.wave_file.writeframes(audio_bytes)
             except Exception as e:
                 logger.error(f"Error writing to wave file: {e}")
+        if self.uploader:
+            self.uploader.write(audio_bytes)
 
         # Encode audio to base64
         encoded = base64.b64encode(audio_bytes).decode("utf-8")
@@ -983,9 +3313,30 @@ class QwenRealtimeClient:
             "type": "input_audio_buffer.append",
             "audio": encoded
         }
-        self.ws.send(json.dumps(event))
+        self.ws.send(jsoncodec.dumps(event))
+        self.latency.frame(len(audio_bytes), received_at, time.monotonic())
+
+    def _on_speech(self, done: bool):
+        """(Event loop) New speech cancels a pending suggestion and pushes the silence timer back."""
+        if done:
+            self.suggestion_generated = False
+        if self.suggestion_task and not self.suggestion_task.done():
+            logger.info("Speech resumed, cancelling suggestion")
+            self.suggestion_task.cancel()
+        self.silence.arm()
+
+    def _on_silence(self):
+        """(Event loop) Fired by the silence timer once nobody has spoken for SUGGESTION_SILENCE_SECONDS."""
+        if self.suggestion_generated or self.generating or self.is_paused or not len(self.context) or not self.is_connected:
+            return
+        logger.info("Silence detected, triggering suggestion...")
+        self.suggestion_task = self.loop.create_task(generate_suggestion(self))
 
     def close(self):
+        self.closed = True
+        self.silence.disarm()
+        if self.suggestion_task and not self.suggestion_task.done():
+            self.suggestion_task.cancel()
         if self.ws:
             self.ws.close()
         self.is_connected = False
@@ -997,20 +3348,37 @@ class QwenRealtimeClient:
             except Exception as e:
                 logger.error(f"Error closing wave file: {e}")
             self.wave_file = None
+        if self.recorder:
+            self.recorder.close()
 
-    def _send_to_frontend(self, text: str, is_final: bool):
+    def _send_to_frontend(self, text: str, is_final: bool, arrived: float | None = None, marks: dict | None = None):
         payload = {
             "type": "transcript",
             "text": text,
             "is_final": is_final,
             "speaker": None # Realtime might not give speaker ID instantly
         }
-        asyncio.run_coroutine_threadsafe(
-            self.frontend_ws.send_text(json.dumps(payload)),
+        if self.debug and marks is not None:
+            payload["latency"] = marks
+        future = asyncio.run_coroutine_threadsafe(
+            self.frontend_ws.send_text(jsoncodec.dumps(payload)),
             self.loop
         )
+        if arrived is not None:
+            future.add_done_callback(lambda f: self._on_pushed(f, arrived, marks if is_final else None))
+
+    def _on_pushed(self, future, arrived: float, final_marks: dict | None):
+        """Runs once the transcript has been written to the browser socket."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        push_ms = (time.monotonic() - arrived) * 1000
+        realtime_latency.observe("frontend_push", push_ms)
+        if final_marks and "final_ms" in final_marks:
+            realtime_latency.observe("end_to_end", final_marks["final_ms"] + push_ms)
 
 # --- 智能建议 (Suggestion) ---
+SUGGESTION_SILENCE_SECONDS = float(os.getenv("SUGGESTION_SILENCE_SECONDS", "3.5"))
+
 async def generate_suggestion(client: QwenRealtimeClient):
     # Safe check for connection
     if not client.is_connected:
@@ -1018,55 +3386,104 @@ async def generate_suggestion(client: QwenRealtimeClient):
 
     client.generating = True
     try:
-        await client.frontend_ws.send_json({"type": "status", "content": "thinking"})
-        context_text = " ".join([text for _, text in client.context_buffer]) or "（对话刚开始）"
+        await client.frontend_ws.send_text(jsoncodec.dumps({"type": "status", "content": "thinking"}))
+        context_text = client.context.render() or "（对话刚开始）"
         prompt = f"基于以下对话上下文，生成一个能自然延续话题的开放式问题：[{context_text}]。要求问题：1) 包含前文提到的关键信息 2) 字数限制在20字内 3) 避免是非问句"
-        
-        async_client = openai.AsyncOpenAI(
-            api_key=os.getenv("GEMINI_API_KEY"),
-            base_url=os.getenv("GEMINI_BASE_URL")
-        )
 
-        stream = await async_client.chat.completions.create(
+        # Holds an LLM slot until the stream is closed, also when we are cancelled mid-stream
+        async with llm_governor.astream(
+            async_client.chat.completions.create,
             model="gemini-3-flash-preview",
             messages=[{"role": "user", "content": prompt}],
-            stream=True
-        )
-        
-        async for chunk in stream:
-            # Check connection again during streaming
-            if not client.is_connected: break
-            
-            content = chunk.choices[0].delta.content
-            if content:
-                await client.frontend_ws.send_json({"type": "suggestion_delta", "content": content})
-                await asyncio.sleep(0.1)
+            stream=True,
+            priority=upstream.PRIORITY_HIGH,
+            deadline=LLM_SUGGESTION_DEADLINE,
+        ) as stream:
+            async for chunk in stream:
+                # Check connection again during streaming
+                if not client.is_connected: break
+                
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    await client.frontend_ws.send_text(jsoncodec.dumps({"type": "suggestion_delta", "content": content}))
         
         if client.is_connected:
-            await client.frontend_ws.send_json({"type": "suggestion_end"})
+            await client.frontend_ws.send_text(jsoncodec.dumps({"type": "suggestion_end"}))
             client.suggestion_generated = True
 
+    except asyncio.CancelledError:
+        # Speech resumed (or the session ended): let the frontend drop the partial suggestion
+        try:
+            await client.frontend_ws.send_text(jsoncodec.dumps({"type": "suggestion_end", "cancelled": True}))
+        except Exception:
+            pass
+        raise
     except Exception as e:
         logger.error(f"Suggestion Error: {e}")
     finally:
         client.generating = False
 
-async def monitor_silence(client: QwenRealtimeClient):
-    logger.info("Silence monitor started")
+async def compress_context(client: QwenRealtimeClient):
+    """Fold utterances that left the recent window into the rolling summary (runs in background)."""
+    claimed = client.context.begin_compression()
+    if claimed is None:
+        return
+    summary, pending_text, claimed_through = claimed
+    new_summary = None
     try:
-        while True:
-            await asyncio.sleep(0.5)
-            # Check if frontend is still connected (implied by loop running)
-            # But client.is_connected refers to Backend<->Aliyun
-            # We care about Backend<->Frontend for sending suggestions
-            
-            now = time.time()
-            if (now - client.last_text_time > 3.5) and (not client.suggestion_generated) and (not client.generating) and (not client.is_paused) and len(client.context_buffer) > 0:
-                if client.is_connected: # Only trigger if session is active
-                    logger.info("Silence detected, triggering suggestion...")
-                    asyncio.create_task(generate_suggestion(client))
-    except asyncio.CancelledError:
-        logger.info("Silence monitor cancelled")
+        prompt = (
+            f"请将以下会议内容压缩为不超过{CONTEXT_SUMMARY_TOKENS}字的摘要，保留关键议题、结论和人名，只输出摘要本身。\n"
+            f"已有摘要：{summary or '（无）'}\n"
+            f"新增内容：{pending_text}"
+        )
+        response = await llm_governor.acall(
+            async_client.chat.completions.create,
+            model="gemini-3-flash-preview",
+            messages=[{"role": "user", "content": prompt}],
+            priority=upstream.PRIORITY_NORMAL,
+            deadline=LLM_CHAT_DEADLINE,
+        )
+        new_summary = response.choices[0].message.content or ""
+    except Exception as e:
+        logger.error(f"Context compression error: {e}")
+    finally:
+        client.context.finish_compression(new_summary, claimed_through)
+
+class SilenceScheduler:
+    """
+    One `call_at` timer per session that fires `callback` after `delay` seconds without speech.
+    Speech pushes the deadline back without touching the timer; when the timer fires early
+    it re-schedules itself for the remaining time, so a session costs one wakeup per silence
+    instead of a polling loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, delay: float, callback):
+        self.loop = loop
+        self.delay = delay
+        self.callback = callback
+        self._deadline: float | None = None
+        self._handle: asyncio.TimerHandle | None = None
+
+    def arm(self):
+        self._deadline = self.loop.time() + self.delay
+        if self._handle is None:
+            self._handle = self.loop.call_at(self._deadline, self._fire)
+
+    def disarm(self):
+        self._deadline = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _fire(self):
+        self._handle = None
+        if self._deadline is None:
+            return
+        if self.loop.time() < self._deadline: # Speech since the timer was scheduled
+            self._handle = self.loop.call_at(self._deadline, self._fire)
+            return
+        self._deadline = None
+        self.callback()
 
 @app.websocket("/ws/asr")
 async def websocket_endpoint(websocket: WebSocket):
@@ -1100,26 +3517,32 @@ async def websocket_endpoint(websocket: WebSocket):
             db.close()
     
     # Init Qwen Client
-    qwen_client = QwenRealtimeClient(websocket, loop, meeting_id=meeting_id)
+    debug = websocket.query_params.get("debug") == "1"
+    # Replays (realtime_replay.py) skip OSS and post-processing, only where the server opted in
+    offline = REALTIME_REPLAY_ENABLED and websocket.query_params.get("replay") == "1"
+    qwen_client = QwenRealtimeClient(websocket, loop, meeting_id=meeting_id, debug=debug, offline=offline)
     qwen_client.connect()
     
-    # Start Monitor
-    monitor_task = asyncio.create_task(monitor_silence(qwen_client))
-    
     try:
         while True:
             message = await websocket.receive()
+            received_at = time.monotonic()
+            if qwen_client.recorder and message.get("bytes") is not None:
+                qwen_client.recorder.audio(message["bytes"])
+            elif qwen_client.recorder and message.get("text") is not None:
+                qwen_client.recorder.control(message["text"])
             if "bytes" in message:
                 if not qwen_client.is_paused:
-                    qwen_client.send_audio(message["bytes"])
+                    qwen_client.send_audio(message["bytes"], received_at)
             elif "text" in message:
                 try:
-                    text_data = json.loads(message["text"])
+                    text_data = jsoncodec.loads(message["text"])
                     if text_data.get("type") == "pause":
                         qwen_client.is_paused = True
                     elif text_data.get("type") == "resume":
                         qwen_client.is_paused = False
                         qwen_client.last_text_time = time.time()
+                        qwen_client.silence.arm()
                 except:
                     pass
             else:
@@ -1130,11 +3553,28 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket Handler Error: {e}")
     finally:
         qwen_client.close()
-        monitor_task.cancel()
         
-        if qwen_client.meeting_id and os.path.exists(qwen_client.audio_path):
+        if qwen_client.offline:
+            logger.info(f"Offline session for meeting {qwen_client.meeting_id}: skipping post-processing")
+            try:
+                os.remove(qwen_client.audio_path)
+            except OSError:
+                pass
+        elif qwen_client.meeting_id and os.path.exists(qwen_client.audio_path):
+            payload = {"meeting_id": qwen_client.meeting_id, "file_path": qwen_client.audio_path}
+            if qwen_client.uploader:
+                try:
+                    # Only the last part and the header part are left to upload at this point
+                    await loop.run_in_executor(None, qwen_client.uploader.complete)
+                    payload["oss_key"] = qwen_client.uploader.key
+                except Exception as e:
+                    logger.error(f"Progressive upload failed for meeting {qwen_client.meeting_id}, falling back to full upload: {e}")
             logger.info(f"Scheduling post-processing for meeting {qwen_client.meeting_id}")
-            loop.run_in_executor(None, process_realtime_recording, qwen_client.meeting_id, qwen_client.audio_path)
+            enqueue_job("postprocess", payload)
+        elif qwen_client.uploader:
+            await loop.run_in_executor(None, qwen_client.uploader.abort)
+        # From here the queued job protects the recording from the storage sweeper
+        _active_local_files.discard(qwen_client.audio_path)
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,119 @@
+"""
+Per-meeting transcript statistics (numpy).
+
+- `compute_stats`: talk time, segment / character / word counts per speaker, emotion
+  distribution and the host (the speaker with the most talk time), in one vectorized
+  pass over a meeting's segments
+- `add_segment`: fold one more segment into stored stats (the realtime writer)
+
+Speakers are grouped by display name, so merged speakers count as one.
+"""
+import re
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[㐀-鿿豈-﫿]|[a-zA-Z0-9]+") # Each CJK character counts as one word (字数)
+
+def word_count(text: str | None) -> int:
+    return len(_WORD_RE.findall(text or ""))
+
+def char_count(text: str | None) -> int:
+    return len("".join((text or "").split()))
+
+def compute_stats(
+    speaker_ids: list[int | None],
+    start_ms: list[int | None],
+    end_ms: list[int | None],
+    texts: list[str | None],
+    emotions: list[str | None],
+    speaker_names: dict[int, str],
+    default_name: str = "未知发言人",
+) -> dict:
+    n = len(texts)
+    if n == 0:
+        return _finish({"segment_count": 0, "char_count": 0, "word_count": 0, "talk_ms": 0, "speakers": [], "emotions": {}})
+
+    starts = np.array([-1 if v is None else v for v in start_ms], dtype=np.int64)
+    ends = np.array([-1 if v is None else v for v in end_ms], dtype=np.int64)
+    durations = np.where((starts >= 0) & (ends >= starts), ends - starts, 0)
+    chars = np.fromiter((char_count(t) for t in texts), dtype=np.int64, count=n)
+    words = np.fromiter((word_count(t) for t in texts), dtype=np.int64, count=n)
+
+    # Segments -> speaker ids -> display names, aggregated with bincount at each level
+    ids = np.array([-1 if v is None else v for v in speaker_ids], dtype=np.int64)
+    unique_ids, id_index = np.unique(ids, return_inverse=True)
+    names = np.array([speaker_names.get(int(i), default_name) if i >= 0 else default_name for i in unique_ids], dtype=object)
+    unique_names, name_of_id = np.unique(names.astype(str), return_inverse=True)
+    name_index = name_of_id[id_index]
+    k = len(unique_names)
+    talk = np.bincount(name_index, weights=durations, minlength=k).astype(np.int64)
+    segments = np.bincount(name_index, minlength=k)
+    name_chars = np.bincount(name_index, weights=chars, minlength=k).astype(np.int64)
+    name_words = np.bincount(name_index, weights=words, minlength=k).astype(np.int64)
+
+    speakers = [
+        {
+            "name": str(unique_names[j]),
+            "speaker_ids": [int(i) for i in unique_ids[name_of_id == j] if i >= 0],
+            "talk_ms": int(talk[j]),
+            "segments": int(segments[j]),
+            "chars": int(name_chars[j]),
+            "words": int(name_words[j]),
+        }
+        for j in range(k)
+    ]
+
+    labelled = np.array([e for e in emotions if e], dtype=object)
+    emotion_counts = {}
+    if len(labelled):
+        values, counts = np.unique(labelled.astype(str), return_counts=True)
+        emotion_counts = {str(v): int(c) for v, c in zip(values, counts)}
+
+    return _finish({
+        "segment_count": n,
+        "char_count": int(chars.sum()),
+        "word_count": int(words.sum()),
+        "talk_ms": int(durations.sum()),
+        "speakers": speakers,
+        "emotions": emotion_counts,
+    })
+
+def add_segment(
+    stats: dict,
+    speaker_id: int | None,
+    speaker_name: str,
+    start_ms: int | None,
+    end_ms: int | None,
+    text: str | None,
+    emotion: str | None = None,
+) -> dict:
+    """Update `stats` (as returned by compute_stats) in place with one appended segment."""
+    duration = max(0, end_ms - start_ms) if start_ms is not None and end_ms is not None else 0
+    chars, words = char_count(text), word_count(text)
+    entry = next((s for s in stats["speakers"] if s["name"] == speaker_name), None)
+    if entry is None:
+        entry = {"name": speaker_name, "speaker_ids": [], "talk_ms": 0, "segments": 0, "chars": 0, "words": 0}
+        stats["speakers"].append(entry)
+    if speaker_id is not None and speaker_id not in entry["speaker_ids"]:
+        entry["speaker_ids"].append(speaker_id)
+    entry["talk_ms"] += duration
+    entry["segments"] += 1
+    entry["chars"] += chars
+    entry["words"] += words
+    stats["segment_count"] += 1
+    stats["char_count"] += chars
+    stats["word_count"] += words
+    stats["talk_ms"] += duration
+    if emotion:
+        stats["emotions"][emotion] = stats["emotions"].get(emotion, 0) + 1
+    return _finish(stats)
+
+def _finish(stats: dict) -> dict:
+    """Order speakers by talk time, fill in talk shares and pick the host."""
+    stats["speakers"].sort(key=lambda s: (-s["talk_ms"], -s["segments"], s["name"]))
+    total = stats["talk_ms"]
+    for s in stats["speakers"]:
+        s["share"] = round(s["talk_ms"] / total, 4) if total else 0.0
+    stats["speaker_count"] = len(stats["speakers"])
+    stats["host"] = stats["speakers"][0]["name"] if stats["speakers"] else None
+    return stats
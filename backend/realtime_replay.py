@@ -0,0 +1,175 @@
+"""
+Replay a recorded realtime session offline, to measure transcript latency without DashScope.
+
+Record a session by starting the backend with REALTIME_RECORD_DIR=logs/sessions and running
+a meeting in the browser. Then replay it:
+
+    python realtime_replay.py serve logs/sessions/session_12_1760000000.jsonl --port 8765
+    REALTIME_REPLAY_ENABLED=1 QWEN_REALTIME_URL=ws://127.0.0.1:8765/realtime uvicorn main:app --port 8000
+    python realtime_replay.py replay logs/sessions/session_12_1760000000.jsonl --url ws://127.0.0.1:8000/ws/asr
+
+`serve` is a fake realtime API. It answers every connection with the recorded upstream
+events, each one released as soon as the backend has forwarded as much audio as it had
+when the event was recorded (plus `--lag-ms`). Upstream timing is then a function of the
+audio alone, so run-to-run differences come from the backend.
+
+`replay` acts as the browser. It sends the recorded frames and pause/resume messages at
+their recorded pace, collects the `latency` debug fields of the transcripts, and prints
+them next to the backend's /api/debug/realtime-latency histograms (reset before the run).
+Each replay creates a realtime meeting in the backend's database (with the replayed
+segments); `replay=1` on the socket skips the OSS upload and post-processing, which the
+backend only honours when started with REALTIME_REPLAY_ENABLED=1.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import urllib.request
+from urllib.parse import urlsplit, urlunsplit
+
+from realtime_trace import BYTES_PER_MS, LatencyHistogram, read_session
+
+# --- fake upstream ---
+
+async def serve_session(websocket, upstream: list[dict], lag_ms: float) -> None:
+    received = {"ms": 0.0}
+    progress = asyncio.Condition()
+
+    async def read_audio():
+        async for message in websocket:
+            try:
+                data = json.loads(message)
+            except ValueError:
+                continue
+            if data.get("type") == "input_audio_buffer.append":
+                received["ms"] += len(base64.b64decode(data.get("audio", ""))) / BYTES_PER_MS
+                async with progress:
+                    progress.notify_all()
+        async with progress:
+            progress.notify_all()
+
+    reader = asyncio.create_task(read_audio())
+    try:
+        for record in upstream:
+            async with progress:
+                await progress.wait_for(lambda: received["ms"] >= record["audio_ms"] or reader.done())
+            if reader.done():
+                break
+            if lag_ms:
+                await asyncio.sleep(lag_ms / 1000)
+            await websocket.send(record["message"])
+        await reader
+    finally:
+        reader.cancel()
+
+async def run_server(path: str, host: str, port: int, lag_ms: float) -> None:
+    from websockets.asyncio.server import serve
+
+    _, records = read_session(path)
+    upstream = [r for r in records if r["kind"] == "upstream"]
+    print(f"fake realtime API on ws://{host}:{port}/realtime ({len(upstream)} upstream events)", file=sys.stderr)
+    async with serve(lambda ws: serve_session(ws, upstream, lag_ms), host, port, max_size=None) as server:
+        await server.serve_forever()
+
+# --- browser side ---
+
+def api_url(ws_url: str, path: str) -> str:
+    parts = urlsplit(ws_url)
+    return urlunsplit(("https" if parts.scheme == "wss" else "http", parts.netloc, path, "", ""))
+
+def call_api(url: str, method: str = "GET") -> dict | None:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=10) as response:
+            return json.loads(response.read())
+    except OSError as e:
+        print(f"{method} {url} failed: {e}", file=sys.stderr)
+        return None
+
+async def replay(path: str, url: str, speed: float, tail: float) -> list[dict]:
+    from websockets.asyncio.client import connect
+
+    _, records = read_session(path)
+    transcripts: list[dict] = []
+    separator = "&" if "?" in url else "?"
+    async with connect(f"{url}{separator}debug=1&replay=1", max_size=None) as websocket:
+        async def receive():
+            async for message in websocket:
+                data = json.loads(message)
+                if data.get("type") == "transcript":
+                    transcripts.append(data)
+
+        receiver = asyncio.create_task(receive())
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for record in records:
+            if record["kind"] == "upstream":
+                continue
+            delay = started + record["t"] / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if record["kind"] == "audio":
+                await websocket.send(base64.b64decode(record["data"]))
+            else:
+                await websocket.send(record["message"])
+        await asyncio.sleep(tail) # Let the last utterance come back before hanging up
+        receiver.cancel()
+    return transcripts
+
+def summarize(transcripts: list[dict]) -> dict:
+    """Client-side view: histograms of the debug fields, one value per utterance."""
+    fields: dict[str, LatencyHistogram] = {}
+    for data in transcripts:
+        if not data.get("is_final"):
+            continue
+        for key, value in (data.get("latency") or {}).items():
+            if key.endswith("_ms"):
+                fields.setdefault(key, LatencyHistogram()).observe(value)
+    return {key: h.snapshot() for key, h in fields.items()}
+
+def print_table(title: str, histograms: dict) -> None:
+    print(title)
+    print(f"  {'stage':<24}{'count':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for stage, h in histograms.items():
+        if not h["count"]:
+            continue
+        cells = "".join(f"{h[k]:>9.1f}" for k in ("p50_ms", "p90_ms", "p99_ms", "max_ms"))
+        print(f"  {stage:<24}{h['count']:>7}{cells}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_p = sub.add_parser("serve", help="fake realtime API replaying the recorded upstream events")
+    serve_p.add_argument("session")
+    serve_p.add_argument("--host", default="127.0.0.1")
+    serve_p.add_argument("--port", type=int, default=8765)
+    serve_p.add_argument("--lag-ms", type=float, default=0.0, help="extra delay before each upstream event")
+    replay_p = sub.add_parser("replay", help="send the recorded frames to the backend and report latencies")
+    replay_p.add_argument("session")
+    replay_p.add_argument("--url", default="ws://127.0.0.1:8000/ws/asr")
+    replay_p.add_argument("--speed", type=float, default=1.0, help="playback speed (1.0 = recorded pace)")
+    replay_p.add_argument("--tail", type=float, default=5.0, help="seconds to wait for transcripts after the last frame")
+    replay_p.add_argument("-o", "--output", help="write the summary as JSON (for comparing runs)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(run_server(args.session, args.host, args.port, args.lag_ms))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    latency_url = api_url(args.url, "/api/debug/realtime-latency")
+    call_api(latency_url, method="DELETE")
+    transcripts = asyncio.run(replay(args.session, args.url, args.speed, args.tail))
+    finals = sum(1 for t in transcripts if t.get("is_final"))
+    print(f"{len(transcripts)} transcript messages, {finals} final")
+    summary = {"client": summarize(transcripts), "server": call_api(latency_url) or {}}
+    print_table("client (debug fields of final transcripts, ms)", summary["client"])
+    print_table("server (/api/debug/realtime-latency, ms)", summary["server"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Realtime transcription latency: per-utterance timings, histograms and session recording.
+
+Stages of one utterance through `QwenRealtimeClient` (milliseconds):
+
+- `upstream_send`: audio frame received from the browser -> forwarded to the realtime API
+- `first_partial`: frame holding the start of speech received -> first `delta` arrives
+- `final`: frame holding the end of speech received -> `done` arrives
+- `db_save`: `done` arrives -> segment committed
+- `frontend_push`: transcript event arrives -> written to the browser socket
+- `end_to_end`: frame holding the end of speech received -> final transcript written to the browser
+
+The upstream VAD events carry positions in the audio stream (`audio_start_ms` /
+`audio_end_ms`); `AudioClock` maps them back to when that audio reached the server.
+
+`SessionRecorder` writes a session's browser frames and upstream events to JSONL, which
+`realtime_replay.py` plays back against a fake realtime server.
+"""
+import base64
+import bisect
+import json
+import threading
+import time
+
+BYTES_PER_MS = 32 # 16 kHz, 16-bit mono PCM
+BUCKETS_MS = (5, 10, 25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 30000)
+STAGES = ("upstream_send", "first_partial", "final", "db_save", "frontend_push", "end_to_end")
+
+class LatencyHistogram:
+    """Fixed-bucket histogram; quantiles are interpolated within a bucket."""
+
+    def __init__(self, bounds: tuple = BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # Last bucket: above the largest bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms: float) -> None:
+        ms = max(0.0, ms)
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.max
+                lo = self.bounds[i - 1] if i else 0.0
+                hi = min(self.bounds[i], self.max)
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def snapshot(self) -> dict:
+        def r(v):
+            return None if v is None else round(v, 1)
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.count,
+            "mean_ms": r(self.total / self.count) if self.count else None,
+            "p50_ms": r(self.quantile(0.5)),
+            "p90_ms": r(self.quantile(0.9)),
+            "p99_ms": r(self.quantile(0.99)),
+            "max_ms": r(self.max) if self.count else None,
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+class LatencyStats:
+    """One histogram per stage, shared by all sessions (observed from websocket threads and the loop)."""
+
+    def __init__(self, stages: tuple = STAGES):
+        self._lock = threading.Lock()
+        self._stages = stages
+        self.reset()
+
+    def observe(self, stage: str, ms: float) -> None:
+        with self._lock:
+            self._histograms[stage].observe(ms)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms = {stage: LatencyHistogram() for stage in self._stages}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: h.snapshot() for stage, h in self._histograms.items()}
+
+class AudioClock:
+    """When each forwarded frame reached the server, by its end position in the upstream audio stream."""
+
+    def __init__(self, bytes_per_ms: int = BYTES_PER_MS, keep: int = 6000):
+        self.bytes_per_ms = bytes_per_ms
+        self.keep = keep # ~10 minutes of 100 ms frames; VAD positions refer to recent audio
+        self.position_ms = 0.0
+        self._ends: list[float] = []
+        self._times: list[float] = []
+        self._lock = threading.Lock()
+
+    def add(self, nbytes: int, received_at: float) -> None:
+        with self._lock:
+            self.position_ms += nbytes / self.bytes_per_ms
+            self._ends.append(self.position_ms)
+            self._times.append(received_at)
+            if len(self._ends) > 2 * self.keep:
+                del self._ends[:-self.keep], self._times[:-self.keep]
+
+    def received_at(self, audio_ms) -> float | None:
+        if not isinstance(audio_ms, (int, float)):
+            return None
+        with self._lock:
+            i = bisect.bisect_left(self._ends, audio_ms)
+            return self._times[i] if i < len(self._times) else None
+
+class UtteranceTracker:
+    """
+    Follows the utterance in flight through the upstream events of one session.
+
+    `event` returns the debug marks for transcript events (`delta` / `done`): the utterance
+    number and the latencies known so far. Stages whose reference point is unknown (e.g. no
+    VAD event before the transcript) are left out rather than guessed.
+    """
+
+    def __init__(self, stats: LatencyStats, bytes_per_ms: int = BYTES_PER_MS):
+        self.stats = stats
+        self.clock = AudioClock(bytes_per_ms)
+        self.utterance = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self.speech_start: float | None = None
+        self.speech_end: float | None = None
+        self.first_partial: float | None = None
+
+    def frame(self, nbytes: int, received_at: float, sent_at: float) -> None:
+        self.clock.add(nbytes, received_at)
+        self.stats.observe("upstream_send", (sent_at - received_at) * 1000)
+
+    def event(self, data: dict, now: float) -> dict | None:
+        event_type = data.get("type")
+        if event_type == "input_audio_buffer.speech_started":
+            self._reset()
+            self.speech_start = self.clock.received_at(data.get("audio_start_ms")) or now
+        elif event_type == "input_audio_buffer.speech_stopped":
+            self.speech_end = self.clock.received_at(data.get("audio_end_ms")) or now
+        elif event_type == "response.audio_transcript.delta":
+            if self.first_partial is None:
+                self.first_partial = now
+                if self.speech_start is not None:
+                    self.stats.observe("first_partial", (now - self.speech_start) * 1000)
+            return self._marks(now)
+        elif event_type == "response.audio_transcript.done":
+            marks = self._marks(now)
+            if "final_ms" in marks:
+                self.stats.observe("final", marks["final_ms"])
+            self.utterance += 1
+            self._reset()
+            return marks
+        return None
+
+    def _marks(self, now: float) -> dict:
+        marks = {"utterance": self.utterance}
+        if self.speech_start is not None:
+            marks["since_speech_start_ms"] = round((now - self.speech_start) * 1000, 1)
+            if self.first_partial is not None:
+                marks["first_partial_ms"] = round((self.first_partial - self.speech_start) * 1000, 1)
+        if self.speech_end is not None:
+            marks["final_ms"] = round((now - self.speech_end) * 1000, 1)
+        return marks
+
+class SessionRecorder:
+    """
+    JSONL session capture: a header line, then one record per browser frame, browser control
+    message and upstream event, each with `t` (seconds since the session started). Upstream
+    events also record `audio_ms`, how much audio had been forwarded when they arrived.
+    """
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+        self._write({"kind": "session", "version": 1, "started_at": time.time(), **meta})
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _t(self) -> float:
+        return round(time.monotonic() - self._started, 4)
+
+    def audio(self, data: bytes) -> None:
+        self._write({"t": self._t(), "kind": "audio", "data": base64.b64encode(data).decode("ascii")})
+
+    def control(self, message: str) -> None:
+        self._write({"t": self._t(), "kind": "control", "message": message})
+
+    def upstream(self, message: str, audio_ms: float) -> None:
+        self._write({"t": self._t(), "kind": "upstream", "audio_ms": round(audio_ms, 1), "message": message})
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+def read_session(path: str) -> tuple[dict, list[dict]]:
+    """(header, records) of a file written by `SessionRecorder`."""
+    with open(path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if not lines or lines[0].get("kind") != "session":
+        raise ValueError(f"{path}: not a realtime session recording")
+    return lines[0], lines[1:]
@@ -0,0 +1,99 @@
+"""
+Bounded, token-aware conversation context for live suggestions.
+
+Recent utterances are kept verbatim in a window capped by a token budget.
+Utterances that fall out of the window are queued for compression into a
+rolling summary (done by the caller, usually an LLM call in the background),
+so the rendered prompt stays the same size however long the meeting runs.
+"""
+import threading
+import time
+from collections import deque
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: one token per CJK character, ~4 characters per token otherwise."""
+    cjk = sum(1 for ch in text if ch >= "⺀")
+    return cjk + (len(text) - cjk + 3) // 4
+
+class RollingContext:
+    def __init__(self, window_tokens: int = 600, summary_tokens: int = 300, compress_batch_tokens: int = 400):
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.compress_batch_tokens = compress_batch_tokens
+
+        self.window: deque[tuple[float, str, int]] = deque()
+        self.window_token_count = 0
+        self.pending: deque[tuple[int, str, int]] = deque() # (sequence number, text, tokens)
+        self.pending_token_count = 0
+        self._next_seq = 0
+        self.summary = ""
+        self.compressing = False
+        # Appended from the upstream websocket thread, rendered on the event loop
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.window) + len(self.pending) + (1 if self.summary else 0)
+
+    def append(self, text: str, timestamp: float | None = None) -> None:
+        tokens = estimate_tokens(text)
+        with self._lock:
+            self.window.append((timestamp or time.time(), text, tokens))
+            self.window_token_count += tokens
+            # Always keep the latest utterance, even if it alone exceeds the budget
+            while self.window_token_count > self.window_tokens and len(self.window) > 1:
+                _, old_text, old_tokens = self.window.popleft()
+                self.window_token_count -= old_tokens
+                self.pending.append((self._next_seq, old_text, old_tokens))
+                self._next_seq += 1
+                self.pending_token_count += old_tokens
+            # If compression keeps failing, drop the oldest pending text rather than grow
+            while self.pending_token_count > self.compress_batch_tokens * 4 and self.pending:
+                _, _, dropped = self.pending.popleft()
+                self.pending_token_count -= dropped
+
+    def needs_compression(self) -> bool:
+        with self._lock:
+            return not self.compressing and self.pending_token_count >= self.compress_batch_tokens
+
+    def begin_compression(self) -> tuple[str, str, int] | None:
+        """Claim the pending text for compression: returns (summary, pending_text, last claimed sequence number)."""
+        with self._lock:
+            if self.compressing or not self.pending:
+                return None
+            self.compressing = True
+            return self.summary, " ".join(text for _, text, _ in self.pending), self.pending[-1][0]
+
+    def finish_compression(self, new_summary: str | None, claimed_through: int) -> None:
+        """Install the new summary and drop the text it covers; on failure keep the pending text."""
+        with self._lock:
+            self.compressing = False
+            if new_summary is None:
+                return
+            # By sequence number: the cap in append() may have dropped claimed entries meanwhile,
+            # so counting from the front would discard newer, unsummarized text
+            while self.pending and self.pending[0][0] <= claimed_through:
+                _, _, tokens = self.pending.popleft()
+                self.pending_token_count -= tokens
+            self.summary = self.truncate(new_summary.strip(), self.summary_tokens)
+
+    def render(self) -> str:
+        with self._lock:
+            recent = " ".join(text for _, text, _ in self.window)
+            summary = self.summary
+        if summary and recent:
+            return f"（前情摘要：{summary}）{recent}"
+        return summary or recent
+
+    @staticmethod
+    def truncate(text: str, max_tokens: int) -> str:
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        # Keep the tail: it describes the most recent part of the meeting
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if estimate_tokens(text[mid:]) <= max_tokens:
+                hi = mid
+            else:
+                lo = mid + 1
+        return text[lo:]
@@ -0,0 +1,66 @@
+"""
+Passage building and tokenization for the local transcript search index (SQLite FTS5, BM25).
+
+FTS5's built-in tokenizers split on whitespace/punctuation, which treats a run of
+Chinese characters as a single token. We index overlapping character bigrams for
+CJK text (plus lower-cased words for Latin text and digits) as a space-separated
+string instead, so `unicode61` sees one term per bigram and BM25 ranks
+partial matches sensibly without an external segmenter.
+"""
+import re
+
+_TOKEN_RE = re.compile(r"[㐀-鿿豈-﫿]+|[a-zA-Z0-9]+")
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for run in _TOKEN_RE.findall(text or ""):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+def index_text(text: str) -> str:
+    return " ".join(tokenize(text))
+
+def match_query(text: str, max_terms: int = 32) -> str | None:
+    """FTS5 MATCH expression: OR of the distinct query terms (BM25 rewards documents matching more of them)."""
+    terms = list(dict.fromkeys(tokenize(text)))[:max_terms]
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+def build_passages(segments: list[dict], max_chars: int = 300, max_segments: int = 8) -> list[dict]:
+    """
+    Group consecutive segments into passages of up to `max_chars` characters.
+
+    `segments` items need `start_time`, `end_time`, `speaker` and `content`; passages
+    keep the start/end time and the speakers of the segments they cover for citations.
+    """
+    passages, current, length = [], [], 0
+    for seg in segments:
+        content = (seg.get("content") or "").strip()
+        if not content:
+            continue
+        if current and (length + len(content) > max_chars or len(current) >= max_segments):
+            passages.append(_passage(current))
+            current, length = [], 0
+        current.append(seg)
+        length += len(content)
+    if current:
+        passages.append(_passage(current))
+    return passages
+
+def _passage(segments: list[dict]) -> dict:
+    lines = [f"{seg.get('speaker') or '未知发言人'}: {seg['content'].strip()}" for seg in segments]
+    return {
+        "start_time": segments[0].get("start_time"),
+        "end_time": segments[-1].get("end_time"),
+        "segment_id": segments[0].get("id"),
+        "speakers": list(dict.fromkeys(seg.get("speaker") or "未知发言人" for seg in segments)),
+        "content": "\n".join(lines),
+    }
@@ -0,0 +1,305 @@
+"""
+Upstream call governor: rate limits, concurrency caps and retries for quota-bound APIs.
+
+One `Governor` per provider (FunASR file transcription, realtime ASR sessions, LLM):
+
+- a token bucket whose rate adapts AIMD-style: halved on 429 / throttling, cut on
+  timeouts, and recovered additively on success, so throughput settles just under
+  the quota instead of oscillating between bursts and retry storms
+- a concurrency cap with priority ordering (interactive callers go first)
+- jittered exponential retries for throttling, timeouts and 5xx, bounded by a deadline
+
+Works from threads (`call`) and from the event loop (`acall`, which never blocks the loop;
+`astream` for streaming responses, which hold their slot until closed).
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+PRIORITY_HIGH = 0 # A user is waiting on the result (chat, live suggestions, realtime connect)
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2 # Background jobs and bulk imports
+
+_default_priority = contextvars.ContextVar("upstream_priority", default=PRIORITY_NORMAL)
+
+@contextmanager
+def priority(level: int):
+    """Default priority for governed calls made inside this block (e.g. a background job)."""
+    token = _default_priority.set(level)
+    try:
+        yield
+    finally:
+        _default_priority.reset(token)
+
+def current_priority() -> int:
+    return _default_priority.get()
+
+class UpstreamError(Exception):
+    """Error from a response-style API (e.g. DashScope) that returns status codes instead of raising."""
+
+    def __init__(self, message: str, status_code: int | None = None, code: str | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+class UpstreamDeadlineExceeded(TimeoutError):
+    pass
+
+def classify_error(exc: BaseException) -> str:
+    """"throttle" / "timeout" / "transient" (retry) or "fatal" (raise immediately)."""
+    status = getattr(exc, "status_code", None)
+    code = str(getattr(exc, "code", "") or "")
+    if status == 429 or code.startswith("Throttling"):
+        return "throttle"
+    name = type(exc).__name__
+    if isinstance(exc, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    if isinstance(status, int) and status >= 500:
+        return "transient"
+    if isinstance(exc, ConnectionError) or "ConnectionError" in name or "ConnectionClosed" in name:
+        return "transient"
+    return "fatal"
+
+def _retry_after(exc: BaseException) -> float | None:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class Governor:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float | None = None,
+        max_concurrency: int = 8,
+        min_rate: float | None = None,
+        max_attempts: int = 5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ):
+        self.name = name
+        self.max_rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 20
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0 # Shared cooldown after throttling, so callers do not all retry at once
+        self._consecutive_throttles = 0
+        self._in_flight = 0
+        self._waiters: list[tuple[int, int]] = [] # (priority, ticket) heap
+        self._tickets = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "timeouts": 0, "failures": 0}
+
+    # --- admission ---
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _try_admit(self, ticket: tuple[int, int]) -> float:
+        """Admit `ticket` if it is first in line and a slot and token are free; else return a wait hint."""
+        now = time.monotonic()
+        if self._waiters[0] != ticket:
+            return 0.05
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= self.max_concurrency:
+            return 0.05
+        self._refill(now)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._in_flight += 1
+        heapq.heappop(self._waiters)
+        self._cond.notify_all() # The next waiter may now be first in line
+        return 0.0
+
+    def _enqueue(self, priority: int) -> tuple[int, int]:
+        ticket = (priority, next(self._tickets))
+        heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _abandon(self, ticket: tuple[int, int]) -> None:
+        self._waiters.remove(ticket)
+        heapq.heapify(self._waiters)
+        self._cond.notify_all()
+
+    def _acquire(self, priority: int, deadline: float | None) -> None:
+        with self._cond:
+            ticket = self._enqueue(priority)
+            while True:
+                wait = self._try_admit(ticket)
+                if wait == 0:
+                    return
+                if deadline is not None and time.monotonic() + min(wait, 0.05) > deadline:
+                    self._abandon(ticket)
+                    raise UpstreamDeadlineExceeded(f"{self.name}: deadline exceeded waiting for quota")
+                self._cond.wait(wait if deadline is None else min(wait, max(0.0, deadline - time.monotonic())))
+
+    async def _acquire_async(self, priority: int, deadline: float | None) -> None:
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket)
+                if wait == 0:
+                    return
+                if deadline is not None and time.monotonic() + min(wait, 0.05) > deadline:
+                    raise UpstreamDeadlineExceeded(f"{self.name}: deadline exceeded waiting for quota")
+                await asyncio.sleep(min(wait, 0.25))
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiters:
+                    self._abandon(ticket)
+            raise
+
+    def _release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    # --- feedback ---
+
+    def _on_success(self) -> None:
+        with self._cond:
+            self._consecutive_throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def _on_failure(self, kind: str, exc: BaseException) -> float:
+        """Adapt the rate to the failure and return the suggested backoff before the next attempt."""
+        with self._cond:
+            if kind == "throttle":
+                self.stats["throttled"] += 1
+                self._consecutive_throttles += 1
+                self._refill(time.monotonic())
+                self.rate = max(self.min_rate, self.rate * 0.5)
+                backoff = _retry_after(exc) or min(
+                    self.max_backoff, self.base_backoff * 2 ** (self._consecutive_throttles - 1)
+                )
+                self._blocked_until = max(self._blocked_until, time.monotonic() + backoff * random.uniform(0.5, 1.0))
+                return backoff
+            if kind == "timeout":
+                self.stats["timeouts"] += 1
+                self.rate = max(self.min_rate, self.rate * 0.75)
+            return self.base_backoff
+
+    def _backoff(self, attempt: int, hint: float) -> float:
+        # Full jitter (uniform in [0, cap]) spreads retries of concurrent callers apart
+        return random.uniform(0, min(self.max_backoff, max(hint, self.base_backoff * 2 ** attempt)))
+
+    # --- calls ---
+
+    def call(self, fn, *args, priority: int | None = None, deadline: float | None = None, **kwargs):
+        """Run `fn(*args, **kwargs)` under the governor; `deadline` is relative (seconds)."""
+        priority = _default_priority.get() if priority is None else priority
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        for attempt in range(self.max_attempts):
+            self._acquire(priority, deadline_at)
+            self._count("calls")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                kind = classify_error(exc)
+                delay = self._retry_delay(kind, exc, attempt, deadline_at)
+                if delay is None:
+                    raise
+            else:
+                self._on_success()
+                return result
+            finally:
+                self._release()
+            time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    async def acall(self, fn, *args, priority: int | None = None, deadline: float | None = None, **kwargs):
+        """Await `fn(*args, **kwargs)` (a coroutine function) under the governor."""
+        result = await self._acall_holding(fn, args, kwargs, priority, deadline)
+        self._release()
+        return result
+
+    @asynccontextmanager
+    async def astream(self, fn, *args, priority: int | None = None, deadline: float | None = None, **kwargs):
+        """
+        `async with governor.astream(create, ..., stream=True) as stream:` keeps the slot until
+        the stream is closed (on leaving the block), so open streams count against the cap.
+        Only opening the stream is retried; errors while iterating propagate as they are.
+        """
+        stream = await self._acall_holding(fn, args, kwargs, priority, deadline)
+        try:
+            yield stream
+        finally:
+            try:
+                await stream.close()
+            finally:
+                self._release()
+
+    async def _acall_holding(self, fn, args, kwargs, priority: int | None, deadline: float | None):
+        """`acall`, except that it returns with the slot still held; the caller releases it."""
+        priority = _default_priority.get() if priority is None else priority
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        for attempt in range(self.max_attempts):
+            await self._acquire_async(priority, deadline_at)
+            self._count("calls")
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as exc:
+                self._release()
+                kind = classify_error(exc)
+                delay = self._retry_delay(kind, exc, attempt, deadline_at)
+                if delay is None:
+                    raise
+            except BaseException: # Cancelled while opening the call
+                self._release()
+                raise
+            else:
+                self._on_success()
+                return result
+            await asyncio.sleep(delay) # Outside the slot, so a backing-off caller does not hold concurrency
+        raise RuntimeError("unreachable")
+
+    def _retry_delay(self, kind: str, exc: BaseException, attempt: int, deadline_at: float | None) -> float | None:
+        """Seconds to wait before retrying, or None to give up and re-raise."""
+        if kind == "fatal":
+            self._count("failures")
+            return None
+        delay = self._backoff(attempt, self._on_failure(kind, exc))
+        last_attempt = attempt + 1 >= self.max_attempts
+        if last_attempt or (deadline_at is not None and time.monotonic() + delay >= deadline_at):
+            self._count("failures")
+            return None
+        self._count("retries")
+        return delay
+
+    def _count(self, key: str) -> None:
+        with self._cond: # Callers run on many threads; += on a dict entry is not atomic
+            self.stats[key] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "waiting": len(self._waiters),
+                "cooldown_s": round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                **self.stats,
+            }
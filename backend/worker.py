@@ -0,0 +1,54 @@
+"""
+Standalone job worker.
+
+Claims transcription, post-processing and analysis jobs from the shared SQLite
+queue (see "Job Queue" in main.py) so heavy work can run outside the API
+process. Run the API with EMBEDDED_WORKER=0 and start as many workers as you
+have cores for:
+
+    python worker.py --processes 4 --concurrency 2
+    python worker.py --kinds analysis
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+
+def run(worker_id: str, concurrency: int, kinds: list[str] | None):
+    from main import start_worker_threads
+
+    stop_event = start_worker_threads(worker_id, concurrency=concurrency, kinds=kinds)
+    # Finish the current job on SIGTERM/SIGINT; unfinished leases expire and are retried elsewhere
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    while not stop_event.wait(1):
+        pass
+    for thread in threading.enumerate():
+        if thread.name.startswith(f"worker-{worker_id}"):
+            thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to start")
+    parser.add_argument("--concurrency", type=int, default=2, help="job threads per process")
+    parser.add_argument("--kinds", default="", help="comma separated job kinds (default: all)")
+    args = parser.parse_args()
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()] or None
+
+    if args.processes <= 1:
+        run(f"worker-{os.getpid()}", args.concurrency, kinds)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run, args=(f"worker-{os.getpid()}-{i}", args.concurrency, kinds))
+        for i in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    signal.signal(signal.SIGTERM, lambda *_: [p.terminate() for p in processes])
+    for p in processes:
+        p.join()
+
+if __name__ == "__main__":
+    main()
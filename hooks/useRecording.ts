@@ -134,7 +134,12 @@ export const useRecording = () => {
               const newSegments = [...prev];
               const lastIdx = newSegments.map(s => s.type).lastIndexOf('suggestion');
               if (lastIdx !== -1) {
-                 newSegments[lastIdx] = { ...newSegments[lastIdx], status: 'done' };
+                 if (data.cancelled) {
+                   // Speech resumed before the suggestion finished: drop it
+                   newSegments.splice(lastIdx, 1);
+                 } else {
+                   newSegments[lastIdx] = { ...newSegments[lastIdx], status: 'done' };
+                 }
               }
               return newSegments;
             });
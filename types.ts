@@ -3,6 +3,9 @@ export interface Meeting {
   id: string;
   title: string;
   host: string;
+  segmentCount?: number;
+  speakerCount?: number;
+  wordCount?: number;
   duration: string;
   durationSeconds?: number;
   time: string;